@@ -4,53 +4,69 @@
 __author__ = 'Dan Kottmann <djkottmann@gmail.com>'
 
 import os
+import sys
 import copy
+import json
 import hashlib
-import ssl
+import threading
 from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, CollectionInvalid
 from datetime import datetime
 from bson.objectid import ObjectId
 from exceptions import MissingRequiredSchemaField, ProjectDoesNotExistError, \
     IncompatibleVersionError
 import lair_models
+import throttle
+import feed
+import plan
+import mirror as project_mirror
+from throttle import DUPLICATE_KEY
 
 DRONE_LOG_HISTORY = 500
 
-# this is the document version
-# only serious changes to the lair api will update this
-VERSION = '0.1.0'
+# Size in bytes of the capped drone_log collection, shared by all projects
+DRONE_LOG_SIZE = 64 * 1024 * 1024
 
+# Maximum number of operations sent to the database in one bulk write
+BULK_WRITE_SIZE = 1000
 
-def db_connect():
-    """
-    connect to the database
+# Default number of threads api.save writes with, from LAIR_WRITERS
+WRITERS = int(os.environ.get('LAIR_WRITERS') or 1)
 
-    :return:database connection object
-    """
-    from pymongo import MongoClient, uri_parser
+# Project fields api.save may change, besides the drone log
+PROJECT_FIELDS = ('commands', 'notes', 'owner', 'industry', 'creation_date',
+                  'description')
 
-    # Connect to the database
-    if 'MONGO_URL' not in os.environ:
-        print "[***] Missing 'MONGO_URL' Environment Variable [***]"
-        raise EnvironmentError
+VALID_STATUSES = [lair_models.STATUS_GREY, lair_models.STATUS_BLUE,
+                  lair_models.STATUS_GREEN, lair_models.STATUS_ORANGE,
+                  lair_models.STATUS_RED]
 
-    mongo_options = uri_parser.parse_uri(os.environ['MONGO_URL'])
-    (host, port) = mongo_options['nodelist'][0]
+# Number of hosts or vulnerabilities committed between two checkpoints.
+# Smaller imports are not checkpointed.
+CHECKPOINT_SIZE = 500
 
-    is_ssl = mongo_options['options'].get('ssl', False)
+# this is the document version
+# only serious changes to the lair api will update this
+VERSION = '0.1.0'
 
-    print "[+] Attempting connection to database '{0}:{1}/{2}'".format(
-        host, str(port), mongo_options['database']
-    )
-    conn = MongoClient(host, port, ssl=is_ssl, ssl_cert_reqs=ssl.CERT_NONE)
-    db = conn[mongo_options['database']]
 
-    if mongo_options['username'] or mongo_options['password']:
-        db.authenticate(mongo_options['username'], mongo_options['password'])
+def db_connect(uri=None, out=None):
+    """
+    connect to the database
 
-    print "[+] Connection successful."
+    Every option of the URI is honored: all of the seeds, replicaSet,
+    readPreference, compressors, maxPoolSize, timeouts, ... The client is
+    shared by the connections to the same URI, see connection.
 
-    return db
+    Writes are kept within the budget set by LAIR_WRITE_OPS and
+    LAIR_WRITE_BYTES and transient errors are retried, see throttle.
+
+    :param uri: MongoDB connection string. Default is MONGO_URL
+    :param out: File the connection progress is reported to. Default is stdout
+    :return:database connection object
+    """
+    import connection
+    return throttle.from_environment(connection.connect(uri, out))
 
 
 def validate(document):
@@ -64,25 +80,669 @@ def validate(document):
     if 'project_id' not in document or not document['project_id']:
         raise MissingRequiredSchemaField('project_id')
 
-    # Validate command
-    if 'commands' not in document or not document['commands']:
+    # Validate command. Streamed imports (see nmap.follow_xml and
+    # raw.stream) only send it with their first batch, and number the others
+    if 'commands' not in document or \
+            (not document['commands'] and not document.get('batch')):
         raise MissingRequiredSchemaField('commands')
 
     return True
 
 
-def save(document, db, tool):
+def merge_web_directories(db, project_id, host_id, file_directories, tool):
+    """Merge a host's parsed web directories with the ones already stored.
+    The existing directories are loaded with a single query.
+
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param host_id: The _id of the host the directories belong to
+    :param file_directories: The web directories parsed from the scan
+    :param tool: The tool that produced the scan
+    :return: List of ('insert', document) and ('replace', document) tuples
+             for new and changed directories, see throttle.write_documents
+    """
+
+    known = dict()
+    q = {'project_id': project_id, 'host_id': host_id}
+    for directory in db.web_directories.find(q):
+        key = (directory['path_clean'], directory['port'],
+               directory['response_code'])
+        known[key] = directory
+
+    ops = list()
+    for file_directory in file_directories:
+        key = (file_directory['path_clean'], file_directory['port'],
+               file_directory['response_code'])
+
+        directory = known.get(key)
+        is_known_directory = directory is not None
+        if not is_known_directory:
+            directory = copy.deepcopy(lair_models.web_directory_model)
+
+        updated = dict(directory)
+        updated['project_id'] = project_id
+        updated['host_id'] = host_id
+        updated['path'] = file_directory['path']
+        updated['path_clean'] = file_directory['path_clean']
+        updated['port'] = file_directory['port']
+        updated['response_code'] = file_directory['response_code']
+
+        if is_known_directory and updated == directory:
+            continue
+
+        updated['last_modified_by'] = tool
+        if is_known_directory:
+            ops.append(('replace', updated))
+        else:
+            updated['_id'] = str(ObjectId())
+            ops.append(('insert', updated))
+        known[key] = updated
+
+    return ops
+
+
+def ensure_drone_log(db, collection_names=None):
+    """Creates the capped drone_log collection if it does not exist yet
+
+    :param db: A connection to the target Lair database
+    :param collection_names: Names of the existing collections, if known
+    """
+    if collection_names is None:
+        collection_names = db.collection_names()
+    if 'drone_log' not in collection_names:
+        try:
+            db.create_collection('drone_log', capped=True, size=DRONE_LOG_SIZE)
+        except CollectionInvalid:
+            # Created by another drone in the meantime
+            pass
+
+
+def _utf8(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else str(value)
+
+
+def write_drone_log(db, project_id, entries):
+    """Appends entries to a project's drone log with a single bulk insert.
+    Each entry's _id is derived from the project, an id of the write, the
+    entry's position and its text, so a retried insert of the same
+    documents is a no-op and identical entries are all kept.
+
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param entries: List of log entries
+    """
+    if not entries:
+        return
+    created = datetime.utcnow()
+    # Hashed as bytes, the project id read from the database is unicode and
+    # the entries are UTF-8 encoded. The write id tells apart identical
+    # entries written by other calls.
+    prefix = '{0}\n{1}'.format(_utf8(project_id), ObjectId())
+    documents = list()
+    for seq, entry in enumerate(entries):
+        key = '\n'.join([prefix, str(seq), _utf8(entry)])
+        documents.append({
+            '_id': hashlib.sha1(key).hexdigest(),
+            'project_id': project_id,
+            'created': created,
+            'seq': seq,
+            'entry': entry,
+        })
+    try:
+        db.drone_log.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        # Entries already written by an interrupted run
+        if any(error.get('code') != DUPLICATE_KEY
+               for error in e.details.get('writeErrors', [])):
+            raise
+
+
+def get_drone_log(db, project_id, limit=DRONE_LOG_HISTORY):
+    """Reads the latest entries of a project's drone log
+
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param limit: Maximum number of entries
+    :return: List of entries, oldest first
+    """
+    cursor = db.drone_log.find({'project_id': project_id}, {'entry': 1}) \
+        .sort([('created', DESCENDING), ('seq', DESCENDING)]).limit(limit)
+    return [document['entry'] for document in cursor][::-1]
+
+
+def _extend_unique(items, new_items):
+    # Extends a list with the items it does not already hold, so that
+    # replaying part of an import does not duplicate them
+    for item in new_items:
+        if item not in items:
+            items.append(item)
+
+
+def import_key(document, tool):
+    """Identifies an import, so that an interrupted save of the same document
+    can be resumed
+
+    :param document: A complete representation of the project model
+    :param tool: The tool that produced the document
+    :return: Hex digest of the document content
+    """
+    content = {
+        'tool': tool,
+        'project_id': document['project_id'],
+        'commands': document['commands'],
+        'hosts': document['hosts'],
+        'vulnerabilities': document.get('vulnerabilities', []),
+    }
+    # Only a stable digest is needed, any byte string decodes as latin-1
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str,
+                                   encoding='latin-1')).hexdigest()
+
+
+def _save_host(db, project_id, file_host, tool, web_directories,
+               directory_ops, changes=None, mirror=None):
+    """Merges a parsed host and its ports with the stored ones
+
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param file_host: The host parsed from the scan
+    :param tool: The tool that produced the scan
+    :param web_directories: Whether web directories are supported
+    :param directory_ops: List of pending web directory writes, see
+                          merge_web_directories, flushed every
+                          BULK_WRITE_SIZE
+    :param changes: List the changes to the host and its ports are added
+                    to, see feed. Default is not to track them
+    :param mirror: Mirror of the project, whose prefetched documents are
+                   used instead of querying for each host and port
+    :return: List of drone log entries
+    """
+    log = list()
+
+    is_known_host = True
+    if mirror is not None:
+        host = mirror.stored_host(file_host['string_addr'])
+    else:
+        host = db.hosts.find_one({'project_id': project_id, 'string_addr': file_host['string_addr']})
+    if not host:
+        is_known_host = False
+        host = copy.deepcopy(lair_models.host_model)
+    before = copy.deepcopy(host) if changes is not None else None
+
+    pre_md5 = hashlib.md5()
+    pre_md5.update(str(host))
+
+    host['project_id'] = project_id
+    host['alive'] = file_host['alive']
+    host['string_addr' ] = file_host['string_addr']
+    host['long_addr'] = file_host['long_addr']
+    host['is_profiled'] = file_host.get('is_profiled', False)
+    host['is_enumerated'] = file_host.get('is_enumerated', False)
+
+    # Include any host notes
+    if file_host['notes']:
+        _extend_unique(host['notes'], file_host['notes'])
+
+    # Add hostnames
+    if len(file_host['hostnames']) > 0:
+        # Only update if new host names were identified
+        if not set(file_host['hostnames']).issubset(host['hostnames']):
+            host['hostnames'].extend(file_host['hostnames'])
+            host['hostnames'] = list(set(host['hostnames']))
+            host['last_modified_by'] = tool
+
+    # Update MAC address if it's not set already
+    if not host['mac_addr']:
+        host['mac_addr'] = file_host['mac_addr']
+
+    # Add the operating system
+    if file_host['os']:
+        os_list = []
+        # The following ensures that no duplicate entries are
+        # added to the database.
+        for file_os in file_host['os']:
+            dupe_found = False
+            for db_os in host['os']:
+                if db_os['tool'] == file_os['tool'] and \
+                   db_os['fingerprint'] == \
+                   file_os['fingerprint']:
+                    dupe_found = True
+
+            if not dupe_found:
+                os_list.append(file_os)
+                host['last_modified_by'] = tool
+
+        host['os'].extend(os_list)
+
+    post_md5 = hashlib.md5()
+    post_md5.update(str(host))
+
+    # Only save if changes were detected
+    if pre_md5 != post_md5:
+        host['last_modified_by'] = tool
+        if not is_known_host:
+            id = str(ObjectId())
+            host['_id'] = id
+            s = file_host.get('status', lair_models.STATUS_GREY)
+            host['status'] = s if s in VALID_STATUSES else lair_models.STATUS_GREY
+
+        db.hosts.save(host)
+
+    if mirror is not None:
+        mirror.saved_host(host)
+
+    if not is_known_host:
+        now = datetime.utcnow().isoformat()
+        log.append("{0} - New host found: {1}".format(
+            now,
+            file_host['string_addr'])
+        )
+
+    if changes is not None:
+        if not is_known_host:
+            changes.append(feed.host_change('new', host))
+        else:
+            fields = feed.changed_fields(before, host)
+            if fields:
+                changes.append(feed.host_change('updated', host, fields))
+
+    # Process each web directory for the host, checking against existing dirs
+    if web_directories and 'web_directories' in file_host:
+        directory_ops.extend(merge_web_directories(
+            db, project_id, host['_id'], file_host['web_directories'], tool))
+        if len(directory_ops) >= BULK_WRITE_SIZE:
+            throttle.write_documents(db.web_directories, directory_ops)
+            del directory_ops[:]
+
+    # Process each port for the host, checking against known ports
+    for file_port in file_host['ports']:
+
+        q = {
+            'project_id': project_id,
+            'host_id': host['_id'],
+            'port': file_port['port'],
+            'protocol': file_port['protocol']
+        }
+        if mirror is not None:
+            port = mirror.stored_port(host['_id'], file_port['port'],
+                                      file_port['protocol'])
+        else:
+            port = db.ports.find_one(q)
+
+        is_known_port = False
+        if port:
+            is_known_port = True
+        else:
+            port = copy.deepcopy(lair_models.port_model)
+        before = copy.deepcopy(port) if changes is not None else None
+
+        pre_md5 = hashlib.md5()
+        pre_md5.update(str(port))
+
+        port['host_id'] = host['_id']
+        port['project_id'] = project_id
+        port['protocol'] = file_port['protocol']
+        port['port'] = file_port['port']
+
+        # TODO: Determine how to handle a closed port
+        port['alive'] = file_port['alive']
+
+        # Update product if it is unknown
+        if port['product'] == lair_models.PRODUCT_UNKNOWN:
+            port['product'] = file_port['product']
+
+        # Set the service if it is not set
+        if not port['service'] or port['service'] == 'unknown':
+            port['service'] = file_port['service']
+
+        # Include any script output for the port
+        if file_port['notes']:
+            _extend_unique(port['notes'], file_port['notes'])
+
+        # Include any credentials
+        if file_port['credentials']:
+            _extend_unique(port['credentials'], file_port['credentials'])
+
+        if not is_known_port:
+            id = str(ObjectId())
+            port['_id'] = id
+            s = file_port.get('status', lair_models.STATUS_GREY)
+            port['status'] = s if s in VALID_STATUSES else lair_models.STATUS_GREY
+            now = datetime.utcnow().isoformat()
+            log.append("{0} - New port found: {1}/{2} ({3})".format(
+                now,
+                str(file_port['port']),
+                file_port['protocol'],
+                file_port['service'])
+            )
+
+        post_md5 = hashlib.md5()
+        post_md5.update(str(port))
+
+        if pre_md5 != post_md5:
+            port['last_modified_by'] = tool
+            db.ports.save(port)
+
+        if mirror is not None:
+            mirror.saved_port(port)
+
+        if changes is not None:
+            if not is_known_port:
+                changes.append(feed.port_change('new', host, port))
+            else:
+                fields = feed.changed_fields(before, port)
+                if fields:
+                    changes.append(feed.port_change('updated', host, port,
+                                                    fields))
+
+    return log
+
+
+def _save_vulnerability(db, project_id, file_vuln, tool, changes=None,
+                        mirror=None):
+    """Merges a parsed vulnerability with the stored one, if any
+
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param file_vuln: The vulnerability parsed from the scan
+    :param tool: The tool that produced the scan
+    :param changes: List the change to the vulnerability is added to, see
+                    feed. Default is not to track it
+    :param mirror: Mirror of the project, whose prefetched documents are
+                   used instead of querying for the vulnerability
+    :return: List of drone log entries
+    """
+    log = list()
+
+    is_known_vuln = False
+
+    # Attempt a lookup by plugin_id, matching each one on its fields so the
+    # plugin_ids.id index can serve the query
+    q = {
+        'project_id': project_id,
+        'plugin_ids': {'$all': [
+            {'$elemMatch': {'tool': plugin['tool'], 'id': plugin['id']}}
+            for plugin in file_vuln['plugin_ids']
+        ]}
+    }
+    if mirror is not None:
+        db_vuln = mirror.stored_vulnerability(file_vuln['plugin_ids'])
+    else:
+        db_vuln = db.vulnerabilities.find_one(q)
+
+    if db_vuln:
+        is_known_vuln = True
+
+    # No vuln found by plugin_id, treat as new
+    if not is_known_vuln:
+        db_vuln = copy.deepcopy(file_vuln)
+        id = str(ObjectId())
+        s = file_vuln.get('status', lair_models.STATUS_GREY)
+        db_vuln['status'] = s if s in VALID_STATUSES else lair_models.STATUS_GREY
+        db_vuln['_id'] = id
+        db_vuln['project_id'] = project_id
+        db_vuln['last_modified_by'] = tool
+        now = datetime.utcnow().isoformat()
+        log.append("{0} - New vulnerability found: {1}".format(
+            now,
+            file_vuln['title'].encode("utf-8"))
+        )
+        db.vulnerabilities.save(db_vuln)
+        if changes is not None:
+            changes.append(feed.vulnerability_change(
+                'new', db_vuln, db_vuln['hosts']))
+
+    if is_known_vuln:
+        before = copy.deepcopy(db_vuln) if changes is not None else None
+        hosts_added = list()
+
+        pre_md5 = hashlib.md5()
+        pre_md5.update(str(db_vuln))
+
+        db_vuln['cves'].extend(file_vuln['cves'])
+        db_vuln['cves'] = list(set(db_vuln['cves']))
+        _extend_unique(db_vuln['identified_by'], file_vuln['identified_by'])
+
+        # Only set 'flag' if it's true for parsed vuln
+        db_vuln['flag'] = file_vuln['flag'] \
+            if file_vuln.get('flag', False) else db_vuln.get('flag', False)
+
+        # Include any script output for the port
+        if file_vuln['notes']:
+            _extend_unique(db_vuln['notes'], file_vuln['notes'])
+
+        for file_host in file_vuln['hosts']:
+            if file_host not in db_vuln['hosts']:
+                db_vuln['hosts'].append(file_host)
+                hosts_added.append(file_host)
+                now = datetime.utcnow().isoformat()
+                log.append("{0} - {1}:{2}/{3} - New vulnerability found: {4}".format(
+                    now,
+                    file_host['string_addr'],
+                    str(file_host['port']),
+                    file_host['protocol'],
+                    file_vuln['title'])
+                )
+
+        post_md5 = hashlib.md5()
+        post_md5.update(str(db_vuln))
+
+        # Vulnerability was known, but change was detected
+        if pre_md5 != post_md5:
+            db_vuln['last_modified_by'] = tool
+            db.vulnerabilities.save(db_vuln)
+
+        if changes is not None:
+            fields = feed.changed_fields(before, db_vuln)
+            if fields:
+                changes.append(feed.vulnerability_change(
+                    'updated', db_vuln, hosts_added, fields))
+
+    if mirror is not None:
+        mirror.saved_vulnerability(db_vuln)
+
+    return log
+
+
+def partition_hosts(hosts, indexes, count):
+    """Splits hosts into at most count contiguous long_addr ranges. A host
+    and its ports are written by a single worker, and the entries for the
+    same address always fall in the same range.
+
+    :param hosts: List of parsed hosts
+    :param indexes: Indexes of the hosts to split
+    :param count: Maximum number of ranges
+    :return: List of lists of indexes, in long_addr order
+    """
+    ordered = sorted(indexes, key=lambda i: hosts[i]['long_addr'])
+    size = max(1, -(-len(ordered) // count))
+    partitions = list()
+    start = 0
+    while start < len(ordered):
+        end = min(start + size, len(ordered))
+        # Don't split the entries for one address
+        while end < len(ordered) and \
+                hosts[ordered[end]]['long_addr'] == hosts[ordered[end - 1]]['long_addr']:
+            end += 1
+        partitions.append(ordered[start:end])
+        start = end
+    return partitions
+
+
+def _plugin_key(plugin_id):
+    return tuple(sorted(plugin_id.items())) if isinstance(plugin_id, dict) else plugin_id
+
+
+def stored_vulnerability_ids(db, project_id, vulns, indexes, mirror=None):
+    """Finds the stored vulnerabilities each parsed one may be merged with,
+    the ones that have all of its plugin ids. They are read with a single
+    query, or from the mirror.
+
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param vulns: List of parsed vulnerabilities
+    :param indexes: Indexes of the vulnerabilities to look up
+    :param mirror: Mirror of the project, used instead of querying
+    :return: Dict of index to the set of stored vulnerability ids
+    """
+    if mirror is not None:
+        return dict((i, mirror.candidates(vulns[i]['plugin_ids']))
+                    for i in indexes)
+
+    ids = set(plugin['id'] for i in indexes for plugin in vulns[i]['plugin_ids'])
+    if not ids:
+        return dict((i, set()) for i in indexes)
+
+    # (tool, id) -> ids of the stored vulnerabilities with that plugin id
+    stored = dict()
+    q = {'project_id': project_id, 'plugin_ids.id': {'$in': list(ids)}}
+    for vuln in db.vulnerabilities.find(q, {'plugin_ids': 1}):
+        for plugin in vuln['plugin_ids']:
+            stored.setdefault((plugin['tool'], plugin['id']), set()).add(vuln['_id'])
+
+    found = dict()
+    for i in indexes:
+        matches = [stored.get((plugin['tool'], plugin['id']), set())
+                   for plugin in vulns[i]['plugin_ids']]
+        found[i] = set.intersection(*matches) if matches else set()
+    return found
+
+
+def partition_vulnerabilities(vulns, indexes, count, stored=None):
+    """Splits vulnerabilities into at most count groups. Vulnerabilities
+    sharing a plugin id, or that may be merged with the same stored
+    document, are always written by the same worker, in document order.
+    Without stored, vulnerabilities with different plugin ids that match
+    one stored document (e.g. [A] and [B] both match [A, B]) may be split,
+    and one of the updates lost.
+
+    :param vulns: List of parsed vulnerabilities
+    :param indexes: Indexes of the vulnerabilities to split
+    :param count: Maximum number of groups
+    :param stored: Dict of index to the ids of the stored vulnerabilities
+                   it may be merged with, see stored_vulnerability_ids
+    :return: List of lists of indexes
+    """
+    # Union-find over the plugin ids and stored ids of each vulnerability
+    parent = dict()
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, key, owner):
+        if key in owner:
+            parent[find(i)] = find(owner[key])
+        else:
+            owner[key] = i
+
+    plugin_owner = dict()
+    stored_owner = dict()
+    for i in indexes:
+        parent[i] = i
+        for plugin_id in vulns[i]['plugin_ids']:
+            union(i, _plugin_key(plugin_id), plugin_owner)
+        for _id in (stored or {}).get(i, ()):
+            union(i, _id, stored_owner)
+
+    groups = dict()
+    for i in indexes:
+        groups.setdefault(find(i), list()).append(i)
+
+    # Largest groups first, each to the least loaded partition
+    partitions = [list() for n in range(min(count, len(groups)))]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        min(partitions, key=len).extend(group)
+    for partition in partitions:
+        partition.sort()
+    return partitions
+
+
+def _run_partitions(partitions, work):
+    # Runs work(partition) on a thread per partition and re-raises the
+    # first error once they have all finished
+    if len(partitions) <= 1:
+        for partition in partitions:
+            work(partition)
+        return
+
+    errors = list()
+
+    def run(partition):
+        try:
+            work(partition)
+        except Exception:
+            errors.append(sys.exc_info())
+
+    threads = list()
+    for partition in partitions:
+        thread = threading.Thread(target=run, args=(partition,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+
+def save(document, db, tool, writers=None, sink=None, mirror=None):
     """Save the project details in the Lair database.
 
+    Large imports are checkpointed in the drone_checkpoints collection
+    every CHECKPOINT_SIZE hosts and vulnerabilities, along with the drone
+    log entries not saved yet. If the save is interrupted, saving the same
+    document again resumes after the last checkpoint, except in a dry run,
+    which plans the whole import. Writes are idempotent, so replaying the
+    hosts or vulnerabilities processed after it is safe, but the log
+    entries of the ones written since it are not recovered.
+
+    Drone log entries are written to the capped drone_log collection as
+    they are committed. The project document only keeps the last
+    DRONE_LOG_HISTORY entries, for compatibility, and is updated in place
+    rather than rewritten.
+
+    With a mirror of the project, the stored documents are fetched a
+    chunk at a time rather than one at a time, and the hosts and
+    vulnerabilities that did not change since they were last imported
+    are skipped.
+
+    Hosts and vulnerabilities can be written by several threads. Hosts are
+    split by long_addr range, so a host and its ports are always written
+    by the same thread, and vulnerabilities sharing a plugin id or merged
+    into the same stored vulnerability are written by the same thread, see
+    partition_vulnerabilities.
+
+    The new and updated hosts, ports and vulnerabilities are published to
+    sink as a change set, see feed, once they are committed: at the end of
+    the import and at every checkpoint. A checkpoint keeps its changes
+    until they are published, and a resumed import publishes them first,
+    so one may be published twice if the import stopped right after
+    publishing it. The changes of the writes made since the last
+    checkpoint, or by an import too small to be checkpointed, are lost if
+    the import is interrupted: the replayed writes no longer change
+    anything. Delivery is at-most-once for those.
+
     :param document: A complete representation of the project model
     :param db: A connection to the target Lair database
+    :param tool: The tool that produced the document
+    :param writers: Number of writer threads. Default is WRITERS
+    :param sink: Function called with each change set. Default is the
+                 LAIR_CHANGE_FEED file, if set. None for a dry run
+    :param mirror: Local mirror of the project's keys, see mirror. Default
+                   is the one in the LAIR_MIRROR directory, if set; False
+                   for none. None for a dry run
     :raise: MissingRequiredSchemaField, ProjectDoesNotExistError
     """
 
     has_errors = False
-    valid_statuses = [lair_models.STATUS_GREY, lair_models.STATUS_BLUE,
-                      lair_models.STATUS_GREEN, lair_models.STATUS_ORANGE,
-                      lair_models.STATUS_RED]
+    writers = max(1, writers or WRITERS)
+
+    throttled = db if isinstance(db, throttle.ThrottledDB) else None
+    if throttled is not None:
+        waited, retried = throttled.waited, throttled.retried
 
     # Validate compatible versions
     version = db.versions.find_one()
@@ -94,7 +754,10 @@ def save(document, db, tool):
 
     print "[+] Processing project {0}".format(document['project_id'])
 
+    # Log entries not written to the drone_log collection yet, and the
+    # latest ones written by this import
     temp_drone_log = list()
+    recent_drone_log = list()
 
     q = {'_id': document['project_id']}
 
@@ -103,12 +766,13 @@ def save(document, db, tool):
         raise ProjectDoesNotExistError(document['project_id'])
 
     project = db.projects.find_one(q)
+    project_fields = set(project)
 
     # Add the command
     project['commands'].extend(document['commands'])
 
     # Add project notes
-    project['notes'].extend(document['notes'])
+    _extend_unique(project['notes'], document['notes'])
 
     # Add the owner if it isn't already set
     if 'owner' not in project or not project['owner']:
@@ -136,283 +800,425 @@ def save(document, db, tool):
         now = datetime.utcnow().isoformat()
         temp_drone_log.append("{0} - Initial project load".format(now))
 
-    # Create indexes
-    db.hosts.ensure_index([
-        ('project_id', ASCENDING),
-        ('string_addr', ASCENDING)
-    ])
-    db.ports.ensure_index([
-        ('project_id', ASCENDING),
-        ('host_id', ASCENDING),
-        ('port', ASCENDING),
-        ('protocol', ASCENDING)
-    ])
-    db.vulnerabilities.ensure_index([
-        ('project_id', ASCENDING),
-        ('plugin_ids', ASCENDING)
-    ])
+    hosts = document['hosts']
+    vulns = document.get('vulnerabilities', [])
+    # A dry run changes nothing, so it has no changes to publish, and the
+    # ids it plans must not end up in the mirror. It plans a whole import,
+    # even if an earlier one was interrupted.
+    dry_run = isinstance(db, plan.Plan)
+
+    checkpoint = None
+    if len(hosts) > CHECKPOINT_SIZE or len(vulns) > CHECKPOINT_SIZE:
+        key = import_key(document, tool)
+        if not dry_run:
+            checkpoint = db.drone_checkpoints.find_one({'_id': key})
+        if checkpoint:
+            print "[+] Resuming import after {0} host(s) and {1} vulnerabilities".format(
+                checkpoint['hosts'], checkpoint['vulnerabilities'])
+            del temp_drone_log[:]
+            recent_drone_log.extend(checkpoint['drone_log'])
+        else:
+            checkpoint = {
+                '_id': key,
+                'project_id': project['_id'],
+                'tool': tool,
+                'hosts': 0,
+                'vulnerabilities': 0,
+            }
+
+    # Changes not published yet. A resumed import keeps the run id.
+    if dry_run:
+        sink = None
+    elif sink is None:
+        sink = feed.from_environment()
+    change_set = None
+    if sink is not None:
+        change_set = feed.ChangeSet(project['_id'], tool,
+                                    checkpoint['_id'] if checkpoint else None)
+        # Committed before the import was interrupted, maybe not published
+        if checkpoint and checkpoint.get('changes'):
+            change_set.extend(checkpoint['changes'])
+
+    def flush_drone_log():
+        write_drone_log(db, project['_id'], temp_drone_log)
+        recent_drone_log.extend(temp_drone_log)
+        del recent_drone_log[:-DRONE_LOG_HISTORY]
+        del temp_drone_log[:]
+
+    def publish(complete):
+        # Tells if there were changes to publish
+        if change_set is not None and (change_set.changes or complete):
+            published = bool(change_set.changes)
+            sink(change_set.pop(complete))
+            return published
+        return False
+
+    def commit(host_count, vuln_count):
+        # Records the progress once the writes before it have completed
+        if checkpoint is None:
+            return
+        flush_drone_log()
+        checkpoint['hosts'] = host_count
+        checkpoint['vulnerabilities'] = vuln_count
+        checkpoint['drone_log'] = recent_drone_log
+        # Kept until they are published, see the resume above
+        checkpoint['changes'] = list(change_set.changes) \
+            if change_set is not None else list()
+        checkpoint['updated'] = datetime.utcnow().isoformat()
+        db.drone_checkpoints.save(checkpoint)
+        if publish(False):
+            checkpoint['changes'] = list()
+            db.drone_checkpoints.update_one({'_id': checkpoint['_id']},
+                                            {'$set': {'changes': list()}})
+
+    host_start = checkpoint['hosts'] if checkpoint else 0
+    vuln_start = checkpoint['vulnerabilities'] if checkpoint else 0
+
+    if dry_run:
+        mirror = None
+    elif mirror is None:
+        mirror = project_mirror.from_environment(db, project['_id'])
+    if mirror:
+        fetched = mirror.refresh(db)
+        print "[+] Mirror refreshed, fetched the keys of {0} document(s).".format(fetched)
+    else:
+        mirror = None
+    skipped = 0
+
+    # Indexes are built once per database by 'drone-db init'
+    collection_names = db.collection_names()
+    ensure_drone_log(db, collection_names)
+
+    # Web directory support is checked once, if any host has some
+    web_directories_supported = False
+    if any('web_directories' in file_host for file_host in hosts[host_start:]):
+        web_directories_supported = 'web_directories' in collection_names
+        if not web_directories_supported:
+            has_errors = True
+            print "[!] Your version of Lair does not support the addition of web directories."
+            print "[!] Please check the Lair project on GitHub for more information (https://github.com/lair-framework/lair)."
+
+    # Hosts and vulnerabilities are written a chunk at a time, split among
+    # the writers. A chunk is committed once all of its writes completed.
+    chunk_size = CHECKPOINT_SIZE if checkpoint is not None else \
+        max(1, len(hosts), len(vulns))
 
     # For each host in the parsed scan, check to see if it already
     # exists in the database.
-    for file_host in document['hosts']:
+    for start in xrange(host_start, len(hosts), chunk_size):
+        end = min(start + chunk_size, len(hosts))
+        logs = [list() for i in range(end - start)]
+        found = [list() if change_set is not None else None
+                 for i in range(end - start)]
+
+        # Hosts imported before are skipped, the others are fetched at once
+        indexes = range(start, end)
+        if mirror is not None:
+            digests = dict((i, project_mirror.digest(hosts[i])) for i in indexes)
+            indexes = [i for i in indexes
+                       if not mirror.unchanged_host(hosts[i], digests[i])]
+            skipped += end - start - len(indexes)
+            mirror.prefetch(db, hosts=[hosts[i] for i in indexes])
+
+        def save_hosts(indexes):
+            directory_ops = list()
+            for index in indexes:
+                logs[index - start] = _save_host(
+                    db, project['_id'], hosts[index], tool,
+                    web_directories_supported, directory_ops,
+                    found[index - start], mirror)
+            if directory_ops:
+                throttle.write_documents(db.web_directories, directory_ops)
+
+        _run_partitions(partition_hosts(hosts, indexes, writers),
+                        save_hosts)
+
+        if mirror is not None:
+            for i in indexes:
+                mirror.imported_host(hosts[i], digests[i])
+
+        # Log entries and changes are kept in document order
+        for log in logs:
+            temp_drone_log.extend(log)
+        if change_set is not None:
+            for changes in found:
+                change_set.extend(changes)
+        commit(end, vuln_start)
 
-        is_known_host = True
-        host = db.hosts.find_one({'project_id': project['_id'], 'string_addr': file_host['string_addr']})
-        if not host:
-            is_known_host = False
-            host = copy.deepcopy(lair_models.host_model)
+    # For each vulnerability in the parsed scan, check to see if it already
+    # exists in the database.
+    for start in xrange(vuln_start, len(vulns), chunk_size):
+        end = min(start + chunk_size, len(vulns))
+        logs = [list() for i in range(end - start)]
+        found = [list() if change_set is not None else None
+                 for i in range(end - start)]
+
+        indexes = range(start, end)
+        if mirror is not None:
+            digests = dict((i, project_mirror.digest(vulns[i])) for i in indexes)
+            indexes = [i for i in indexes
+                       if not mirror.unchanged_vulnerability(vulns[i], digests[i])]
+            skipped += end - start - len(indexes)
+            mirror.prefetch(db, vulns=[vulns[i] for i in indexes])
+
+        def save_vulnerabilities(indexes):
+            for index in indexes:
+                logs[index - start] = _save_vulnerability(
+                    db, project['_id'], vulns[index], tool,
+                    found[index - start], mirror)
+
+        # Only needed to split the chunk between writers
+        stored = None
+        if writers > 1 and len(indexes) > 1:
+            stored = stored_vulnerability_ids(db, project['_id'], vulns,
+                                              indexes, mirror)
+        _run_partitions(
+            partition_vulnerabilities(vulns, indexes, writers, stored),
+            save_vulnerabilities)
+
+        if mirror is not None:
+            for i in indexes:
+                mirror.imported_vulnerability(vulns[i], digests[i])
+
+        for log in logs:
+            temp_drone_log.extend(log)
+        if change_set is not None:
+            for changes in found:
+                change_set.extend(changes)
+        commit(len(hosts), end)
+
+    flush_drone_log()
+
+    # Update the project in place. The copy of the drone log it keeps is
+    # limited to DRONE_LOG_HISTORY entries; entries already added by an
+    # interrupted run of the same import are skipped.
+    update = {'$set': dict((field, project[field]) for field in PROJECT_FIELDS)}
+    for field in ('hosts', 'vulnerabilities'):
+        if field not in project_fields:
+            update['$set'][field] = project[field]
+    logged = set(project.get('drone_log', []))
+    new_entries = [entry for entry in recent_drone_log if entry not in logged]
+    if new_entries:
+        update['$push'] = {'drone_log': {
+            '$each': new_entries,
+            '$slice': -DRONE_LOG_HISTORY
+        }}
+    db.projects.update_one({'_id': project['_id']}, update)
+
+    publish(True)
+
+    if checkpoint is not None:
+        db.drone_checkpoints.delete_one({'_id': checkpoint['_id']})
+
+    if mirror is not None:
+        mirror.save()
+        if skipped:
+            print "[+] Skipped {0} host(s) and vulnerabilities unchanged since the last import.".format(skipped)
+
+    if throttled is not None and (throttled.waited > waited or
+                                  throttled.retried > retried):
+        print "[+] Waited {0:.1f}s on the write budget, retried {1} operation(s).".format(
+            throttled.waited - waited, throttled.retried - retried)
 
-        pre_md5 = hashlib.md5()
-        pre_md5.update(str(host))
-
-        host['project_id'] = project['_id']
-        host['alive'] = file_host['alive']
-        host['string_addr' ] = file_host['string_addr']
-        host['long_addr'] = file_host['long_addr']
-        host['is_profiled'] = file_host.get('is_profiled', False)
-        host['is_enumerated'] = file_host.get('is_enumerated', False)
-
-        # Include any host notes
-        if file_host['notes']:
-            host['notes'].extend(file_host['notes'])
-
-        # Add hostnames
-        if len(file_host['hostnames']) > 0:
-            # Only update if new host names were identified
-            if not set(file_host['hostnames']).issubset(host['hostnames']):
-                host['hostnames'].extend(file_host['hostnames'])
-                host['hostnames'] = list(set(host['hostnames']))
-                host['last_modified_by'] = tool
+    if not has_errors:
+        print "[+] Processing completed: {0} host(s) processed.".format(
+            str(len(document['hosts'])))
+    else:
+        print "[!] Could not process this drone's data. See above for any error messages."
 
-        # Update MAC address if it's not set already
-        if not host['mac_addr']:
-            host['mac_addr'] = file_host['mac_addr']
-
-        # Add the operating system
-        if file_host['os']:
-            os_list = []
-            # The following ensures that no duplicate entries are
-            # added to the database.
-            for file_os in file_host['os']:
-                dupe_found = False
-                for db_os in host['os']:
-                    if db_os['tool'] == file_os['tool'] and \
-                       db_os['fingerprint'] == \
-                       file_os['fingerprint']:
-                        dupe_found = True
-
-                if not dupe_found:
-                    os_list.append(file_os)
-                    host['last_modified_by'] = tool
-
-            host['os'].extend(os_list)
 
-        post_md5 = hashlib.md5()
-        post_md5.update(str(host))
+# Number of documents fetched per round trip by the read API
+READ_BATCH_SIZE = 500
 
-        # Only save if changes were detected
-        if pre_md5 != post_md5:
-            host['last_modified_by'] = tool
-            if not is_known_host:
-                id = str(ObjectId())
-                host['_id'] = id
-                s = file_host.get('status', lair_models.STATUS_GREY)
-                host['status'] = s if s in valid_statuses else lair_models.STATUS_GREY
 
-            db.hosts.save(host)
+def projection(fields, required=()):
+    """Builds a find() projection
 
-        if not is_known_host:
-            now = datetime.utcnow().isoformat()
-            temp_drone_log.append("{0} - New host found: {1}".format(
-                now,
-                file_host['string_addr'])
-            )
+    :param fields: Field names to return, or None for whole documents
+    :param required: Field names always returned, e.g. join keys
+    :return: Projection dictionary, or None for whole documents
+    """
+    if fields is None:
+        return None
+    return dict((field, 1) for field in set(fields) | set(required))
 
-        # Process each web directory for the host, checking against existing dirs
-        if 'web_directories' in file_host:
-            # Check if web directories are supported by the remote Lair server.
-            if 'web_directories' in db.collection_names():
-                for file_directory in file_host['web_directories']:
-                    q = {
-                        'project_id': project['_id'],
-                        'host_id': host['_id'],
-                        'path_clean': file_directory['path_clean'],
-                        'port': file_directory['port'],
-                        'response_code': file_directory['response_code'],
-                    }
-                    directory = db.web_directories.find_one(q)
-
-                    is_known_directory = False
-                    if directory:
-                        is_known_directory = True
-                    else:
-                        directory = copy.deepcopy(lair_models.web_directory_model)
-
-                    pre_md5 = hashlib.md5()
-                    pre_md5.update(str(directory))
-
-                    directory['project_id'] = project['_id']
-                    directory['host_id'] = host['_id']
-                    directory['path'] = file_directory['path']
-                    directory['path_clean'] = file_directory['path_clean']
-                    directory['port'] = file_directory['port']
-                    directory['response_code'] = file_directory['response_code']
-
-                    post_md5 = hashlib.md5()
-                    post_md5.update(str(directory))
-
-                    if pre_md5 != post_md5:
-                        directory['last_modified_by'] = tool
-                        if not is_known_directory:
-                            id = str(ObjectId())
-                            directory['_id'] = id
-                        db.web_directories.save(directory)
-            else:
-                has_errors = True
-                print "[!] Your version of Lair does not support the addition of web directories."
-                print "[!] Please check the Lair project on GitHub for more information (https://github.com/lair-framework/lair)."
 
-        # Process each port for the host, checking against known ports
-        for file_port in file_host['ports']:
+def _batches(cursor, batch_size):
+    batch = list()
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
 
-            q = {
-                'project_id': project['_id'],
-                'host_id': host['_id'],
-                'port': file_port['port'],
-                'protocol': file_port['protocol']
-            }
-            port = db.ports.find_one(q)
 
-            is_known_port = False
-            if port:
-                is_known_port = True
-            else:
-                port = copy.deepcopy(lair_models.port_model)
+def iter_hosts(db, project_id, fields=None, batch_size=READ_BATCH_SIZE):
+    """Iterates over a project's hosts, ordered by address string. The query
+    is served by the (project_id, string_addr) index.
 
-            pre_md5 = hashlib.md5()
-            pre_md5.update(str(port))
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param fields: Host fields to return. Default is whole documents
+    :param batch_size: Documents fetched per round trip
+    """
+    return db.hosts.find({'project_id': project_id}, projection(fields)) \
+        .sort('string_addr', ASCENDING).batch_size(batch_size)
 
-            port['host_id'] = host['_id']
-            port['project_id'] = project['_id']
-            port['protocol'] = file_port['protocol']
-            port['port'] = file_port['port']
 
-            # TODO: Determine how to handle a closed port
-            port['alive'] = file_port['alive']
+def iter_ports(db, project_id, host_ids=None, fields=None,
+               batch_size=READ_BATCH_SIZE):
+    """Iterates over a project's ports, ordered by host, port and protocol.
+    The query is served by the (project_id, host_id, port, protocol) index.
 
-            # Update product if it is unknown
-            if port['product'] == lair_models.PRODUCT_UNKNOWN:
-                port['product'] = file_port['product']
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param host_ids: Only return the ports of these hosts. Default is all
+    :param fields: Port fields to return, host_id is always included
+    :param batch_size: Documents fetched per round trip
+    """
+    q = {'project_id': project_id}
+    if host_ids is not None:
+        q['host_id'] = {'$in': list(host_ids)}
+    return db.ports.find(q, projection(fields, ('host_id',))) \
+        .sort([('host_id', ASCENDING), ('port', ASCENDING),
+               ('protocol', ASCENDING)]).batch_size(batch_size)
 
-            # Set the service if it is not set
-            if not port['service'] or port['service'] == 'unknown':
-                port['service'] = file_port['service']
 
-            # Include any script output for the port
-            if file_port['notes']:
-                port['notes'].extend(file_port['notes'])
+def iter_vulnerabilities(db, project_id, fields=None,
+                         batch_size=READ_BATCH_SIZE):
+    """Iterates over a project's vulnerabilities
 
-            # Include any credentials
-            if file_port['credentials']:
-                port['credentials'].extend(file_port['credentials'])
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param fields: Vulnerability fields to return. Default is whole documents
+    :param batch_size: Documents fetched per round trip
+    """
+    return db.vulnerabilities.find({'project_id': project_id},
+                                   projection(fields)).batch_size(batch_size)
 
-            if not is_known_port:
-                id = str(ObjectId())
-                port['_id'] = id
-                s = file_port.get('status', lair_models.STATUS_GREY)
-                port['status'] = s if s in valid_statuses else lair_models.STATUS_GREY
-                now = datetime.utcnow().isoformat()
-                temp_drone_log.append("{0} - New port found: {1}/{2} ({3})".format(
-                    now,
-                    str(file_port['port']),
-                    file_port['protocol'],
-                    file_port['service'])
-                )
 
-            post_md5 = hashlib.md5()
-            post_md5.update(str(port))
+def iter_web_directories(db, project_id, host_ids=None, fields=None,
+                         batch_size=READ_BATCH_SIZE):
+    """Iterates over a project's web directories, ordered by host
 
-            if pre_md5 != post_md5:
-                port['last_modified_by'] = tool
-                db.ports.save(port)
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param host_ids: Only return the directories of these hosts. Default is all
+    :param fields: Directory fields to return, host_id is always included
+    :param batch_size: Documents fetched per round trip
+    """
+    q = {'project_id': project_id}
+    if host_ids is not None:
+        q['host_id'] = {'$in': list(host_ids)}
+    return db.web_directories.find(q, projection(fields, ('host_id',))) \
+        .sort('host_id', ASCENDING).batch_size(batch_size)
 
-    # For each vulnerability in the parsed scan, check to see if it already
-    # exists in the database.
-    for file_vuln in document.get('vulnerabilities', []):
 
-        is_known_vuln = False
+def vulnerabilities_by_host(db, project_id, fields=None):
+    """Indexes a project's vulnerabilities by the hosts they affect. The
+    vulnerabilities are read with a single query and joined in memory.
 
-        # Attempt a lookup by plugin_id...
-        q = {
-            'project_id': project['_id'],
-            'plugin_ids': {'$all': file_vuln['plugin_ids']}
-        }
-        db_vuln = db.vulnerabilities.find_one(q)
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param fields: Vulnerability fields to return, hosts is always included
+    :return: Dict of string_addr to a list of (port, protocol, vulnerability)
+    """
+    index = dict()
+    for vuln in iter_vulnerabilities(db, project_id,
+                                     fields and list(fields) + ['hosts']):
+        for host_key in vuln.get('hosts', []):
+            index.setdefault(host_key['string_addr'], list()).append(
+                (host_key['port'], host_key['protocol'], vuln))
+    return index
+
+
+def iter_host_details(db, project_id, host_fields=None, port_fields=None,
+                      vulnerabilities=False, vuln_fields=None,
+                      web_directories=False, batch_size=READ_BATCH_SIZE):
+    """Iterates over a project's hosts with their ports, and optionally
+    their vulnerabilities and web directories, attached. Hosts are read in
+    batches and the ports of each batch are fetched with one query, so the
+    number of round trips grows with the number of batches, not hosts.
 
-        if db_vuln:
-            is_known_vuln = True
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param host_fields: Host fields to return. Default is whole documents
+    :param port_fields: Port fields to return. Default is whole documents
+    :param vulnerabilities: Attach the vulnerabilities affecting each host
+                            as 'vulnerabilities', a list of (port, protocol,
+                            vulnerability). They are held in memory.
+    :param vuln_fields: Vulnerability fields to attach. Default is whole
+                        documents
+    :param web_directories: Attach the host's web directories
+    :param batch_size: Hosts per batch
+    """
+    vulns = None
+    if vulnerabilities:
+        vulns = vulnerabilities_by_host(db, project_id, vuln_fields)
+
+    # The join keys are always needed
+    if host_fields is not None:
+        host_fields = list(host_fields) + ['_id', 'string_addr']
+
+    hosts = iter_hosts(db, project_id, host_fields, batch_size)
+    for batch in _batches(hosts, batch_size):
+        host_ids = [host['_id'] for host in batch]
+
+        ports = dict()
+        for port in iter_ports(db, project_id, host_ids, port_fields, batch_size):
+            ports.setdefault(port['host_id'], list()).append(port)
+
+        directories = dict()
+        if web_directories:
+            for directory in iter_web_directories(db, project_id, host_ids,
+                                                  batch_size=batch_size):
+                directories.setdefault(directory['host_id'], list()).append(directory)
+
+        for host in batch:
+            host['ports'] = ports.get(host['_id'], list())
+            if web_directories:
+                host['web_directories'] = directories.get(host['_id'], list())
+            if vulns is not None:
+                host['vulnerabilities'] = vulns.get(host['string_addr'], list())
+            yield host
+
+
+def export_project(db, project_id, out, batch_size=READ_BATCH_SIZE):
+    """Writes a project as newline delimited JSON in the format read by
+    drone-raw: a header line with the project fields, then one
+    {"host": ...} line per host, with its ports and web directories, and
+    one {"vulnerability": ...} line per vulnerability. Documents are
+    written as they are read so memory use does not grow with the project.
 
-        # No vuln found by plugin_id, treat as new
-        if not is_known_vuln:
-            db_vuln = copy.deepcopy(file_vuln)
-            id = str(ObjectId())
-            s = file_vuln.get('status', lair_models.STATUS_GREY)
-            db_vuln['status'] = s if s in valid_statuses else lair_models.STATUS_GREY
-            db_vuln['_id'] = id
-            db_vuln['project_id'] = project['_id']
-            db_vuln['last_modified_by'] = tool
-            now = datetime.utcnow().isoformat()
-            temp_drone_log.append("{0} - New vulnerability found: {1}".format(
-                now,
-                file_vuln['title'].encode("utf-8"))
-            )
-            db.vulnerabilities.save(db_vuln)
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :param out: File object to write to
+    :param batch_size: Documents fetched per round trip
+    :return: Tuple of the number of hosts and vulnerabilities written
+    :raise: ProjectDoesNotExistError
+    """
+    project = db.projects.find_one({'_id': project_id})
+    if project is None:
+        raise ProjectDoesNotExistError(project_id)
 
-        if is_known_vuln:
-            pre_md5 = hashlib.md5()
-            pre_md5.update(str(db_vuln))
-
-            db_vuln['cves'].extend(file_vuln['cves'])
-            db_vuln['cves'] = list(set(db_vuln['cves']))
-            db_vuln['identified_by'].extend(file_vuln['identified_by'])
-
-            # Only set 'flag' if it's true for parsed vuln
-            db_vuln['flag'] = file_vuln['flag'] \
-                if file_vuln.get('flag', False) else db_vuln.get('flag', False)
-
-            # Include any script output for the port
-            if file_vuln['notes']:
-                db_vuln['notes'].extend(file_vuln['notes'])
-
-            for file_host in file_vuln['hosts']:
-                if file_host not in db_vuln['hosts']:
-                    db_vuln['hosts'].append(file_host)
-                    now = datetime.utcnow().isoformat()
-                    temp_drone_log.append("{0} - {1}:{2}/{3} - New vulnerability found: {4}".format(
-                        now,
-                        file_host['string_addr'],
-                        str(file_host['port']),
-                        file_host['protocol'],
-                        file_vuln['title'])
-                    )
-
-            post_md5 = hashlib.md5()
-            post_md5.update(str(db_vuln))
-
-            # Vulnerability was known, but change was detected
-            if pre_md5 != post_md5:
-                db_vuln['last_modified_by'] = tool
-                db.vulnerabilities.save(db_vuln)
-
-    # Ensure history log does not exceed DRONE_LOG_HISTORY limit
-    project['drone_log'].extend(temp_drone_log)
-    length = len(project['drone_log'])
-    del project['drone_log'][0:(length - DRONE_LOG_HISTORY)]
-
-    db.projects.save(project)
+    header = dict((k, v) for k, v in project.items() if k != '_id')
+    header['project_id'] = project_id
+    out.write(json.dumps(header, default=str) + '\n')
 
-    if not has_errors:
-        print "[+] Processing completed: {0} host(s) processed.".format(
-            str(len(document['hosts'])))
-    else:
-        print "[!] Could not process this drone's data. See above for any error messages."
+    web_directories = 'web_directories' in db.collection_names()
+
+    host_count = 0
+    for host in iter_host_details(db, project_id,
+                                  web_directories=web_directories,
+                                  batch_size=batch_size):
+        out.write(json.dumps({'host': host}, default=str) + '\n')
+        host_count += 1
+
+    vuln_count = 0
+    for vuln in iter_vulnerabilities(db, project_id, batch_size=batch_size):
+        out.write(json.dumps({'vulnerability': vuln}, default=str) + '\n')
+        vuln_count += 1
+
+    return host_count, vuln_count
@@ -0,0 +1,554 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import re
+import copy
+import hashlib
+from HTMLParser import HTMLParser
+from urlparse import urlparse
+from lairdrone import drone_models as models
+from lairdrone import helper
+from lairdrone import xmlbackend as et
+
+OS_WEIGHT = 75
+TOOL = "burp"
+
+burp_issue_model = {
+    'name': '',
+    'issue_background': '',
+    'issue_detail': '',
+    'remediation_background': '',
+    'vulnerability_classifications': [],
+    'references': [],
+    'ip': '',
+    'port': 0,
+    'url': '', # https://api.example.com
+    'scheme': '', # https
+    'hostname': '', # api.example.com
+    'path': '',
+    'severity': '',
+}
+
+class MLStripper(HTMLParser):
+    def __init__(self):
+        self.reset()
+        self.fed = []
+    def handle_data(self, d):
+        self.fed.append(d)
+    def get_data(self):
+        return ''.join(self.fed)
+
+def _digest(text):
+    if text is None:
+        return None
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).digest()
+
+def strip_tags(html, cache=None):
+    """Converts html to text
+
+    :param html: The html
+    :param cache: Dict of the text already converted, keyed by the digest
+                  of the html. Issue backgrounds repeat across every issue
+                  of a type, so parse() passes one for the whole file.
+    """
+    key = _digest(html)
+    txt = cache.get(key) if cache is not None else None
+    if txt is None:
+        s = MLStripper()
+        s.feed(html)
+        txt = s.get_data().strip()
+        txt = re.sub('\n\n\n(\s*)', '\n\n', txt)
+        if cache is not None:
+            cache[key] = txt
+    return txt
+
+def iter_issues(burp_file):
+    """Streams a Burp export, yielding each issue element. The base64
+    request and response bodies are dropped as soon as they are read and
+    each issue is detached from the tree once the caller is done with it,
+    so memory stays bounded by the largest issue.
+
+    :param burp_file: The Burp xml file to be parsed, or '-' for stdin
+    """
+    stack = list()
+    releaser = et.Releaser()
+    with helper.open_resource(burp_file) as fh:
+        for event, elem in et.iterparse(fh, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            if elem.tag == 'requestresponse':
+                elem.clear()
+            elif elem.tag == 'issue':
+                yield elem
+                releaser.release(stack[-1] if stack else None, elem)
+
+RETIREJS_LIBRARY = re.compile(r'The library <b>(?P<library>[^<]+)</b> version <b>(?P<version>[^<]+)</b>')
+RETIREJS_AFFECTED = re.compile(r'The vulnerability is affecting all versions prior <b>(?P<before>[^<]+)</b> \(between <b>(?P<from>[^<]+)</b> and <b>(?P<to>[^<]+)</b>\)')
+RETIREJS_HREF = re.compile('href="([^"]+)"')
+
+def _extract_retirejs_detail(detail):
+    lines = detail.split('\n')
+
+    # The disclosure list closes on the last '</ul>' line that is followed,
+    # three lines later, by the affected versions line
+    affected = dict()
+    close = None
+    for n, line in enumerate(lines):
+        m = RETIREJS_AFFECTED.match(line)
+        if m is not None:
+            affected[n] = m
+    for n, line in enumerate(lines):
+        if line == '</ul>' and n + 4 in affected:
+            close = n
+
+    if close is None:
+        return None
+
+    for n, line in enumerate(lines):
+        # The library line is followed, four lines later, by '<ul>' and at
+        # least one line of disclosures
+        if n + 6 > close:
+            break
+        m = RETIREJS_LIBRARY.search(line)
+        if m is None or lines[n + 4] != '<ul>':
+            continue
+
+        details = m.groupdict()
+        details.update(affected[close + 4].groupdict())
+        details['urls'] = list()
+        for token in '\n'.join(lines[n + 5:close]).split():
+            href = RETIREJS_HREF.search(token)
+            if href is not None:
+                details['urls'].append(href.group(1))
+        return details
+
+    return None
+
+def parse_retirejs_detail(detail, cache=None):
+    """Extracts the library, version, affected versions and disclosure urls
+    from a retire.js issue detail. Each line of the detail is read a fixed
+    number of times.
+
+    :param detail: The issue detail html
+    :param cache: Dict of the details already extracted, keyed by the
+                  digest of the detail text. parse() passes one per file.
+    :return: Dict of library, version, before, from, to and urls, or None
+             if the detail is not in the retire.js format
+    """
+    if cache is None:
+        return _extract_retirejs_detail(detail)
+    key = _digest(detail)
+    if key not in cache:
+        cache[key] = _extract_retirejs_detail(detail)
+    return cache[key]
+
+# add_issue_hosts adds the host for each issue in the list of issues to the vuln.
+def add_issue_hosts(vuln, issues):
+    known = set((h['string_addr'], h['port'], h['protocol']) for h in vuln['hosts'])
+    for issue in issues:
+        host_key_dict = dict(models.host_key_model)
+        host_key_dict['string_addr'] = issue['ip']
+        host_key_dict['port'] = issue['port']
+
+        # Check if host/port is already associated with vuln, add if not
+        key = (host_key_dict['string_addr'], host_key_dict['port'], host_key_dict['protocol'])
+        if key not in known:
+            known.add(key)
+            vuln['hosts'].append(host_key_dict)
+
+
+class HostSet(object):
+    """Hosts merged by string_addr. Each host's ports are indexed by port
+    number and its hostnames by name, so merging is linear in the number
+    of hosts, ports and hostnames added.
+    """
+
+    def __init__(self, hosts=None):
+        self.hosts = hosts if hosts is not None else list()
+        self.index = dict()  # string_addr: (host, port numbers, hostnames)
+        for host in self.hosts:
+            if host['string_addr'] not in self.index:
+                self._add(host)
+
+    def _add(self, host):
+        self.index[host['string_addr']] = (
+            host,
+            set(p['port'] for p in host['ports']),
+            set(host['hostnames']),
+        )
+
+    def merge(self, src):
+        """Merges hosts from the src list of hosts into the set
+
+        :param src: List of models.host_model's
+        """
+        for shost in src:
+            entry = self.index.get(shost['string_addr'])
+            if entry is None:
+                self.hosts.append(shost)
+                self._add(shost)
+                continue
+
+            dhost, ports, hostnames = entry
+
+            if not dhost.get('os'):
+                dhost['os'] = shost['os']
+
+            for p in shost['ports']:
+                if p['port'] not in ports:
+                    ports.add(p['port'])
+                    dhost['ports'].append(p)
+
+            for h in shost['hostnames']:
+                if h not in hostnames:
+                    hostnames.add(h)
+                    dhost['hostnames'].append(h)
+
+            # TODO: handle notes
+
+
+# merge_hosts merges hosts from the src list of hosts into the dst list.
+def merge_hosts(dst, src):
+    HostSet(dst).merge(src)
+
+
+# get_issue_hosts gets a de-duped list of models.host_model's from the list of issues.
+def get_issue_hosts(issues):
+    hosts = HostSet()
+    for issue in issues:
+        host = dict(models.host_model)
+        host['os'] = list() # no OS
+        host['ports'] = list()
+        host['hostnames'] = list()
+
+        if issue['ip'] == '':
+            raise Exception('issue has blank ip')
+
+        host['string_addr'] = issue['ip']
+        host['long_addr'] = helper.ip2long(issue['ip'])
+
+        port = dict(models.port_model)
+        port['port'] = issue['port']
+        port['protocol'] = models.PROTOCOL_TCP
+        port['service'] = issue['scheme']
+        host['ports'].append(port)
+
+        # Don't set an OS
+        os_dict = dict(models.os_model)
+        os_dict['tool'] = TOOL
+        host['os'].append(os_dict)
+
+        hosts.merge([host])
+
+    return hosts.hosts
+
+
+def add_issue_tags(vuln, issues):
+    """Tags the vuln with the hostname->ip:port of each issue
+
+    :param vuln: The vulnerability model
+    :param issues: List of burp_issue_model's
+    """
+    known = set(vuln['tags'])
+    for issue in issues:
+        tag = 'dhostname:%s->%s:%s/tcp' % (issue['hostname'], issue['ip'], issue['port'])
+        if tag not in known:
+            known.add(tag)
+            vuln['tags'].append(tag)
+
+
+def get_severity(severity):
+    if severity == 'High':
+        return 10.0
+    if severity == 'Medium':
+        return 5.0
+    if severity == 'Low':
+        return 3.0
+    return 0.0
+
+def process_retirejs(plugin_id, issues, details=None):
+    v = copy.deepcopy(models.vulnerability_model)
+
+    v['title'] = 'Use of Components with Known Vulnerabilities'
+    v['cvss'] = 6.5
+    v['description'] = '''We identified third-party software components that have known vulnerabilities in the versions in use.
+
+Third party software components are frequently used in the creation of software. They provide functionality that the application creators would otherwise need to write themselves. Third party software components are frequently, but not exclusively, open source and can have a wide range of quality, bug reporting, and security practices.
+
+Security vulnerabilities in third-party software components can expose the parent application to security issues. The full range of weaknesses is possible, including injection, broken access control, XSS, etc. The impact could range from minimal to complete host takeover and data compromise.
+
+Tracking weaknesses in software applications can be a difficult task. Vulnerability reports for commercial or open source software do not always specify exactly which versions of a component are vulnerable in a standard, searchable way. Further, not all libraries use an understandable version numbering system and many do not report to a central clearinghouse such as CVE and NVD.'''
+    v['solution'] = '''Update the affected components to the latest secure version.
+
+The projects for most software components or libraries do not create vulnerability patches for old versions. Instead, most simply fix the problem in the next release. Therefore, upgrading to these new versions is critical.
+
+One option for mitigation is to not use components that you didn't write. Because this is usually not a realistic option, software projects should have a process in place to:
+
+1. Identify all components and the versions you are using, including all dependencies. (e.g., the versions plugin).
+2. Monitor the security of these components in public databases, project mailing lists, and security mailing lists, and keep them up to date.
+3. Establish security policies governing component use, such as requiring certain software development practices, passing security tests, and acceptable licenses.
+4. Where appropriate, consider adding security wrappers around components to disable unused functionality and/ or secure weak or vulnerable aspects of the component.
+
+Services such as [snyk.io](https://snyk.io/) can help manage many aspects of this process.
+
+For more background on the dangers posed by software dependencies in general, see this blog post by Russ Cox: [research.swtch.com/deps](https://research.swtch.com/deps).'''
+
+    v['tags'] = ['cat:application']
+
+    plugin_dict = dict(models.plugin_id_model)
+    plugin_dict['tool'] = TOOL
+    plugin_dict['id'] = plugin_id
+    v['plugin_ids'].append(plugin_dict)
+
+    libraries = dict() # '<library>-<version>': {'groupdict': {}, 'issues': []}
+
+    add_issue_tags(v, issues)
+
+    for issue in issues:
+        gd = parse_retirejs_detail(issue['issue_detail'], details)
+        if gd is None:
+            raise Exception("retirejs issue detail doesn't match regex")
+
+        libkey = '%s-%s' % (gd['library'], gd['version'])
+        if libkey not in libraries:
+            libraries[libkey] = {'groupdict': gd, 'issues': []}
+        libraries[libkey]['issues'].append(issue)
+
+    # NOTE: I am omitting the component url for now, since we don't know what it is.
+    detail_tpl = '''The library **%s** version **%s** is in use and has known security issues. The vulnerabilities affect all versions %s.
+
+We identified the following affected pages, though there are likely more:
+
+%s
+
+More details can be found in the following issue disclosures:
+
+%s'''
+
+    # each unique library gets its own output
+
+    for library in libraries.values():
+        libdict = library['groupdict']
+        version_range = 'between **%s** and **%s**' % (libdict['from'], libdict['to'])
+        if libdict['from'] == '*':
+            version_range = 'prior to **%s**' % libdict['to']
+
+        pages = []
+        for issue in library['issues']:
+            pages.append(issue['url'] + issue['path'])
+
+        disclosures = libdict['urls']
+
+        evidence = detail_tpl % (
+            libdict['library'],
+            libdict['version'],
+            version_range,
+            '\n'.join(['- ' + page for page in pages]),
+            '\n'.join(['- <%s>' % disc for disc in disclosures]),
+        )
+
+        if v['evidence']:
+            v['evidence'] += '\n\n---\n\n'
+
+        v['evidence']+= evidence
+
+    # we would pass a filtered list of issues if we were weeding some out
+    add_issue_hosts(v, issues)
+    return v, get_issue_hosts(issues)
+
+
+def process_default(plugin_id, issues, stripped=None):
+    # add in hostnames
+    # for details, add in the issue path, followed by the unique content, but group by matching content.
+    v = copy.deepcopy(models.vulnerability_model)
+
+    v['title'] = issues[0]['name'].title()
+    v['cvss'] = get_severity(issues[0]['severity'])
+    if issues[0]['issue_background']:
+        v['description'] = strip_tags(issues[0]['issue_background'], stripped).replace('\n', '\n\n')
+    if issues[0]['remediation_background']:
+        v['solution'] = strip_tags(issues[0]['remediation_background'], stripped).replace('\n', '\n\n')
+    if issues[0]['references']:
+        v['solution'] += '\n\nAdditional Resources:\n\n'
+        v['solution'] +=  '\n'.join(['- <%s>' % ref for ref in issues[0]['references']])
+
+
+    v['tags'] = ['cat:application']
+
+    plugin_dict = dict(models.plugin_id_model)
+    plugin_dict['tool'] = TOOL
+    plugin_dict['id'] = plugin_id
+    v['plugin_ids'].append(plugin_dict)
+
+    add_issue_tags(v, issues)
+
+    evidences = {} # issue_detail: [issue]
+    evidence_urls = {} # issue_detail: set of issue urls
+    for issue in issues:
+        if issue['issue_detail'] not in evidences:
+            evidences[issue['issue_detail']] = []
+            evidence_urls[issue['issue_detail']] = set()
+
+        if issue['url'] not in evidence_urls[issue['issue_detail']]:
+            evidence_urls[issue['issue_detail']].add(issue['url'])
+            evidences[issue['issue_detail']].append(issue)
+
+    for evidence, evid_issues in evidences.items():
+        if v['evidence']:
+            v['evidence'] += '\n\n---\n\n'
+
+        v['evidence'] += '%s:\n\n' % ', '.join([issue['url'] + issue['path'] for issue in evid_issues])
+        v['evidence'] += strip_tags(evidence.strip(), stripped).replace('\n', '\n\n')
+
+    add_issue_hosts(v, issues)
+    return v, get_issue_hosts(issues)
+
+
+def parse(project, burp_file, include_informational=False, scope=None):
+    """Parses a Burp file and updates the Lair database
+
+    :param project: The project id
+    :param burp_file: The Burp xml file to be parsed
+    :param include_informational: Whether to include info findings in data. Default False
+    :param scope: Optional Scope; issues on out-of-scope hosts are skipped
+    """
+
+    # Create the project dictionary which acts as foundation of document
+    project_dict = copy.deepcopy(models.project_model)
+    project_dict['commands'] = list()
+    project_dict['vulnerabilities'] = list()
+    project_dict['project_id'] = project
+
+    # Temp dicts used to ensure no duplicate hosts or ports are added
+    temp_vulns = dict()
+    temp_hosts = list()
+
+    command_dict = dict(models.command_model)
+    command_dict['tool'] = TOOL
+    command_dict['command'] = 'Active scan'
+    project_dict['commands'].append(command_dict)
+
+    # Group vuln instances by their plugin_id
+    temp_issues = dict()
+
+    # Issue text shared by many issues is kept once, keyed by its digest,
+    # and so are its conversion to text and the retire.js details extracted
+    # from it. They only live as long as the parse.
+    texts = dict()
+    stripped = dict()
+    details = dict()
+
+    for issue_elem in iter_issues(burp_file):
+        host_elem = issue_elem.find('host')
+
+        # Don't import issues for out-of-scope hosts
+        if scope is not None and \
+                (host_elem is None or host_elem.attrib['ip'] not in scope):
+            continue
+
+        issue = dict(burp_issue_model)
+        issue['references'] = list()
+        issue['vulnerability_classifications'] = list()
+
+        name = issue_elem.find('name')
+        if name is not None:
+            issue['name'] = name.text
+
+        issue_background = issue_elem.find('issueBackground')
+        if issue_background is not None:
+            # don't strip here, we need original for regex matches in post processing
+            issue['issue_background'] = texts.setdefault(
+                _digest(issue_background.text), issue_background.text)
+
+        issue_detail = issue_elem.find('issueDetail')
+        if issue_detail is not None:
+            issue['issue_detail'] = issue_detail.text
+
+        remediation_background = issue_elem.find('remediationBackground')
+        if remediation_background is not None:
+            issue['remediation_background'] = texts.setdefault(
+                _digest(remediation_background.text), remediation_background.text)
+
+        classifications = issue_elem.find('vulnerabilityClassifications')
+        if classifications is not None:
+            issue['vulnerability_classifications'] = classifications.text
+
+        references = issue_elem.find('references')
+        if references is not None:
+            for ref in references.text.split('href="'):
+                if ref.find('"') != -1:
+                    issue['references'].append(ref[0:ref.index('"')])
+
+        if host_elem is not None:
+            issue['ip'] = host_elem.attrib['ip']
+            issue['url'] = host_elem.text
+            issue['port'] = 80
+
+            url = urlparse(host_elem.text)
+            issue['scheme'] = url.scheme
+            issue['hostname'] = url.hostname
+            if url.port:
+                issue['port'] = url.port
+            if url.scheme == 'https':
+                issue['port'] = 443
+
+        path = issue_elem.find('path')
+        if path is not None:
+            issue['path'] = path.text
+
+        severity = issue_elem.find('severity')
+        if severity is not None:
+            issue['severity'] = severity.text
+
+        type_elem = issue_elem.find('type')
+        if type_elem is not None:
+            plugin_id = type_elem.text
+            if type_elem.text == "134217728":
+                # For these we need persistent IDs for each type we want to group otherwise things like retire.js won't group propertly.
+                if issue['name'].startswith('Vulnerable version of the library'):
+                    plugin_id = 'retirejs01'
+                if issue['name'].startswith('CSP: The domain is hosting user content'):
+                    plugin_id = 'csp-domain-uc01'
+                if plugin_id == "134217728":
+                    print "\n\nWARNING: Issue is using a Burp extension generated issue type (plugin_id) which may conflict with other project vulns and not be added as a result --",  issue['name'] + '\n\n'
+                else:
+                    print "CHANGED:", issue['name'], plugin_id
+
+        if plugin_id not in temp_issues:
+            temp_issues[plugin_id] = []
+
+        temp_issues[plugin_id].append(issue)
+
+    temp_vulns = list() # [models.vulnerability_model]
+    temp_hosts = HostSet() # [models.host_model]
+
+    for plugin_id, issues in temp_issues.items():
+        # issues shouldn't be handling hosts. We're going to map from
+
+        if issue['severity'] == 'Information' and not include_informational:
+            continue
+
+        # handle special cases:
+        if issues[0]['name'].startswith('Vulnerable version of the library'):
+            vuln, hosts = process_retirejs(plugin_id, issues, details)
+            # hosts must be already added to vuln as models.host_key_model, v['hosts']
+
+        else:
+            vuln, hosts = process_default(plugin_id, issues, stripped)
+
+        # vuln will be unique
+        temp_vulns.append(vuln)
+
+        # only add hosts if they are unique:
+        temp_hosts.merge(hosts)
+
+    project_dict['vulnerabilities'] = temp_vulns
+    project_dict['hosts'] = temp_hosts.hosts
+
+    return project_dict
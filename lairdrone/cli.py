@@ -0,0 +1,583 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+import sys
+import time
+import subprocess
+from optparse import OptionParser
+
+# Modules that are slow to import. None of them is imported until a command
+# has checked its arguments and runs.
+HEAVY_MODULES = ('pymongo', 'bson', 'requests', 'lxml')
+
+# Registered commands, by name
+COMMANDS = dict()
+
+
+class Command(object):
+    """A drone subcommand: its usage, the functions adding its options and
+    the function running it. Building the option parser imports nothing;
+    run imports the tool's parser, and with it pymongo and requests, only
+    once the arguments have been checked.
+    """
+
+    def __init__(self, name, usage, description, options, run, version):
+        self.name = name
+        self.usage = usage
+        self.description = description
+        self.options = options
+        self.run = run
+        self.version = version
+
+    def parser(self, prog=None):
+        """Builds the command's option parser
+
+        :param prog: Program name shown in the usage
+        """
+        parser = OptionParser(usage=self.usage, description=self.description,
+                              version="%prog " + self.version, prog=prog)
+        for add_options in self.options:
+            add_options(parser)
+        return parser
+
+
+def command(name, usage, description, options=(), version='0.0.1'):
+    """Registers a function as the run function of a subcommand. It is
+    called with the option parser, the parsed options and the arguments,
+    and returns the exit status.
+    """
+    def register(run):
+        COMMANDS[name] = Command(name, usage, description, options, run,
+                                 version)
+        return run
+    return register
+
+
+def informational_option(parser):
+    parser.add_option(
+        "--include-informational",
+        dest="include_informational",
+        default=False,
+        action="store_true",
+        help="Forces informational plugins to be loaded"
+    )
+
+
+def scope_option(parser):
+    parser.add_option(
+        "--scope",
+        dest="scope",
+        default=None,
+        action="store",
+        help="File of in-scope CIDRs, address ranges and addresses, one per "
+             "line; lines starting with '!' are excluded. Out-of-scope "
+             "hosts are not imported"
+    )
+
+
+def dry_run_option(parser):
+    parser.add_option(
+        "--dry-run",
+        dest="dry_run",
+        default=False,
+        action="store_true",
+        help="Report the inserts and updates the import would make, their "
+             "size and the number of database round trips, without writing "
+             "anything"
+    )
+
+
+def load_scope(options):
+    if not options.scope:
+        return None
+    from lairdrone import scope
+    return scope.load_file(options.scope)
+
+
+def connect(options):
+    # Import commands load the scope and parse the file first, so a bad
+    # file or scope fails before a connection is opened. Only the ones that
+    # save as they read (nmap --follow, raw) connect before reading.
+    from lairdrone import api
+    db = api.db_connect()
+    if getattr(options, 'dry_run', False):
+        from lairdrone import plan
+        db = plan.Plan(db)
+    return db
+
+
+def save(db, tool):
+    from lairdrone import api
+    return lambda project: api.save(project, db, tool)
+
+
+def report(db, options):
+    if getattr(options, 'dry_run', False):
+        print db.report()
+
+
+def usage_error(parser):
+    print parser.get_usage()
+    return 1
+
+
+def nmap_options(parser):
+    parser.add_option(
+        "--follow",
+        dest="follow",
+        default=False,
+        action="store_true",
+        help="Import hosts as they are written to a running scan's XML "
+             "output (use '-' as the file to read 'nmap -oX -' from stdin)"
+    )
+    parser.add_option(
+        "--batch-size",
+        dest="batch_size",
+        default=25,
+        action="store",
+        type="int",
+        help="Maximum number of hosts saved at once in follow mode "
+             "(default 25)"
+    )
+    parser.add_option(
+        "--idle-timeout",
+        dest="idle_timeout",
+        default=None,
+        action="store",
+        type="float",
+        help="Stop following a file after this many seconds without new "
+             "output (default: wait for the scan to finish)"
+    )
+
+
+@command('nmap', "usage: %prog <project_id> <file> [xml|grep] (default xml)",
+         "%prog imports Nmap files into Lair",
+         (nmap_options, scope_option, dry_run_option))
+def run_nmap(parser, options, args):
+    if len(args) < 2 or len(args) > 3:
+        return usage_error(parser)
+
+    project_id, result_resource = args[:2]
+    result_format = args[2] if len(args) == 3 else 'xml'
+
+    if options.follow:
+        if result_format != 'xml' or options.batch_size < 1:
+            return usage_error(parser)
+
+        in_scope = load_scope(options)
+        from lairdrone import nmap
+        db = connect(options)
+        nmap.follow_xml(project_id, result_resource, save(db, nmap.TOOL),
+                        options.batch_size, options.idle_timeout, in_scope)
+        report(db, options)
+        return 0
+
+    if result_format not in ('xml', 'grep'):
+        return usage_error(parser)
+
+    in_scope = load_scope(options)
+    from lairdrone import nmap
+    if result_format == 'xml':
+        project = nmap.parse_xml(project_id, result_resource, in_scope)
+    else:
+        project = nmap.parse_grep(project_id, result_resource, in_scope)
+
+    db = connect(options)
+    save(db, nmap.TOOL)(project)
+    report(db, options)
+    return 0
+
+
+def nessus_options(parser):
+    parser.add_option(
+        "--min-note-severity",
+        dest="min_note_severity",
+        default=2,
+        action="store",
+        type="int",
+        help="Minimal severity level to use when persisting service notes "
+             "(range 0-4, default 2)"
+    )
+
+
+@command('nessus', "usage: %prog <project_id> <file>",
+         "%prog imports Nessus files into Lair",
+         (informational_option, nessus_options, scope_option, dry_run_option),
+         version='0.0.4')
+def run_nessus(parser, options, args):
+    if len(args) != 2:
+        return usage_error(parser)
+
+    if options.min_note_severity < 0 or options.min_note_severity > 4:
+        return usage_error(parser)
+
+    in_scope = load_scope(options)
+    from lairdrone import nessus
+    project = nessus.parse(args[0], args[1], options.include_informational,
+                           options.min_note_severity, in_scope)
+    db = connect(options)
+    save(db, nessus.TOOL)(project)
+    report(db, options)
+    return 0
+
+
+@command('nexpose', "usage: %prog <project_id> <file>",
+         "%prog imports Nexpose files into Lair",
+         (informational_option, scope_option, dry_run_option),
+         version='0.0.3')
+def run_nexpose(parser, options, args):
+    if len(args) != 2:
+        return usage_error(parser)
+
+    in_scope = load_scope(options)
+    from lairdrone import nexpose
+    project = nexpose.parse(args[0], args[1], options.include_informational,
+                            in_scope)
+    db = connect(options)
+    save(db, nexpose.TOOL)(project)
+    report(db, options)
+    return 0
+
+
+@command('burp', "usage: %prog <project_id> <file>",
+         "%prog imports Burp files into Lair",
+         (informational_option, scope_option, dry_run_option))
+def run_burp(parser, options, args):
+    if len(args) != 2:
+        return usage_error(parser)
+
+    in_scope = load_scope(options)
+    from lairdrone import burp
+    project = burp.parse(args[0], args[1], options.include_informational,
+                         in_scope)
+    db = connect(options)
+    save(db, burp.TOOL)(project)
+    report(db, options)
+    return 0
+
+
+@command('dirb', "usage: %prog <project_id> <file> [file ...]",
+         "%prog imports dirb files into Lair",
+         (scope_option, dry_run_option))
+def run_dirb(parser, options, args):
+    if len(args) < 2:
+        return usage_error(parser)
+
+    in_scope = load_scope(options)
+    from lairdrone import dirb
+    project = dirb.parse(args[0], args[1:], in_scope)
+    db = connect(options)
+    save(db, dirb.TOOL)(project)
+    report(db, options)
+    return 0
+
+
+def cve_options(parser):
+    from lairdrone import cve
+    cve.add_options(parser)
+
+
+@command('wpscan', "usage: %prog <project_id> <file>",
+         "%prog imports WPScan json files into Lair",
+         (cve_options, scope_option, dry_run_option))
+def run_wpscan(parser, options, args):
+    if len(args) != 2:
+        return usage_error(parser)
+
+    in_scope = load_scope(options)
+    from lairdrone import cve
+    from lairdrone import wpscan
+    project = wpscan.parse(args[0], args[1], cve.from_options(options),
+                           in_scope)
+    db = connect(options)
+    save(db, wpscan.TOOL)(project)
+    report(db, options)
+    return 0
+
+
+@command('wpscan-sum', "usage: %prog <project_id> <file>",
+         "%prog imports a summary of WPScan json files into Lair",
+         (cve_options, scope_option, dry_run_option))
+def run_wpscan_sum(parser, options, args):
+    if len(args) != 2:
+        return usage_error(parser)
+
+    in_scope = load_scope(options)
+    from lairdrone import cve
+    from lairdrone import wpscan_sum
+    project = wpscan_sum.parse(args[0], args[1], cve.from_options(options),
+                               in_scope)
+    db = connect(options)
+    save(db, wpscan_sum.TOOL)(project)
+    report(db, options)
+    return 0
+
+
+def raw_options(parser):
+    parser.add_option(
+        "--batch-size",
+        dest="batch_size",
+        default=100,
+        action="store",
+        type="int",
+        help="Maximum number of hosts and vulnerabilities saved at once "
+             "(default 100)"
+    )
+
+
+@command('raw', "usage: %prog <project_id> <file> <tool>",
+         "%prog imports raw JSON or NDJSON files into Lair",
+         (raw_options, scope_option, dry_run_option))
+def run_raw(parser, options, args):
+    if len(args) != 3 or options.batch_size < 1:
+        return usage_error(parser)
+
+    in_scope = load_scope(options)
+    from lairdrone import raw
+
+    # Records are saved as they are read rather than loading the whole
+    # file, so the database is connected to before reading it
+    db = connect(options)
+    raw.stream(args[0], args[1], save(db, args[2]), options.batch_size,
+               in_scope)
+    report(db, options)
+    return 0
+
+
+def watch_options(parser):
+    parser.add_option(
+        "--workers",
+        dest="workers",
+        default=2,
+        action="store",
+        type="int",
+        help="Number of files parsed concurrently (default 2)"
+    )
+    parser.add_option(
+        "--settle",
+        dest="settle",
+        default=10,
+        action="store",
+        type="float",
+        help="Seconds a file must stay unchanged before it is imported "
+             "(default 10)"
+    )
+    parser.add_option(
+        "--interval",
+        dest="interval",
+        default=5,
+        action="store",
+        type="float",
+        help="Seconds between directory scans (default 5)"
+    )
+
+
+@command('watch', "usage: %prog <project_id> <directory> [directory ...]",
+         "%prog watches directories and imports new scan output into Lair",
+         (informational_option, watch_options, scope_option, dry_run_option))
+def run_watch(parser, options, args):
+    if len(args) < 2 or options.workers < 1:
+        return usage_error(parser)
+
+    for directory in args[1:]:
+        if not os.path.isdir(directory):
+            print "[!] Not a directory: {0}".format(directory)
+            return 1
+
+    in_scope = load_scope(options)
+    from lairdrone import watch
+
+    # Connect to the database once; the connection is shared by every import
+    db = connect(options)
+    watcher = watch.Watcher(args[0], args[1:], db,
+                            workers=options.workers,
+                            settle=options.settle,
+                            interval=options.interval,
+                            include_informational=options.include_informational,
+                            scope=in_scope)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print "[+] Stopped watching."
+
+    report(db, options)
+    return 0
+
+
+def export_options(parser):
+    # Same default as api.READ_BATCH_SIZE, without importing pymongo
+    parser.add_option(
+        "--batch-size",
+        dest="batch_size",
+        default=500,
+        action="store",
+        type="int",
+        help="Documents fetched from the database per round trip "
+             "(default 500)"
+    )
+
+
+@command('export', "usage: %prog <project_id> [file]",
+         "%prog exports a Lair project as NDJSON that drone-raw can import. "
+         "Writes to stdout if file is omitted or '-'",
+         (export_options,))
+def run_export(parser, options, args):
+    if len(args) not in (1, 2) or options.batch_size < 1:
+        return usage_error(parser)
+
+    from lairdrone import api
+    from lairdrone import helper
+    path = args[1] if len(args) == 2 else helper.STDIN
+    # stdout may carry the export, report the connection on stderr
+    db = api.db_connect(out=sys.stderr if path == helper.STDIN else None)
+
+    out = sys.stdout if path == helper.STDIN else open(path, 'w')
+    try:
+        hosts, vulns = api.export_project(db, args[0], out, options.batch_size)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    # stdout carries the export, report on stderr
+    sys.stderr.write("Exported %d hosts and %d vulnerabilities\n" % (hosts, vulns))
+    return 0
+
+
+@command('db', "usage: %prog <init|verify>",
+         "%prog prepares a Lair database for the drones. init builds the "
+         "missing indexes in the background, verify lists the missing "
+         "indexes and the drone queries that would scan a collection")
+def run_db(parser, options, args):
+    if len(args) != 1 or args[0] not in ('init', 'verify'):
+        return usage_error(parser)
+
+    from lairdrone import api
+    from lairdrone import indexes
+    db = api.db_connect()
+
+    if args[0] == 'init':
+        created = indexes.init(db)
+        for collection, keys in created:
+            print "[+] Building index {0} on {1}".format(
+                indexes.describe(keys), collection)
+        if not created:
+            print "[+] All indexes exist"
+        return 0
+
+    missing, scanning = indexes.verify(db)
+    for collection, keys in missing:
+        print "[!] Missing index {0} on {1}".format(
+            indexes.describe(keys), collection)
+    for collection, issued_by, problem in scanning:
+        print "[!] Query of {0} on {1} {2}".format(issued_by, collection, problem)
+    if missing or scanning:
+        print "[!] Run 'drone-db init' to build the missing indexes"
+        return 1
+    print "[+] All indexes exist and no query scans a collection"
+    return 0
+
+
+# Runs a command with no arguments, which stops at the usage error, and
+# reports the heavy modules that were imported on the way
+BENCHMARK_SNIPPET = """
+import os, sys
+sys.stdout = open(os.devnull, 'w')
+from lairdrone import cli
+cli.main([%r])
+sys.stderr.write(','.join(m for m in cli.HEAVY_MODULES if m in sys.modules))
+"""
+
+
+def benchmark_options(parser):
+    parser.add_option(
+        "--runs",
+        dest="runs",
+        default=10,
+        action="store",
+        type="int",
+        help="Number of runs per command (default 10)"
+    )
+    parser.add_option(
+        "--max-ms",
+        dest="max_ms",
+        default=None,
+        action="store",
+        type="float",
+        help="Fail if a command takes longer than this many milliseconds "
+             "more than a bare interpreter, on average"
+    )
+
+
+def _time_python(args, env, runs):
+    # Average wall time of runs interpreter processes, and the stderr of
+    # the last one
+    elapsed = 0.0
+    err = ''
+    for i in range(runs):
+        start = time.time()
+        process = subprocess.Popen([sys.executable] + args, env=env,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        out, err = process.communicate()
+        elapsed += time.time() - start
+    return elapsed * 1000 / runs, err.strip()
+
+
+@command('startup-benchmark', "usage: %prog [command ...]",
+         "%prog times the start of each drone command, up to its usage "
+         "error, and fails if one imports pymongo, requests or lxml before "
+         "it runs",
+         (benchmark_options,))
+def run_startup_benchmark(parser, options, args):
+    names = args or sorted(name for name in COMMANDS
+                           if name != 'startup-benchmark')
+    if options.runs < 1 or any(name not in COMMANDS for name in names):
+        return usage_error(parser)
+
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + filter(None, [env.get('PYTHONPATH')]))
+
+    baseline, err = _time_python(['-c', 'pass'], env, options.runs)
+    print "[+] Interpreter start: {0:.1f}ms".format(baseline)
+
+    failed = False
+    for name in names:
+        ms, loaded = _time_python(['-c', BENCHMARK_SNIPPET % name], env,
+                                  options.runs)
+        status = ''
+        if loaded:
+            status = ' (imports {0})'.format(loaded)
+            failed = True
+        if options.max_ms is not None and ms - baseline > options.max_ms:
+            status += ' (over {0:.0f}ms)'.format(options.max_ms)
+            failed = True
+        print "[{0}] {1}: {2:.1f}ms, +{3:.1f}ms{4}".format(
+            '!' if status else '+', name, ms, ms - baseline, status)
+
+    return 1 if failed else 0
+
+
+def main(argv=None, prog=None):
+    """Runs a drone command
+
+    :param argv: The command name followed by its arguments. Default is
+                 sys.argv[1:]
+    :param prog: Program name shown in the usage. Default is
+                 'drone <command>'
+    :return: Exit status
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in COMMANDS:
+        print "usage: drone <command> [options] [args]\n"
+        print "commands: {0}".format(', '.join(sorted(COMMANDS)))
+        print "Run 'drone <command> --help' for the options of a command."
+        return 0 if argv and argv[0] in ('-h', '--help') else 1
+
+    cmd = COMMANDS[argv[0]]
+    parser = cmd.parser(prog or 'drone {0}'.format(cmd.name))
+    (options, args) = parser.parse_args(argv[1:])
+    return cmd.run(parser, options, args)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+import sys
+import ssl
+import time
+import threading
+from pymongo import MongoClient, uri_parser
+
+# Client options used unless MONGO_URL sets them. Everything else in the
+# URI (seeds, replicaSet, readPreference, compressors, maxPoolSize,
+# timeouts, authSource, ...) is passed to the client as is.
+DEFAULT_OPTIONS = {
+    'appname': 'lairdrone',
+    'retryWrites': True,
+    'connectTimeoutMS': 20000,
+    'serverSelectionTimeoutMS': 30000,
+}
+
+# URI options that configure certificate validation. Lair installs use
+# self-signed certificates, so validation is off unless one of them is set.
+CERT_OPTIONS = ('ssl_cert_reqs', 'tlsallowinvalidcertificates', 'tlsinsecure',
+                'tlscafile', 'ssl_ca_certs')
+
+# MONGO_URL -> MongoClient, shared by every connection of the process
+_clients = dict()
+_lock = threading.Lock()
+
+
+def _options(parsed):
+    # Keyword arguments for MongoClient on top of the URI
+    given = set(name.lower() for name in parsed['options'])
+    kwargs = dict((name, value) for name, value in DEFAULT_OPTIONS.items()
+                  if name.lower() not in given)
+    is_ssl = parsed['options'].get('ssl') or parsed['options'].get('tls')
+    if is_ssl and not given.intersection(CERT_OPTIONS):
+        kwargs['ssl_cert_reqs'] = ssl.CERT_NONE
+    return kwargs
+
+
+def describe(parsed):
+    """Formats the seeds and database of a parsed URI, without credentials
+
+    :param parsed: Result of pymongo.uri_parser.parse_uri
+    """
+    seeds = ','.join('{0}:{1}'.format(host, port)
+                     for host, port in parsed['nodelist'])
+    replica_set = parsed['options'].get('replicaset')
+    if replica_set:
+        seeds += ' (replica set {0})'.format(replica_set)
+    return '{0}/{1}'.format(seeds, parsed['database'])
+
+
+def get_client(uri):
+    """Returns the client for a URI, connecting on first use. Clients are
+    thread safe and pool their connections, so one client serves every
+    import of a batch run.
+
+    :param uri: MongoDB connection string
+    :return: Tuple of the MongoClient and whether it was created by this call
+    """
+    with _lock:
+        if uri in _clients:
+            return _clients[uri], False
+        client = MongoClient(uri, **_options(uri_parser.parse_uri(uri)))
+        _clients[uri] = client
+        return client, True
+
+
+def close():
+    """Closes the shared clients"""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def connect(uri=None, out=None):
+    """Connects to the Lair database of a URI and reports the connection
+    setup and first query latencies. The client is shared with any earlier
+    connection to the same URI.
+
+    :param uri: MongoDB connection string. Default is MONGO_URL
+    :param out: File the progress is reported to. Default is stdout
+    :return: The database
+    """
+    out = out or sys.stdout
+    if uri is None:
+        if 'MONGO_URL' not in os.environ:
+            print >> out, "[***] Missing 'MONGO_URL' Environment Variable [***]"
+            raise EnvironmentError
+        uri = os.environ['MONGO_URL']
+
+    parsed = uri_parser.parse_uri(uri)
+    print >> out, "[+] Attempting connection to database '{0}'".format(
+        describe(parsed))
+
+    start = time.time()
+    client, created = get_client(uri)
+    db = client[parsed['database']]
+    # Server selection, handshake and authentication happen on the first
+    # command
+    client.admin.command('ping')
+    setup = (time.time() - start) * 1000
+
+    start = time.time()
+    db.versions.find_one()
+    first_query = (time.time() - start) * 1000
+
+    print >> out, "[+] Connection successful{0}: setup {1:.1f}ms, first " \
+        "query {2:.1f}ms.".format('' if created else ' (shared client)',
+                                  setup, first_query)
+    return db
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+import gzip
+import json
+import errno
+import urllib2
+import threading
+from Queue import Queue, Empty
+
+# Per-CVE NVD JSON documents
+NVDCVE_URL = "https://raw.githubusercontent.com/olbat/nvdcve/master/nvdcve/%s.json"
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.lair', 'cve-cache')
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = 10
+
+
+class CVEResolver(object):
+    """Looks up NVD JSON documents for CVE ids.
+
+    Each CVE is only resolved once. Documents are read from the in-memory
+    cache, then the on-disk cache, then the NVD mirror directory, and only
+    then fetched over the network by a bounded pool of threads. Fetched
+    documents, and CVEs the source does not know about, are written to the
+    on-disk cache. In offline mode nothing is fetched.
+
+    The mirror directory may hold per-CVE <CVE-ID>.json files, as in the
+    nvdcve repository, and/or NVD JSON feeds (nvdcve-1.1-*.json[.gz]).
+    """
+
+    def __init__(self, cache_dir=None, mirror_dir=None, offline=False,
+                 workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT,
+                 url=NVDCVE_URL):
+        self.cache_dir = cache_dir
+        self.mirror_dir = mirror_dir
+        self.offline = offline
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.url = url
+
+        # CVE id -> document, or None if not found
+        self.cves = dict()
+        self.lock = threading.Lock()
+
+    def resolve(self, cve_ids):
+        """Resolves a list of CVE ids
+
+        :param cve_ids: List of CVE ids, e.g. CVE-2019-11358
+        :return: Dict of CVE id to NVD document, or None if not found
+        """
+        wanted = list()
+        for cve_id in cve_ids:
+            if cve_id not in self.cves and cve_id not in wanted:
+                wanted.append(cve_id)
+
+        missing = list()
+        for cve_id in wanted:
+            found, data = self._read_cache(cve_id)
+            if not found:
+                found, data = self._read_mirror_file(cve_id)
+            if found:
+                self.cves[cve_id] = data
+            else:
+                missing.append(cve_id)
+
+        if missing and self.mirror_dir:
+            feeds = self._read_mirror_feeds(missing)
+            for cve_id, data in feeds.items():
+                self.cves[cve_id] = data
+                self._write_cache(cve_id, data)
+            missing = [cve_id for cve_id in missing if cve_id not in feeds]
+
+        if missing:
+            if self.offline:
+                for cve_id in missing:
+                    print '%s not found offline' % cve_id
+                    self.cves[cve_id] = None
+            else:
+                self._fetch_all(missing)
+
+        return dict((cve_id, self.cves[cve_id]) for cve_id in cve_ids)
+
+    def get_cves(self, cve_ids):
+        """Resolves a list of CVE ids, skipping those that were not found
+
+        :param cve_ids: List of CVE ids
+        :return: List of NVD documents, in the order of cve_ids
+        """
+        resolved = self.resolve(cve_ids)
+        return [resolved[cve_id] for cve_id in cve_ids
+                if resolved[cve_id] is not None]
+
+    def _cache_path(self, cve_id):
+        return os.path.join(self.cache_dir, '%s.json' % cve_id)
+
+    def _read_cache(self, cve_id):
+        if not self.cache_dir:
+            return False, None
+        try:
+            with open(self._cache_path(cve_id), 'r') as fh:
+                return True, json.load(fh)
+        except (IOError, ValueError):
+            return False, None
+
+    def _write_cache(self, cve_id, data):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Write then rename so a reader never sees a partial document
+        path = self._cache_path(cve_id)
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+        with open(tmp, 'w') as fh:
+            json.dump(data, fh)
+        os.rename(tmp, path)
+
+    def _read_mirror_file(self, cve_id):
+        if not self.mirror_dir:
+            return False, None
+        for path in (os.path.join(self.mirror_dir, '%s.json' % cve_id),
+                     os.path.join(self.mirror_dir, 'nvdcve', '%s.json' % cve_id)):
+            try:
+                with open(path, 'r') as fh:
+                    return True, json.load(fh)
+            except (IOError, ValueError):
+                continue
+        return False, None
+
+    def _read_mirror_feeds(self, cve_ids):
+        # Scans every feed in the mirror, keeping only the wanted items
+        wanted = set(cve_ids)
+        found = dict()
+        for filename in sorted(os.listdir(self.mirror_dir)):
+            if not filename.startswith('nvdcve-') or \
+                    not filename.endswith(('.json', '.json.gz')):
+                continue
+            path = os.path.join(self.mirror_dir, filename)
+            opener = gzip.open if filename.endswith('.gz') else open
+            try:
+                with opener(path, 'rb') as fh:
+                    feed = json.load(fh)
+            except (IOError, ValueError):
+                print 'skipping unreadable NVD feed %s' % path
+                continue
+            for item in feed.get('CVE_Items', []):
+                cve_id = item.get('cve', {}).get('CVE_data_meta', {}).get('ID')
+                if cve_id in wanted:
+                    found[cve_id] = item
+            if len(found) == len(wanted):
+                break
+        return found
+
+    def _fetch(self, cve_id):
+        print 'fetching %s' % cve_id
+        try:
+            response = urllib2.urlopen(self.url % cve_id, timeout=self.timeout)
+            data = json.loads(response.read())
+        except urllib2.HTTPError as e:
+            if e.code != 404:
+                print '  ...%s failed: %s' % (cve_id, e)
+                return None
+            print '  ...%s not found' % cve_id
+            data = None
+        except Exception as e:
+            # Network errors are not cached so the lookup is retried later
+            print '  ...%s failed: %s' % (cve_id, e)
+            return None
+
+        self._write_cache(cve_id, data)
+        return data
+
+    def _fetch_all(self, cve_ids):
+        queue = Queue()
+        for cve_id in cve_ids:
+            queue.put(cve_id)
+
+        def work():
+            while True:
+                try:
+                    cve_id = queue.get_nowait()
+                except Empty:
+                    return
+                data = self._fetch(cve_id)
+                with self.lock:
+                    self.cves[cve_id] = data
+
+        threads = list()
+        for i in range(min(self.workers, len(cve_ids))):
+            thread = threading.Thread(target=work)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+
+def add_options(parser):
+    """Adds the CVE lookup options to an OptionParser
+
+    :param parser: The OptionParser
+    """
+    parser.add_option(
+        "--cve-cache",
+        dest="cve_cache",
+        default=os.environ.get('LAIR_CVE_CACHE', DEFAULT_CACHE_DIR),
+        action="store",
+        help="Directory CVE lookups are cached in. Defaults to $LAIR_CVE_CACHE "
+             "or ~/.lair/cve-cache"
+    )
+    parser.add_option(
+        "--nvd-mirror",
+        dest="nvd_mirror",
+        default=os.environ.get('LAIR_NVD_MIRROR'),
+        action="store",
+        help="Local NVD JSON mirror directory of <CVE-ID>.json files or "
+             "nvdcve-1.1-*.json[.gz] feeds. Defaults to $LAIR_NVD_MIRROR"
+    )
+    parser.add_option(
+        "--offline",
+        dest="offline",
+        default=False,
+        action="store_true",
+        help="Only resolve CVEs from the cache and the NVD mirror"
+    )
+    parser.add_option(
+        "--cve-workers",
+        dest="cve_workers",
+        default=DEFAULT_WORKERS,
+        action="store",
+        type="int",
+        help="Maximum number of concurrent CVE fetches"
+    )
+
+
+def from_options(options):
+    """Creates a CVEResolver from the options added by add_options
+
+    :param options: Parsed options
+    """
+    return CVEResolver(cache_dir=options.cve_cache,
+                       mirror_dir=options.nvd_mirror,
+                       offline=options.offline,
+                       workers=options.cve_workers)
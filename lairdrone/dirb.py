@@ -3,15 +3,51 @@
 import os
 import copy
 import re
+import socket
+from StringIO import StringIO
 from urlparse import urlparse
 from lairdrone import drone_models as models
 from lairdrone import helper
 
 TOOL = 'dirb'
 
+# Header lines written by dirb and the command line argument each one
+# implies, in the order the arguments are rebuilt. The value of the line is
+# the first group of the pattern, matched against the text following the
+# prefix. Only the first occurrence of each line is used.
+ARGUMENT_LINES = (
+	('USER_AGENT: ', '-a %s', '(.+)'),
+	('COOKIE: ', '-c "%s"', '(.+)'),
+	('OPTION: Fine tunning of NOT_FOUND detection', '-f', None),
+	('ADDED_HEADERS:', '-H "%s"', None),
+	('OPTION: Using Case-Insensitive Searches', '-i', None),
+	('OPTION: Printing LOCATION header', '-l', None),
+	('OPTION: Ignoring NOT_FOUND code -> ', '-N %s', '(\d+)'),
+	('OUTPUT_FILE: ', '-o %s', '(.+)'),
+	('PROXY: ', '-p %s', '(.+)'),
+	('PROXY AUTHORIZATION: ', '-P %s', '(.+)'),
+	('OPTION: Not Recursive', '-r', None),
+	('OPTION: Silent Mode', '-S', None),
+	('OPTION: NOT forcing an ending', '-t', None),
+	('AUTHORIZATION: ', '-u %s', '(.+)'),
+	('OPTION: Show Not Existant Pages', '-v', None),
+	('OPTION: Not Stoping on warning message', '-w', None),
+	('EXTENSIONS_LIST: ', '-X %s', '\((.+)\) \|'),
+	('EXTENSIONS_FILE: ', '-x %s', '(.+)'),
+	('SPEED_DELAY: ', '-z %s', '(\d+) miliseconds'),
+)
+
+ARGUMENT_PATTERNS = [re.compile(pattern) if pattern else None
+	for prefix, flag, pattern in ARGUMENT_LINES]
+
+BANNER = 'DIRB v'
+BASE_URL_PREFIX = 'URL_BASE: '
+DIRECTORY_PREFIX = '==> DIRECTORY: '
+FILE_PATTERN = re.compile('\+ (.+) \(CODE:(\d{3})')
+
 def build_clean_path(base_url, path, replace_specials=False):
 	"""Remove the base url value out of a path and optionally replace
-	   any special characters with an underscore character (required to 
+	   any special characters with an underscore character (required to
 	   build 'path_clean').
 
 	   :param base_url: Base URL
@@ -21,127 +57,194 @@ def build_clean_path(base_url, path, replace_specials=False):
 	path = path.replace(base_url, '')
 	return re.sub('[^a-zA-Z0-9]', '_', path) if replace_specials else path
 
+class Section(object):
+	"""The output of a single dirb run against one base URL"""
+
+	def __init__(self):
+		self.base_url = None
+		self.arguments = [None] * len(ARGUMENT_LINES)
+		self.directories = []
+		self.files = []
+		self.headers_state = None
+
+	def add_argument(self, index, line):
+		if self.arguments[index] is not None:
+			return
+		prefix, flag, pattern = ARGUMENT_LINES[index]
+		if pattern is None:
+			self.arguments[index] = flag
+			return
+		match = ARGUMENT_PATTERNS[index].match(line[len(prefix):])
+		if match:
+			self.arguments[index] = flag % match.group(1)
+
+	def command(self):
+		"""Well... since the result output for dirb doesn't give the commands used, I'm gonna have to
+		   do it the hard way! Works backwards from the header lines to derive the command line args
+		   used. Heavily dependent on the version in use. If any of these expected values change,
+		   ARGUMENT_LINES needs to also be updated.
+		"""
+		return 'dirb %s' % ' '.join(filter(None, self.arguments))
+
+	def results(self):
+		base_url = self.base_url or ''
+		parsed_url = urlparse(base_url)
+		port = parsed_url.port if parsed_url.port else 80
+
+		final_results = []
+		for path, response_code in self.directories + self.files:
+			final_results.append({
+				'path': build_clean_path(base_url, path),
+				'path_clean': build_clean_path(base_url, path, True),
+				'port': port,
+				'response_code': response_code,
+				'flag': False,
+			})
+		return parsed_url.hostname, final_results
+
+def scan_lines(lines):
+	"""Reads dirb output in a single pass. A new section starts at each dirb
+	   banner, or at a second base URL within the same section, so the output
+	   of several runs concatenated together is supported.
+
+	   :param lines: Iterable of output lines
+	   :return: Generator of Section objects
+	"""
+	section = Section()
+	for line in lines:
+		line = line.rstrip('\r\n')
+
+		# Result lines make up the bulk of the output, check them first
+		if line.startswith('+ '):
+			match = FILE_PATTERN.match(line)
+			if match:
+				section.files.append(match.groups())
+			continue
+
+		if line.startswith(DIRECTORY_PREFIX):
+			section.directories.append((line[len(DIRECTORY_PREFIX):], '200'))
+			continue
+
+		# The added headers are written between two '--' lines
+		if section.headers_state is not None:
+			state = section.headers_state
+			section.headers_state = None
+			if state == 0 and line == '--':
+				section.headers_state = 1
+				continue
+			if state == 1:
+				if section.arguments[3] is None:
+					section.arguments[3] = ARGUMENT_LINES[3][1] % line
+				continue
+
+		if line.startswith(BANNER) or \
+				(line.startswith(BASE_URL_PREFIX) and section.base_url is not None):
+			if section.base_url is not None:
+				yield section
+				section = Section()
+
+		if line.startswith(BASE_URL_PREFIX):
+			base_url = line[len(BASE_URL_PREFIX):]
+			section.base_url = base_url[:-1] if base_url.endswith('/') else base_url
+			continue
+
+		for index, argument_line in enumerate(ARGUMENT_LINES):
+			if line.startswith(argument_line[0]):
+				if index == 3:
+					section.headers_state = 0
+				else:
+					section.add_argument(index, line)
+				break
+
+	if section.base_url is not None:
+		yield section
+
 def extrapolate_args(contents):
-	"""Well... since the result output for dirb doesn't give the commands used, I'm gonna have to 
-	   do it the hard way! Works backwards from the result output to derive the command line args
-	   used. Heavily dependent on the version in use. If any of these expected values change, the
-	   regex patterns need to also be updated. Not the best, but what are ya gonna do?
+	"""Derives the dirb command line used to produce an output file
 
 	   :param contents: String value of output file
 	"""
-	user_agent_pattern = re.compile('USER_AGENT: (.+)')
-	cookie_pattern = re.compile('COOKIE: (.+)')
-	fine_tuning_pattern = re.compile('OPTION: Fine tunning of NOT_FOUND detection')
-	headers_pattern = re.compile('ADDED_HEADERS:.+\n--\n(.+)\n--')
-	case_sensitivity_pattern = re.compile('OPTION: Using Case-Insensitive Searches')
-	location_pattern = re.compile('OPTION: Printing LOCATION header')
-	not_found_pattern = re.compile('OPTION: Ignoring NOT_FOUND code -> (\d+)')
-	output_file_pattern = re.compile('OUTPUT_FILE: (.+)')
-	proxy_pattern = re.compile('PROXY: (.+)')
-	proxy_auth_pattern = re.compile('PROXY AUTHORIZATION: (.+)')
-	not_recursive_pattern = re.compile('OPTION: Not Recursive')
-	silent_mode_pattern = re.compile('OPTION: Silent Mode')
-	trailing_slash_pattern = re.compile('OPTION: NOT forcing an ending')
-	http_auth_pattern = re.compile('AUTHORIZATION: (.+)')
-	non_existing_pattern = re.compile('OPTION: Show Not Existant Pages')
-	stop_warning_pattern = re.compile('OPTION: Not Stoping on warning message')
-	extension_list_pattern = re.compile('EXTENSIONS_LIST: \((.+)\) \|')
-	extension_file_pattern = re.compile('EXTENSIONS_FILE: (.+)')
-	speed_delay_pattern = re.compile('SPEED_DELAY: (\d+) miliseconds')
-	
-	command_args = []
-	command_args.append('-a %s' % user_agent_pattern.findall(contents)[0] if len(user_agent_pattern.findall(contents)) else None)
-	command_args.append('-c "%s"' % cookie_pattern.findall(contents)[0] if len(cookie_pattern.findall(contents)) else None)
-	command_args.append('-f' if len(fine_tuning_pattern.findall(contents)) else None)
-	command_args.append('-H "%s"' % headers_pattern.findall(contents)[0] if len(headers_pattern.findall(contents)) else None)
-	command_args.append('-i' if len(case_sensitivity_pattern.findall(contents)) else None)
-	command_args.append('-l' if len(location_pattern.findall(contents)) else None)
-	command_args.append('-N %s' % not_found_pattern.findall(contents)[0] if len(not_found_pattern.findall(contents)) else None)
-	command_args.append('-o %s' % output_file_pattern.findall(contents)[0] if len(output_file_pattern.findall(contents)) else None)
-	command_args.append('-p %s' % proxy_pattern.findall(contents)[0] if len(proxy_pattern.findall(contents)) else None)
-	command_args.append('-P %s' % proxy_auth_pattern.findall(contents)[0] if len(proxy_auth_pattern.findall(contents)) else None)
-	command_args.append('-r' if len(not_recursive_pattern.findall(contents)) else None)
-	command_args.append('-S' if len(silent_mode_pattern.findall(contents)) else None)
-	command_args.append('-t' if len(trailing_slash_pattern.findall(contents)) else None)
-	command_args.append('-u %s' % http_auth_pattern.findall(contents)[0] if len(http_auth_pattern.findall(contents)) else None)
-	command_args.append('-v' if len(non_existing_pattern.findall(contents)) else None)
-	command_args.append('-w' if len(stop_warning_pattern.findall(contents)) else None)
-	command_args.append('-X %s' % extension_list_pattern.findall(contents)[0] if len(extension_list_pattern.findall(contents)) else None)
-	command_args.append('-x %s' % extension_file_pattern.findall(contents)[0] if len(extension_file_pattern.findall(contents)) else None)
-	command_args.append('-z %s' % speed_delay_pattern.findall(contents)[0] if len(speed_delay_pattern.findall(contents)) else None)
-
-	return 'dirb %s' % ' '.join(filter(None, command_args))
+	for section in scan_lines(StringIO(contents)):
+		return section.command()
+	return 'dirb '
 
 def extract_data(contents):
 	"""Take the output file contents and parse out the results as well as the commands used.
 
 	:param contents: String value of dirb output file
 	"""
-	base_url_pattern = re.compile('URL_BASE: (.+)(\/)?\n')
-	directory_pattern = re.compile('DIRECTORY: (.+)')
-	file_pattern = re.compile('\+ (.+) \(CODE:(\d{3})')
-
-	arguments = extrapolate_args(contents)
-
-	try:
-		base_url = base_url_pattern.findall(contents)[0]
-
-		# base_url at this point is a tuple, with the 2nd item value 
-		# being the 2nd matched group, so we can disregard that.
-		base_url = base_url[0] if not base_url[0].endswith('/') else base_url[0][:-1]
-		parsed_url = urlparse(base_url)
-		port = parsed_url.port if parsed_url.port else 80
-	except Exception as exception:
-		print exception
-
-	directories = [(x, '200') for x in directory_pattern.findall(contents)]
-	files = file_pattern.findall(contents)
-	results = directories + files
-	final_results = []
-	for record in results:
-		final_results.append({
-			'path': build_clean_path(base_url, record[0]),
-			'path_clean': build_clean_path(base_url, record[0], True),
-			'port': port,
-			'response_code': record[1],
-			'flag': False,
-		})
-	return parsed_url.hostname, arguments, final_results
-
-def parse(project, resource):
-	"""Parses a Dirb file and updates the Lair database
+	for section in scan_lines(StringIO(contents)):
+		hostname, results = section.results()
+		return hostname, section.command(), results
+	return None, extrapolate_args(contents), []
+
+def _read_lines(resource):
+	# Attempt to read resource as a file or string
+	if helper.is_resource(resource):
+		with helper.open_resource(resource) as fh:
+			for line in fh:
+				yield line
+	else:
+		for line in StringIO(resource):
+			yield line
+
+def parse(project, resource, scope=None):
+	"""Parses one or more Dirb files and updates the Lair database
 
 	:param project: The project id
-	:param resource: The output file provided by dirb
+	:param resource: The output file provided by dirb, its contents, or a
+	                 list of either
+	:param scope: Optional Scope; out-of-scope hosts are skipped
 	"""
 
-	# Attempt to parse resource as a file or string
-	try:
-		if os.path.isfile(resource):
-			with open(resource, 'r') as fh:
-				contents = fh.read()
-		else:
-			contents = resource
-	except Exception as exception:
-		print exception
-
-	host_ip, arguments, extracted_data = extract_data(contents)
+	resources = resource if isinstance(resource, (list, tuple)) else [resource]
 
 	# Create the project dictionary which acts as foundation of document
 	project_dict = copy.deepcopy(models.project_model)
 	project_dict['project_id'] = project
 
-	# Pull the command from the file
-	command_dict = copy.deepcopy(models.command_model)
-	command_dict['tool'] = TOOL
-	command_dict['command'] = arguments
-
-	project_dict['commands'].append(command_dict)
-
-	# Proecess host data
-	host_dict = copy.deepcopy(models.host_model)
-	host_dict['string_addr'] = host_ip
-	host_dict['web_directories'] = extracted_data
+	# Hosts and commands are merged across sections so that each is only
+	# added once
+	hosts = dict()
+	seen_directories = dict()
+	commands = list()
+
+	for item in resources:
+		for section in scan_lines(_read_lines(item)):
+			host_ip, extracted_data = section.results()
+
+			# Pull the command from the file
+			arguments = section.command()
+			if arguments not in commands:
+				commands.append(arguments)
+
+			# Don't import an out-of-scope host
+			if scope is not None and host_ip not in scope:
+				continue
+
+			# Proecess host data
+			if host_ip not in hosts:
+				host_dict = copy.deepcopy(models.host_model)
+				host_dict['string_addr'] = host_ip
+				try:
+					host_dict['long_addr'] = helper.ip2long(host_ip)
+				except (socket.error, TypeError):
+					pass
+				host_dict['web_directories'] = []
+				hosts[host_ip] = host_dict
+				seen_directories[host_ip] = set()
+				project_dict['hosts'].append(host_dict)
+
+			for directory in extracted_data:
+				key = (directory['path_clean'], directory['port'], directory['response_code'])
+				if key not in seen_directories[host_ip]:
+					seen_directories[host_ip].add(key)
+					hosts[host_ip]['web_directories'].append(directory)
+
+	for arguments in commands:
+		command_dict = copy.deepcopy(models.command_model)
+		command_dict['tool'] = TOOL
+		command_dict['command'] = arguments
+		project_dict['commands'].append(command_dict)
 
-	project_dict['hosts'].append(host_dict)
 	return project_dict
@@ -45,3 +45,13 @@ class IncompatibleDataVersionError(Exception):
     def __str__(self):
         return "The input file is not a supported version. Expecting " \
                "{0}.".format(self.version)
+
+
+class InvalidScopeError(Exception):
+
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __str__(self):
+        return "Invalid scope entry: {0}. Expecting a CIDR, an address " \
+               "range or a single address.".format(repr(self.entry))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+import json
+import threading
+from datetime import datetime
+from bson.objectid import ObjectId
+
+# Fields api.save sets on every change, left out of the changed fields
+IGNORED_FIELDS = ('last_modified_by',)
+
+
+def _items(value):
+    return sorted(json.dumps(item, sort_keys=True, default=str)
+                  for item in value)
+
+
+def _same(a, b):
+    # api.save rebuilds some lists from sets, which reorders them
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and _items(a) == _items(b)
+    return a == b
+
+
+def changed_fields(before, after):
+    """Lists the fields whose value differs between two versions of a
+    document. Lists are compared regardless of order.
+
+    :param before: The document as it was read
+    :param after: The document as it is saved
+    :return: Sorted list of field names
+    """
+    return sorted(field for field in set(before) | set(after)
+                  if field not in IGNORED_FIELDS and
+                  not _same(before.get(field), after.get(field)))
+
+
+def host_change(action, host, fields=None):
+    """Describes a new or updated host
+
+    :param action: 'new' or 'updated'
+    :param host: The host document saved
+    :param fields: The fields changed, for an update
+    """
+    return {
+        'type': 'host',
+        'action': action,
+        '_id': host['_id'],
+        'string_addr': host['string_addr'],
+        'fields': fields or [],
+    }
+
+
+def port_change(action, host, port, fields=None):
+    """Describes a new or updated port
+
+    :param action: 'new' or 'updated'
+    :param host: The host document the port belongs to
+    :param port: The port document saved
+    :param fields: The fields changed, for an update
+    """
+    return {
+        'type': 'port',
+        'action': action,
+        '_id': port['_id'],
+        'host_id': host['_id'],
+        'string_addr': host['string_addr'],
+        'port': port['port'],
+        'protocol': port['protocol'],
+        'service': port['service'],
+        'fields': fields or [],
+    }
+
+
+def vulnerability_change(action, vuln, hosts_added, fields=None):
+    """Describes a new or updated vulnerability
+
+    :param action: 'new' or 'updated'
+    :param vuln: The vulnerability document saved
+    :param hosts_added: The host keys (string_addr, port, protocol) added to
+                        the vulnerability, all of them for a new one
+    :param fields: The fields changed, for an update
+    """
+    return {
+        'type': 'vulnerability',
+        'action': action,
+        '_id': vuln['_id'],
+        'title': vuln['title'],
+        'plugin_ids': vuln['plugin_ids'],
+        'hosts_added': list(hosts_added),
+        'fields': fields or [],
+    }
+
+
+class ChangeSet(object):
+    """Collects the changes of an import until they are published.
+
+    An import publishes a change set each time it commits, so a
+    checkpointed import publishes several, with the same run id, and the
+    last one is marked complete.
+    """
+
+    def __init__(self, project_id, tool, run=None):
+        self.project_id = project_id
+        self.tool = tool
+        self.run = run or str(ObjectId())
+        self.changes = list()
+
+    def extend(self, changes):
+        self.changes.extend(changes)
+
+    def pop(self, complete):
+        """Returns the changes collected since the last call as a change set
+
+        :param complete: Whether the import is over
+        :return: Dictionary with the run id, project id, tool, time,
+                 completeness, a count of the changes by type and action
+                 under 'summary', and the 'changes'
+        """
+        summary = dict()
+        for change in self.changes:
+            key = '{0}_{1}'.format(change['action'], change['type'])
+            summary[key] = summary.get(key, 0) + 1
+            if change['type'] == 'vulnerability' and change['action'] == 'updated':
+                summary['vulnerability_hosts_added'] = \
+                    summary.get('vulnerability_hosts_added', 0) + \
+                    len(change['hosts_added'])
+
+        change_set = {
+            'run': self.run,
+            'project_id': self.project_id,
+            'tool': self.tool,
+            'time': datetime.utcnow().isoformat(),
+            'complete': complete,
+            'summary': summary,
+            'changes': self.changes,
+        }
+        self.changes = list()
+        return change_set
+
+
+class NDJSONSink(object):
+    """Appends each change set to a file as a line of JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, change_set):
+        line = json.dumps(change_set, default=str) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as fh:
+                fh.write(line)
+
+
+def discard(change_set):
+    """A sink that drops the change sets, e.g. for dry runs"""
+    pass
+
+
+def from_environment():
+    """Returns the sink set by LAIR_CHANGE_FEED, the path of an NDJSON file
+
+    :return: NDJSONSink, or None if there is no feed
+    """
+    path = os.environ.get('LAIR_CHANGE_FEED')
+    return NDJSONSink(path) if path else None
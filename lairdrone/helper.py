@@ -1,6 +1,10 @@
 # Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
 # See the file license.txt for copying permission
 
+import os
+import sys
+import bz2
+import zlib
 import socket
 import struct
 
@@ -21,3 +25,221 @@ def long2ip(n):
     :return: IP address as a dotted-quad string
     """
     return socket.inet_ntoa(struct.pack('!L', n))
+
+
+# Resource name that reads from stdin
+STDIN = '-'
+
+# Compression formats detected by the magic bytes at the start of a file
+COMPRESSION_MAGIC = (
+    ('\x1f\x8b', 'gzip'),
+    ('BZh', 'bz2'),
+    ('\xfd7zXZ\x00', 'xz'),
+)
+MAGIC_SIZE = 6
+
+# Compressed bytes read at a time
+CHUNK_SIZE = 65536
+
+
+def _decompressor(kind):
+    if kind == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if kind == 'bz2':
+        return bz2.BZ2Decompressor()
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            raise IOError("Reading xz input requires the backports.lzma package")
+    return lzma.LZMADecompressor()
+
+
+class DecompressingReader(object):
+    """Read-only file object that decompresses a stream as it is read.
+    Concatenated compressed streams (e.g. from 'cat a.gz b.gz') are read
+    one after the other. The bytes already read from the stream to detect
+    the compression are passed in as head.
+    """
+
+    def __init__(self, fh, kind, head=''):
+        self.fh = fh
+        self.kind = kind
+        self.decompressor = _decompressor(kind)
+        self.pending = head
+        self.buf = ''
+        self.offset = 0
+        self.seekable = fh is not sys.stdin
+
+    def _more(self):
+        # Adds decompressed data to buf, returns False at the end of input
+        while True:
+            data = self.pending or self.fh.read(CHUNK_SIZE)
+            self.pending = ''
+            if not data:
+                return False
+
+            try:
+                out = self.decompressor.decompress(data)
+            except EOFError:
+                # The previous stream ended exactly at a chunk boundary
+                self.decompressor = _decompressor(self.kind)
+                out = self.decompressor.decompress(data)
+
+            if self.decompressor.unused_data:
+                # Another compressed stream follows
+                self.pending = self.decompressor.unused_data
+                self.decompressor = _decompressor(self.kind)
+
+            if out:
+                self.buf += out
+                return True
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buf) < size) and self._more():
+            pass
+        if size < 0:
+            data, self.buf = self.buf, ''
+        else:
+            data, self.buf = self.buf[:size], self.buf[size:]
+        self.offset += len(data)
+        return data
+
+    def readline(self, size=-1):
+        start = 0
+        while True:
+            end = self.buf.find('\n', start)
+            if end >= 0:
+                end += 1
+                break
+            start = len(self.buf)
+            if not self._more():
+                end = len(self.buf)
+                break
+        if 0 <= size < end:
+            end = size
+        data, self.buf = self.buf[:end], self.buf[end:]
+        self.offset += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def tell(self):
+        if not self.seekable:
+            raise IOError("Compressed input from a stream cannot be rewound")
+        return self.offset
+
+    def seek(self, offset, whence=0):
+        # Only rewinding is supported; the stream is decompressed again
+        if not self.seekable or offset != 0 or whence != 0:
+            raise IOError("Compressed input can only be rewound to the start")
+        self.fh.seek(0)
+        self.decompressor = _decompressor(self.kind)
+        self.pending = ''
+        self.buf = ''
+        self.offset = 0
+
+    def close(self):
+        if self.fh is not sys.stdin:
+            self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class StdinReader(object):
+    """Uncompressed stdin, with the bytes read to detect compression put
+    back in front"""
+
+    def __init__(self, head):
+        self.head = head
+
+    def read(self, size=-1):
+        if not self.head:
+            return sys.stdin.read(size)
+        if size < 0:
+            data, self.head = self.head + sys.stdin.read(), ''
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        if len(data) < size:
+            data += sys.stdin.read(size - len(data))
+        return data
+
+    def readline(self, size=-1):
+        if not self.head:
+            return sys.stdin.readline(size)
+        if '\n' in self.head:
+            end = self.head.index('\n') + 1
+        else:
+            end = len(self.head)
+        if 0 <= size < end:
+            end = size
+        data, self.head = self.head[:end], self.head[end:]
+        if not data.endswith('\n') and not self.head and \
+                (size < 0 or len(data) < size):
+            data += sys.stdin.readline(size - len(data) if size >= 0 else -1)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def is_resource(resource):
+    """Checks if a resource names input to be opened with open_resource,
+    rather than holding the content itself
+
+    :param resource: A file path, or '-' for stdin
+    """
+    return isinstance(resource, basestring) and \
+        (resource == STDIN or os.path.isfile(resource))
+
+
+def is_plain_file(resource):
+    """Checks if a resource is an uncompressed file on disk, which can be
+    memory mapped and read at any offset
+
+    :param resource: A file path, or '-' for stdin
+    """
+    if resource == STDIN or not is_resource(resource):
+        return False
+    with open(resource, 'rb') as fh:
+        head = fh.read(MAGIC_SIZE)
+    return not any(head.startswith(magic) for magic, kind in COMPRESSION_MAGIC)
+
+
+def open_resource(resource):
+    """Opens a file, or stdin for '-', for reading. gzip, bzip2 and xz input
+    is detected by its magic bytes and decompressed while it is read, so it
+    never has to be decompressed to disk first.
+
+    :param resource: A file path, or '-' for stdin
+    :return: A file object
+    """
+    fh = sys.stdin if resource == STDIN else open(resource, 'rb')
+
+    head = fh.read(MAGIC_SIZE)
+    for magic, kind in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return DecompressingReader(fh, kind, head)
+
+    if fh is sys.stdin:
+        return StdinReader(head)
+
+    fh.seek(0)
+    return fh
+
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+from pymongo import ASCENDING, DESCENDING
+
+# Every index the drones rely on, as (collection, keys). Built once per
+# database by 'drone-db init' rather than on every import.
+INDEXES = (
+    ('hosts', [('project_id', ASCENDING), ('string_addr', ASCENDING)]),
+    ('ports', [('project_id', ASCENDING), ('host_id', ASCENDING),
+               ('port', ASCENDING), ('protocol', ASCENDING)]),
+    ('vulnerabilities', [('project_id', ASCENDING),
+                         ('plugin_ids.id', ASCENDING)]),
+    ('web_directories', [('project_id', ASCENDING), ('host_id', ASCENDING),
+                         ('path_clean', ASCENDING), ('port', ASCENDING),
+                         ('response_code', ASCENDING)]),
+    ('drone_log', [('project_id', ASCENDING), ('created', ASCENDING),
+                   ('seq', ASCENDING)]),
+)
+
+# The shape of every query the drones issue, as (collection, filter, sort,
+# issued by), checked by 'drone-db verify'. Only the fields and operators
+# matter, not the values. Lookups by _id are left out.
+QUERIES = (
+    ('hosts', {'project_id': '', 'string_addr': ''}, None,
+     'api.save host lookup'),
+    ('hosts', {'project_id': ''}, [('string_addr', ASCENDING)],
+     'api.iter_hosts'),
+    ('ports', {'project_id': '', 'host_id': '', 'port': 0, 'protocol': ''},
+     None, 'api.save port lookup'),
+    ('ports', {'project_id': '', 'host_id': {'$in': ['']}},
+     [('host_id', ASCENDING), ('port', ASCENDING), ('protocol', ASCENDING)],
+     'api.iter_ports'),
+    ('vulnerabilities',
+     {'project_id': '', 'plugin_ids': {'$all': [
+         {'$elemMatch': {'tool': '', 'id': ''}}]}},
+     None, 'api.save vulnerability lookup'),
+    ('vulnerabilities', {'project_id': ''}, None, 'api.iter_vulnerabilities'),
+    ('web_directories', {'project_id': '', 'host_id': ''}, None,
+     'api.merge_web_directories'),
+    ('web_directories', {'project_id': '', 'host_id': {'$in': ['']}},
+     [('host_id', ASCENDING)], 'api.iter_web_directories'),
+    ('drone_log', {'project_id': ''},
+     [('created', DESCENDING), ('seq', DESCENDING)], 'api.get_drone_log'),
+)
+
+
+def _key(keys):
+    return [(field, int(direction)) for field, direction in keys]
+
+
+def missing_indexes(db, collection_names=None):
+    """Lists the indexes of the manifest the database lacks
+
+    :param db: A connection to the target Lair database
+    :param collection_names: Names of the existing collections, if known
+    :return: List of (collection, keys). Collections that do not exist are
+             skipped, web_directories for one only exists on Lair servers
+             that support it.
+    """
+    if collection_names is None:
+        collection_names = db.collection_names()
+    missing = list()
+    for collection, keys in INDEXES:
+        if collection not in collection_names:
+            continue
+        existing = [_key(index['key'])
+                    for index in db[collection].index_information().values()]
+        if _key(keys) not in existing:
+            missing.append((collection, keys))
+    return missing
+
+
+def init(db):
+    """Creates the drone_log collection and the missing indexes, built in
+    the background so the database stays available
+
+    :param db: A connection to the target Lair database
+    :return: List of (collection, keys) of the indexes created
+    """
+    from lairdrone import api
+    collection_names = db.collection_names()
+    api.ensure_drone_log(db, collection_names)
+    collection_names = db.collection_names()
+
+    created = missing_indexes(db, collection_names)
+    for collection, keys in created:
+        db[collection].create_index(keys, background=True)
+    return created
+
+
+def _stages(plan):
+    # Walks the stages of an explain() plan
+    yield plan
+    for field in ('inputStage', 'outerStage', 'innerStage'):
+        if field in plan:
+            for stage in _stages(plan[field]):
+                yield stage
+    for field in ('inputStages', 'shards'):
+        for child in plan.get(field, []):
+            for stage in _stages(child.get('winningPlan', child)):
+                yield stage
+
+
+def scanning_queries(db, collection_names=None):
+    """Explains every query of the manifest and lists the ones that would
+    scan a collection or sort in memory
+
+    :param db: A connection to the target Lair database
+    :param collection_names: Names of the existing collections, if known
+    :return: List of (collection, issued by, problem)
+    """
+    if collection_names is None:
+        collection_names = db.collection_names()
+    problems = list()
+    for collection, q, sort, issued_by in QUERIES:
+        if collection not in collection_names:
+            continue
+        cursor = db[collection].find(q)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = cursor.explain()
+        plan = explain.get('queryPlanner', {}).get('winningPlan', {})
+        stages = set(stage.get('stage') for stage in _stages(plan))
+        if 'COLLSCAN' in stages:
+            problems.append((collection, issued_by, 'scans the collection'))
+        elif 'SORT' in stages:
+            problems.append((collection, issued_by, 'sorts in memory'))
+    return problems
+
+
+def verify(db):
+    """Checks that the database has every index of the manifest and that no
+    drone query would scan a collection
+
+    :param db: A connection to the target Lair database
+    :return: Tuple of the missing indexes and the scanning queries
+    """
+    collection_names = db.collection_names()
+    return (missing_indexes(db, collection_names),
+            scanning_queries(db, collection_names))
+
+
+def describe(keys):
+    """Formats index keys, e.g. project_id_1_string_addr_1
+
+    :param keys: List of (field, direction)
+    """
+    return '_'.join('%s_%s' % (field, int(direction))
+                    for field, direction in keys)
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+import json
+import hashlib
+import threading
+
+FORMAT_VERSION = 2
+
+# Documents fetched per query by _id
+FETCH_BATCH_SIZE = 1000
+
+# Fields each collection is matched on
+KEY_FIELDS = {
+    'hosts': ('string_addr',),
+    'ports': ('host_id', 'port', 'protocol'),
+    'vulnerabilities': ('plugin_ids',),
+}
+
+
+def digest(document):
+    """Digest of a parsed host or vulnerability, to tell if it changed
+    since the last import
+
+    :param document: The parsed document
+    """
+    text = json.dumps(document, sort_keys=True, default=str, encoding='latin-1')
+    return hashlib.sha1(text).hexdigest()
+
+
+def port_key(host_id, port, protocol):
+    return json.dumps([host_id, port, protocol])
+
+
+def plugin_key(plugin_id):
+    return json.dumps([plugin_id.get('tool'), plugin_id.get('id')])
+
+
+def fetch(collection, ids, projection=None):
+    """Fetches documents by _id, a batch of FETCH_BATCH_SIZE per query
+
+    :param collection: The collection to read
+    :param ids: The _ids of the documents
+    :param projection: Optional fields to fetch
+    :return: Dictionary of _id to document
+    """
+    ids = list(ids)
+    documents = dict()
+    for start in xrange(0, len(ids), FETCH_BATCH_SIZE):
+        q = {'_id': {'$in': ids[start:start + FETCH_BATCH_SIZE]}}
+        for document in collection.find(q, projection):
+            documents[document['_id']] = document
+    return documents
+
+
+class Mirror(object):
+    """A local copy of the keys api.save matches a project's hosts, ports
+    and vulnerabilities on, kept in a JSON file.
+
+    The mirror tells which documents exist, so api.save fetches the ones
+    it merges with a query per batch rather than one per document, and
+    does not query for new ones. Digests of the hosts and vulnerabilities
+    imported last let an import skip the ones that did not change.
+
+    refresh() reads the _ids of the project's documents, which may be
+    ObjectIds or the random strings the Lair UI creates, and compares them
+    with the mirror: the keys of the documents added since the last refresh
+    are fetched, and the documents deleted since are dropped along with the
+    digests that covered them. Changes made in place, e.g. a host's address
+    edited in the Lair UI, are not seen; removing the mirror file fetches
+    every key again.
+    """
+
+    def __init__(self, path, project_id):
+        self.path = path
+        self.project_id = project_id
+        # key -> _id, or set of _ids for plugin keys
+        self.keys = {'hosts': dict(), 'ports': dict(),
+                     'vulnerabilities': dict()}
+        # key -> digest of the parsed document last imported
+        self.digests = {'hosts': dict(), 'vulnerabilities': dict()}
+        # documents fetched by prefetch, and saved since
+        self.stored = {'hosts': dict(), 'ports': dict(),
+                       'vulnerabilities': dict()}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Reads the mirror file, if any"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as fh:
+            data = json.load(fh)
+        if data.get('version') != FORMAT_VERSION or \
+                data.get('project_id') != self.project_id:
+            return
+        self.keys['hosts'] = data['hosts']
+        self.keys['ports'] = data['ports']
+        self.keys['vulnerabilities'] = dict(
+            (key, set(ids)) for key, ids in data['vulnerabilities'].items())
+        self.digests = data['digests']
+
+    def save(self):
+        """Writes the mirror file, replacing it in a single rename"""
+        data = {
+            'version': FORMAT_VERSION,
+            'project_id': self.project_id,
+            'hosts': self.keys['hosts'],
+            'ports': self.keys['ports'],
+            'vulnerabilities': dict(
+                (key, sorted(ids))
+                for key, ids in self.keys['vulnerabilities'].items()),
+            'digests': self.digests,
+        }
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(temp, 'w') as fh:
+            json.dump(data, fh)
+        os.rename(temp, self.path)
+
+    def _ids(self, collection):
+        if collection == 'vulnerabilities':
+            return set().union(*self.keys[collection].values())
+        return set(self.keys[collection].values())
+
+    def _add(self, collection, document):
+        keys = self.keys[collection]
+        if collection == 'hosts':
+            keys[document['string_addr']] = document['_id']
+        elif collection == 'ports':
+            keys[port_key(document['host_id'], document['port'],
+                          document['protocol'])] = document['_id']
+        else:
+            for plugin_id in document.get('plugin_ids', []):
+                keys.setdefault(plugin_key(plugin_id), set()).add(document['_id'])
+
+    def _remove(self, collection, ids):
+        # Drops the keys of deleted documents and the digests covering them:
+        # a host's digest covers its ports, a vulnerability's its plugin ids
+        keys = self.keys[collection]
+        if collection == 'vulnerabilities':
+            removed = set()
+            for key, vuln_ids in keys.items():
+                if vuln_ids & ids:
+                    removed.add(key)
+                    vuln_ids -= ids
+                    if not vuln_ids:
+                        del keys[key]
+            digests = self.digests['vulnerabilities']
+            for key in digests.keys():
+                if removed.intersection(json.loads(key)):
+                    del digests[key]
+            return
+
+        removed = [key for key, _id in keys.items() if _id in ids]
+        for key in removed:
+            del keys[key]
+        if collection == 'hosts':
+            addresses = removed
+        else:
+            host_ids = set(json.loads(key)[0] for key in removed)
+            addresses = [address for address, _id in self.keys['hosts'].items()
+                         if _id in host_ids]
+        for address in addresses:
+            self.digests['hosts'].pop(address, None)
+
+    def refresh(self, db):
+        """Brings the keys up to date with the database. Only the _ids of
+        the project's documents are read, and the keys of the new ones.
+
+        :param db: A connection to the target Lair database
+        :return: Number of documents whose keys were fetched
+        """
+        fetched = 0
+        for collection, fields in sorted(KEY_FIELDS.items()):
+            q = {'project_id': self.project_id}
+            stored = set(document['_id']
+                         for document in db[collection].find(q, {'_id': 1}))
+            known = self._ids(collection)
+            if known - stored:
+                self._remove(collection, known - stored)
+
+            projection = dict((field, 1) for field in fields)
+            added = fetch(db[collection], stored - known, projection)
+            for document in added.values():
+                self._add(collection, document)
+            fetched += len(added)
+        return fetched
+
+    def unchanged_host(self, file_host, value):
+        """Tells if a parsed host has the digest of the one imported last
+        for its address, and the stored host still exists
+
+        :param file_host: The parsed host
+        :param value: Its digest
+        """
+        return file_host['string_addr'] in self.keys['hosts'] and \
+            self.digests['hosts'].get(file_host['string_addr']) == value
+
+    def unchanged_vulnerability(self, file_vuln, value):
+        """Tells if a parsed vulnerability has the digest of the one
+        imported last with its plugin ids, and the stored one still exists
+
+        :param file_vuln: The parsed vulnerability
+        :param value: Its digest
+        """
+        return bool(self.candidates(file_vuln['plugin_ids'])) and \
+            self.digests['vulnerabilities'].get(
+                vulnerability_key(file_vuln)) == value
+
+    def imported_host(self, file_host, value):
+        """Records the digest of a parsed host once it is saved"""
+        with self.lock:
+            self.digests['hosts'][file_host['string_addr']] = value
+
+    def imported_vulnerability(self, file_vuln, value):
+        """Records the digest of a parsed vulnerability once it is saved"""
+        with self.lock:
+            self.digests['vulnerabilities'][vulnerability_key(file_vuln)] = value
+
+    def prefetch(self, db, hosts=(), vulns=()):
+        """Fetches the stored documents the parsed hosts and their ports,
+        or the parsed vulnerabilities, will be merged with
+
+        :param db: A connection to the target Lair database
+        :param hosts: Parsed hosts
+        :param vulns: Parsed vulnerabilities
+        """
+        host_ids = [self.keys['hosts'][host['string_addr']] for host in hosts
+                    if host['string_addr'] in self.keys['hosts']]
+        stored_hosts = fetch(db.hosts, host_ids)
+
+        port_ids = list()
+        for host in hosts:
+            host_id = self.keys['hosts'].get(host['string_addr'])
+            if host_id not in stored_hosts:
+                continue
+            for port in host['ports']:
+                key = port_key(host_id, port['port'], port['protocol'])
+                if key in self.keys['ports']:
+                    port_ids.append(self.keys['ports'][key])
+
+        vuln_ids = set()
+        for vuln in vulns:
+            vuln_ids.update(self.candidates(vuln['plugin_ids']))
+
+        self.stored = {
+            'hosts': dict((host['string_addr'], host)
+                          for host in stored_hosts.values()),
+            'ports': dict((port_key(port['host_id'], port['port'],
+                                    port['protocol']), port)
+                          for port in fetch(db.ports, port_ids).values()),
+            'vulnerabilities': fetch(db.vulnerabilities, vuln_ids),
+        }
+
+    def candidates(self, plugin_ids):
+        """The ids of the stored vulnerabilities with all of the plugin ids"""
+        found = [self.keys['vulnerabilities'].get(plugin_key(plugin_id), set())
+                 for plugin_id in plugin_ids]
+        return set.intersection(*found) if found else set()
+
+    def stored_host(self, string_addr):
+        return self.stored['hosts'].get(string_addr)
+
+    def stored_port(self, host_id, port, protocol):
+        return self.stored['ports'].get(port_key(host_id, port, protocol))
+
+    def stored_vulnerability(self, plugin_ids):
+        # The oldest of the vulnerabilities with all of the plugin ids
+        ids = [i for i in self.candidates(plugin_ids)
+               if i in self.stored['vulnerabilities']]
+        return self.stored['vulnerabilities'][min(ids)] if ids else None
+
+    def saved_host(self, host):
+        with self.lock:
+            self.stored['hosts'][host['string_addr']] = host
+            self._add('hosts', host)
+
+    def saved_port(self, port):
+        with self.lock:
+            self.stored['ports'][port_key(port['host_id'], port['port'],
+                                          port['protocol'])] = port
+            self._add('ports', port)
+
+    def saved_vulnerability(self, vuln):
+        with self.lock:
+            self.stored['vulnerabilities'][vuln['_id']] = vuln
+            self._add('vulnerabilities', vuln)
+
+
+def vulnerability_key(vuln):
+    """The key a parsed vulnerability's digest is recorded under"""
+    return json.dumps(sorted(plugin_key(plugin_id)
+                             for plugin_id in vuln['plugin_ids']))
+
+
+def from_environment(db, project_id):
+    """Returns the mirror of a project in the LAIR_MIRROR directory
+
+    :param db: A connection to the target Lair database
+    :param project_id: The project id
+    :return: Mirror, or None if LAIR_MIRROR is not set
+    """
+    directory = os.environ.get('LAIR_MIRROR')
+    if not directory:
+        return None
+    name = '{0}-{1}.json'.format(db.name, project_id)
+    return Mirror(os.path.join(directory, name), project_id)
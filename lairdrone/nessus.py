@@ -2,13 +2,15 @@
 # Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
 # See the file license.txt for copying permission
 
-import xml.etree.ElementTree as et
 import re
 import copy
-import requests
 import os
+import mmap
+import itertools
+import multiprocessing
 from lairdrone import drone_models as models
 from lairdrone import helper
+from lairdrone import xmlbackend as et
 
 OS_WEIGHT = 75
 TOOL = "nessus"
@@ -17,12 +19,32 @@ PLUGINSEARCHKEY = ""
 
 NESSUS_REPLACEMENT = "The testing team"
 
+# Smallest file read by several processes; below it starting them costs
+# more than it saves
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+
+# Chunks per process, so a process that draws hosts with many findings
+# does not hold up the others, and the largest chunk a process parses at
+# once
+CHUNKS_PER_WORKER = 4
+MAX_CHUNK_SIZE = 32 * 1024 * 1024
+
+# Tags found when splitting a file at host boundaries
+REPORT_HOST_TAG = re.compile(r'<ReportHost[\s>]')
+PROLOG_TAG = re.compile(r'<\?xml[^>]*\?>')
+ROOT_TAG = re.compile(r'<NessusClientData_v2(\s[^>]*)?>')
+REPORT_TAG = re.compile(r'<Report(\s[^>]*)?>')
+
 DEBUG = os.environ.get('DRONE_DEBUG') != ''
 
 nessus_links = {}
 
 def is_paranoid(plugin_id):
     global PLUGINSEARCHKEY
+
+    # requests is only imported when a lookup is needed
+    import requests
+
     if not PLUGINSEARCHKEY:
         r = requests.get('https://www.tenable.com/plugins', timeout=5)
         match = re.search('"buildId":"([^"]*)"', r.text)
@@ -56,42 +78,295 @@ def is_paranoid(plugin_id):
         return False
 
 
-def parse(project, nessus_file, include_informational=False, min_note_sev=2):
-    """Parses a Nessus XMLv2 file and updates the Hive database
+# Child elements of a 'ReportItem' holding a single text value. Every item
+# record is pre-sized with these keys so that a missing element reads as None.
+ITEM_TEXT_FIELDS = (
+    'plugin_output',
+    'description',
+    'solution',
+    'exploit_available',
+    'exploit_framework_metasploit',
+    'metasploit_name',
+    'exploit_framework_canvas',
+    'canvas_package',
+    'exploit_framework_core',
+    'core_name',
+    'exploit_framework_exploithub',
+    'exploithub_sku',
+    'cvss_base_score',
+    'risk_factor',
+)
 
-    :param project: The project id
-    :param nessus_file: The Nessus xml file to be parsed
-    :param include_informational: Whether to include info findings in data. Default False
-    :min_note_sev: The minimum severity of notes that will be saved. Default 2
+# Child elements of a 'ReportItem' that may repeat
+ITEM_LIST_FIELDS = ('see_also', 'cve', 'edb-id')
+
+# Exploit framework flag, module name element and note title, in the order
+# the notes are added to a vulnerability
+EXPLOIT_FRAMEWORKS = (
+    ('exploit_framework_metasploit', 'metasploit_name', 'Metasploit Exploit'),
+    ('exploit_framework_canvas', 'canvas_package', 'Canvas Exploit'),
+    ('exploit_framework_core', 'core_name', 'Core Impact Exploit'),
+    ('exploit_framework_exploithub', 'exploithub_sku', 'Exploit Hub Exploit'),
+)
+
+# CVSS score used when a plugin only reports a risk factor
+RISK_FACTOR_CVSS = {
+    'Low': 3.0,
+    'Medium': 5.0,
+    'High': 7.5,
+    'Critical': 10.0,
+}
+
+
+def _set_text(record, elem):
+    record[elem.tag] = elem.text if elem.text is not None else ''
+
+
+def _append_text(record, elem):
+    record[elem.tag].append(elem.text if elem.text is not None else '')
+
+
+# Maps a 'ReportItem' child tag to the handler storing it in the item record
+ITEM_DISPATCH = dict(
+    [(field, _set_text) for field in ITEM_TEXT_FIELDS] +
+    [(field, _append_text) for field in ITEM_LIST_FIELDS]
+)
+
+
+def _host_os(host_dict, text):
+    os_dict = dict(models.os_model)
+    os_dict['tool'] = TOOL
+    os_dict['weight'] = OS_WEIGHT
+    os_dict['fingerprint'] = text
+    host_dict['os'].append(os_dict)
+
+
+def _host_ip(host_dict, text):
+    host_dict['string_addr'] = text
+    host_dict['long_addr'] = helper.ip2long(text)
+
+
+def _host_mac(host_dict, text):
+    host_dict['mac_addr'] = text
+
+
+def _host_name(host_dict, text):
+    host_dict['hostnames'].append(text)
+
+
+# Maps the 'name' attribute of a HostProperties 'tag' to its handler
+HOST_TAG_DISPATCH = {
+    'operating-system': _host_os,
+    'host-ip': _host_ip,
+    'mac-address': _host_mac,
+    'host-fqdn': _host_name,
+    'netbios-name': _host_name,
+}
+
+
+def read_host_properties(host, host_dict):
+    """Populates a host dictionary from the HostProperties of a 'ReportHost'
+
+    :param host: The 'ReportHost' element
+    :param host_dict: The host model to update
     """
+    properties = host.find('HostProperties')
+    if properties is None:
+        return
 
-    cve_pattern = re.compile(r'(CVE-|CAN-)')
-    false_udp_pattern = re.compile(r'.*\?$')
+    for tag in properties:
+        handler = HOST_TAG_DISPATCH.get(tag.attrib.get('name'))
+        if handler is not None:
+            handler(host_dict, tag.text)
 
-    tree = et.parse(nessus_file)
-    root = tree.getroot()
-    note_id = 1
 
-    # Create the project dictionary which acts as foundation of document
-    project_dict = dict(models.project_model)
-    project_dict['commands'] = list()
-    project_dict['vulnerabilities'] = list()
-    project_dict['project_id'] = project
+def read_report_item(item):
+    """Collects the children of a 'ReportItem' in a single pass
 
-    # Used to maintain a running list of host:port vulnerabilities by plugin
-    vuln_host_map = dict()
+    :param item: The 'ReportItem' element
+    :return: Dictionary of child text keyed by tag name
+    """
+    record = dict.fromkeys(ITEM_TEXT_FIELDS)
+    for field in ITEM_LIST_FIELDS:
+        record[field] = list()
 
-    # Structure:
-    # vuln_host_map = {
-    #     plugin_id: {
-    #         'hosts': []
-    #         'tags'
-    #         'vuln': vuln-object
-    #         'evidence': [evidence_text] # unique set of evidence texts
-    #     }
-    # }
+    for child in item:
+        handler = ITEM_DISPATCH.get(child.tag)
+        if handler is not None:
+            handler(record, child)
+
+    return record
+
+
+def get_cvss(record):
+    """Returns the CVSS score of a 'ReportItem' record, falling back to
+    the risk factor when no base score is reported
+
+    :param record: The record returned by read_report_item
+    """
+    if record['cvss_base_score'] is not None:
+        return float(record['cvss_base_score'])
+    return RISK_FACTOR_CVSS.get(record['risk_factor'], 0)
+
+
+def resolve_see_also(links):
+    """Builds the 'Additional Resources' list appended to a solution,
+    following nessus.org redirects
 
-    for host in root.iter('ReportHost'):
+    :param links: The text of each 'see_also' element
+    """
+    text = ''
+    for sa in links:
+        for link in sa.split('\n'):
+            if DEBUG:
+                print "resolving: %s" % link
+            if link in nessus_links:
+                if DEBUG:
+                    print "link is in cache: %s -> %s" % (link, nessus_links[link])
+                text += "\n- <" + nessus_links[link] + ">"
+
+            elif 'nessus.org' in link:
+                import requests
+                reslink = link
+                try:
+                    resp = requests.get(link, timeout=10)
+                    if resp.ok:
+                        reslink = resp.url
+                        nessus_links[link] = reslink
+                except Exception as e:
+                    print('Omitting link "{}" which failed to resolve: {}\n'.format(link, str(e)))
+                    nessus_links[link] = link
+                    continue
+
+                text += "\n- <" + reslink + ">"
+
+            else:
+                text += "\n- <" + link + ">"
+
+    return text
+
+
+def build_vulnerability(plugin_id, title, record, cvss):
+    """Creates the vulnerability model for a plugin. Only called for
+    plugins that are kept in the output.
+
+    :param plugin_id: The Nessus plugin id
+    :param title: The plugin name
+    :param record: The record returned by read_report_item
+    :param cvss: The CVSS score returned by get_cvss
+    """
+    cve_pattern = re.compile(r'(CVE-|CAN-)')
+
+    v = copy.deepcopy(models.vulnerability_model)
+    v['cves'] = list()
+    v['seealsos'] = list()
+    v['plugin_ids'] = list()
+    v['identified_by'] = list()
+    v['hosts'] = list()
+    v['tags'] = []
+
+    # Set the title
+    v['title'] = title
+
+    # Set the description
+    if record['description'] is not None:
+        # convert the weird 5 spaces into 1
+        description_text = record['description'].replace('     ', ' ')
+        # convert 3 spaces into 1, first seen on pluginID="121602"
+        description_text = description_text.replace('   ', ' ')
+
+        description_text = description_text.replace("Nessus", NESSUS_REPLACEMENT)
+        v['description'] = description_text
+
+    # Set the solution
+    if record['solution'] is not None:
+        v['solution'] = record['solution'].replace("Nessus", NESSUS_REPLACEMENT)
+
+    # Append see_also references to solution
+    if record['see_also']:
+        v['solution'] += '\n\nAdditional Resources:\n'
+        v['solution'] += resolve_see_also(record['see_also'])
+
+    # Set the vulnerability flag if exploit exists
+    if record['exploit_available'] is not None:
+        v['flag'] = record['exploit_available'] == 'true'
+
+        # Grab Metasploit, Canvas, Core Impact and ExploitHub details
+        for flag, module, note_title in EXPLOIT_FRAMEWORKS:
+            if record[flag] == 'true':
+                note_dict = copy.deepcopy(models.note_model)
+                note_dict['title'] = note_title
+                note_dict['content'] = 'Exploit exists. Details unknown.'
+                if record[module] is not None:
+                    note_dict['content'] = record[module]
+                note_dict['last_modified_by'] = TOOL
+                v['notes'].append(note_dict)
+
+        # Grab any and all ExploitDB IDs
+        for module in record['edb-id']:
+            note_dict = copy.deepcopy(models.note_model)
+            note_dict['title'] = 'Exploit-DB Exploit ' \
+                                 '({0})'.format(module)
+            note_dict['content'] = module
+            note_dict['last_modified_by'] = TOOL
+            v['notes'].append(note_dict)
+
+    # Set the CVSS score
+    v['cvss'] = cvss
+
+    # Set the CVE(s)
+    for cve in record['cve']:
+        v['cves'].append(cve_pattern.sub('', cve))
+
+    # Set the plugin information
+    plugin_dict = dict(models.plugin_id_model)
+    plugin_dict['tool'] = TOOL
+    plugin_dict['id'] = plugin_id
+    v['plugin_ids'].append(plugin_dict)
+
+    # Set the identified by information
+    identified_dict = dict(models.identified_by_model)
+    identified_dict['tool'] = TOOL
+    identified_dict['id'] = plugin_id
+    v['identified_by'].append(identified_dict)
+
+    return v
+
+
+def read_hosts(hosts, include_informational=False, min_note_sev=2,
+               scope=None, force=frozenset()):
+    """Reads 'ReportHost' elements on their own, without the state that
+    spans the whole file, so that the chunks of a file can be read in
+    parallel. merge_hosts combines the results in file order.
+
+    Port notes are numbered by merge_hosts. A plugin is kept or dropped by
+    the informational filter on its first item in the chunk, which may not
+    be its first item in the file; plugins in force are kept regardless.
+
+    :param hosts: Iterable of 'ReportHost' elements
+    :param include_informational: Whether to include info findings
+    :param min_note_sev: The minimum severity of notes that will be saved
+    :param scope: Optional Scope; out-of-scope hosts are skipped
+    :param force: Plugin ids whose items are kept even if informational
+    :return: Dictionary of the 'hosts', the port 'notes' as (note, title)
+             pairs, the first scan 'command' or None, the plugin ids in the
+             order they were first seen as 'plugins', their first item as
+             (title, record, cvss) in 'first' (None if dropped) and their
+             items as (evidence, evidence host, host:port:protocol, target
+             hostname) in 'occurrences'
+    """
+    false_udp_pattern = re.compile(r'.*\?$')
+
+    part = {
+        'hosts': list(),
+        'notes': list(),
+        'command': None,
+        'plugins': list(),
+        'first': dict(),
+        'occurrences': dict(),
+    }
+
+    for host in hosts:
         temp_ip = host.attrib['name']
 
         if DEBUG:
@@ -102,39 +377,18 @@ def parse(project, nessus_file, include_informational=False, min_note_sev=2):
         host_dict['ports'] = list()
         host_dict['hostnames'] = list()
 
-        target_hostname = None
-
         # Tags contain host-specific information
-        for tag in host.iter('tag'):
+        read_host_properties(host, host_dict)
 
-            # Operating system tag
-            if tag.attrib['name'] == 'operating-system':
-                os_dict = dict(models.os_model)
-                os_dict['tool'] = TOOL
-                os_dict['weight'] = OS_WEIGHT
-                os_dict['fingerprint'] = tag.text
-                host_dict['os'].append(os_dict)
+        # Don't import out-of-scope hosts
+        if scope is not None and \
+                (host_dict['string_addr'] or temp_ip) not in scope:
+            continue
 
-            # IP address tag
-            if tag.attrib['name'] == 'host-ip':
-                host_dict['string_addr'] = tag.text
-                host_dict['long_addr'] = helper.ip2long(tag.text)
-
-                # If hostname was used for target, save it for later use
-                if tag.text != temp_ip:
-                    target_hostname = temp_ip
-
-            # MAC address tag
-            if tag.attrib['name'] == 'mac-address':
-                host_dict['mac_addr'] = tag.text
-
-            # Hostname tag
-            if tag.attrib['name'] == 'host-fqdn':
-                host_dict['hostnames'].append(tag.text)
-
-            # NetBIOS name tag
-            if tag.attrib['name'] == 'netbios-name':
-                host_dict['hostnames'].append(tag.text)
+        # If hostname was used for target, save it for later use
+        target_hostname = None
+        if host_dict['string_addr'] and host_dict['string_addr'] != temp_ip:
+            target_hostname = temp_ip
 
         # Track the unique port/protocol combos for a host so we don't
         # add duplicate entries
@@ -150,7 +404,6 @@ def parse(project, nessus_file, include_informational=False, min_note_sev=2):
             port = int(item.attrib['port'])
             protocol = item.attrib['protocol']
             service = item.attrib['svc_name']
-            evidence = item.find('plugin_output')
 
             if DEBUG:
                 print port, title
@@ -159,17 +412,21 @@ def parse(project, nessus_file, include_informational=False, min_note_sev=2):
             if protocol == "udp" and false_udp_pattern.match(service):
                 continue
 
+            record = read_report_item(item)
+            evidence = record['plugin_output']
+
             # Create a port model and temporarily store it in the dict
             # for tracking purposes. The ports_processed dict is used
             # later to add ports to the host so that no duplicates are
             # present. This is necessary due to the format of the Nessus
             # XML files.
-            if '{0}:{1}'.format(port, protocol) not in ports_processed:
+            port_key = '{0}:{1}'.format(port, protocol)
+            if port_key not in ports_processed:
                 port_dict = copy.deepcopy(models.port_model)
                 port_dict['port'] = port
                 port_dict['protocol'] = protocol
                 port_dict['service'] = service
-                ports_processed['{0}:{1}'.format(port, protocol)] = port_dict
+                ports_processed[port_key] = port_dict
 
             # Set the evidence as a port note if it exists
             if evidence is not None and \
@@ -177,32 +434,122 @@ def parse(project, nessus_file, include_informational=False, min_note_sev=2):
                     plugin_family != 'Port scanners' and \
                     plugin_family != 'Service detection':
                 note_dict = copy.deepcopy(models.note_model)
-                note_dict['title'] = "{0} (ID{1})".format(title, str(note_id))
-                # evidence is not None, but evidence.text can be None
-                evidence_text = evidence.text if evidence.text is not None else ''
-                e = evidence_text.strip()
+                e = evidence.strip()
                 for line in e.split("\n"):
                     line = line.strip()
                     if line:
                         note_dict['content'] += "    " + line + "\n"
                 note_dict['last_modified_by'] = TOOL
-                ports_processed['{0}:{1}'.format(port, protocol)]['notes'].append(note_dict)
-                note_id += 1
+                ports_processed[port_key]['notes'].append(note_dict)
+                part['notes'].append((note_dict, title))
 
             # This plugin is general scan info...use it for 'command' element
             if plugin_id == '19506':
 
-                command = item.find('plugin_output')
-
                 command_dict = dict(models.command_model)
                 command_dict['tool'] = TOOL
 
-                if command is not None:
-                    command_dict['command'] = command.text
+                if evidence is not None:
+                    command_dict['command'] = evidence
+
+                if part['command'] is None:
+                    part['command'] = command_dict
+
+                continue
+
+            # The first item of a plugin decides whether it is kept. By
+            # default, don't include informational findings unless
+            # explicitly told to do so.
+            if plugin_id not in part['first']:
+                part['plugins'].append(plugin_id)
+                cvss = get_cvss(record)
+                if cvss == 0 and not include_informational and \
+                        plugin_id not in force:
+                    part['first'][plugin_id] = None
+                    continue
+                part['first'][plugin_id] = (title, record, cvss)
+                part['occurrences'][plugin_id] = list()
+            elif part['first'][plugin_id] is None:
+                continue
+
+            # the issue is when there is a plugin where output is empty for one of the hosts.
+            evidence_text = evidence if evidence is not None else ''
+
+            evidence_host = u"{0} {1}/{2}".format(host_dict['string_addr'], str(port), protocol)
+            hostpp = u"{0}:{1}:{2}".format(
+                host_dict['string_addr'],
+                str(port),
+                protocol
+            )
+            part['occurrences'][plugin_id].append(
+                (evidence_text, evidence_host, hostpp, target_hostname))
+
+        # In the event no IP was found, use the 'name' attribute of
+        # the 'ReportHost' element
+        if not host_dict['string_addr']:
+            host_dict['string_addr'] = temp_ip
+            host_dict['long_addr'] = helper.ip2long(temp_ip)
+
+        # Add all encountered ports to the host
+        host_dict['ports'].extend(ports_processed.values())
+
+        part['hosts'].append(host_dict)
+
+    return part
+
+
+def merge_hosts(project_dict, parts, include_informational=False,
+                reread=None):
+    """Combines the results of read_hosts, in file order, into the project
+    and a map of the vulnerabilities by plugin. Hosts, notes, plugins and
+    their items are added in the order a single pass over the file would
+    add them, so the output does not depend on how the file was split.
+
+    :param project_dict: The project model to add hosts and commands to
+    :param parts: Iterable of (read_hosts result, chunk) in file order
+    :param include_informational: Whether to include info findings
+    :param reread: Function reading a chunk again with a set of forced
+                   plugins, for the plugins a chunk dropped that were kept
+                   by an earlier one
+    :return: The vuln_host_map
+    """
+    note_id = 1
+
+    # Used to maintain a running list of host:port vulnerabilities by plugin
+    vuln_host_map = dict()
+
+    # Structure:
+    # vuln_host_map = {
+    #     plugin_id: {
+    #         'hosts': []
+    #         'tags'
+    #         'vuln': vuln-object
+    #         'evidence': [evidence_text] # unique set of evidence texts
+    #     }
+    # }
+
+    # Plugins dropped by the informational filter, so they are only
+    # evaluated once
+    skipped_plugins = set()
+
+    for part, chunk in parts:
+        forced = [plugin_id for plugin_id in part['plugins']
+                  if part['first'][plugin_id] is None and
+                  plugin_id in vuln_host_map]
+        if forced:
+            part = reread(chunk, frozenset(forced))
+
+        for note_dict, title in part['notes']:
+            note_dict['title'] = "{0} (ID{1})".format(title, str(note_id))
+            note_id += 1
 
-                if not project_dict['commands']:
-                    project_dict['commands'].append(command_dict)
+        if part['command'] is not None and not project_dict['commands']:
+            project_dict['commands'].append(part['command'])
 
+        project_dict['hosts'].extend(part['hosts'])
+
+        for plugin_id in part['plugins']:
+            if plugin_id in skipped_plugins:
                 continue
 
             # Check if this vulnerability has been seen in this file for
@@ -213,207 +560,27 @@ def parse(project, nessus_file, include_informational=False, min_note_sev=2):
             # IP and port information are embedded within each vulnerability
             # while ensuring no duplicate data exists.
             if plugin_id not in vuln_host_map:
-                v = copy.deepcopy(models.vulnerability_model)
-                v['cves'] = list()
-                v['seealsos'] = list()
-                v['plugin_ids'] = list()
-                v['identified_by'] = list()
-                v['hosts'] = list()
-                v['tags'] = []
-
-                # Set the title
-                v['title'] = title
-
-                # Set the description
-                description = item.find('description')
-                if description is not None:
-                    # convert the weird 5 spaces into 1
-                    description_text = description.text.replace('     ', ' ')
-                    # convert 3 spaces into 1, first seen on pluginID="121602"
-                    description_text = description_text.replace('   ', ' ')
-
-                    description_text = description_text.replace("Nessus", NESSUS_REPLACEMENT)
-                    v['description'] = description_text
-
-                # Set the solution
-                solution = item.find('solution')
-                if solution is not None:
-                    solution_text = solution.text.replace("Nessus", NESSUS_REPLACEMENT)
-                    v['solution'] = solution_text
-
-                # Append see_also references to solution
-                see_also = item.findall('see_also')
-                if len(see_also) > 0:
-                    if 'solution' not in v:
-                        v['solution'] = 'Additional Resources:\n\n'
-                    else:
-                        v['solution'] += '\n\nAdditional Resources:\n'
-                    for sa in see_also:
-                        for link in sa.text.split('\n'):
-                            if DEBUG:
-                                print "resolving: %s" % link
-                            if link in nessus_links:
-                                if DEBUG:
-                                    print "link is in cache: %s -> %s" % (link, nessus_links[link])
-                                v['solution'] += "\n- <" + nessus_links[link] + ">"
-
-                            elif 'nessus.org' in link:
-                                reslink = link
-                                try:
-                                    # Lookups do not need to be cached since drone
-                                    # only parses each unique vuln plugin once.
-                                    resp = requests.get(link, timeout=10)
-                                    if resp.ok:
-                                        reslink = resp.url
-                                        nessus_links[link] = reslink
-                                except Exception as e:
-                                    print('Omitting link "{}" which failed to resolve: {}\n'.format(link, str(e)))
-                                    nessus_links[link] = link
-                                    continue
-
-                                v['solution'] += "\n- <" + reslink + ">"
-
-                            else:
-                                v['solution'] += "\n- <" + link + ">"
-
-                # Set the evidence
-                # if evidence is not None:
-                #     v['evidence'] = evidence.text
-
-                # Set the vulnerability flag if exploit exists
-                exploit = item.find('exploit_available')
-                if exploit is not None:
-                    v['flag'] = exploit.text == 'true'
-
-                    # Grab Metasploit details
-                    exploit_detail = item.find('exploit_framework_metasploit')
-                    if exploit_detail is not None and \
-                            exploit_detail.text == 'true':
-                        note_dict = copy.deepcopy(models.note_model)
-                        note_dict['title'] = 'Metasploit Exploit'
-                        note_dict['content'] = 'Exploit exists. Details unknown.'
-                        module = item.find('metasploit_name')
-                        if module is not None:
-                            note_dict['content'] = module.text
-                        note_dict['last_modified_by'] = TOOL
-                        v['notes'].append(note_dict)
-
-                    # Grab Canvas details
-                    exploit_detail = item.find('exploit_framework_canvas')
-                    if exploit_detail is not None and \
-                            exploit_detail.text == 'true':
-                        note_dict = copy.deepcopy(models.note_model)
-                        note_dict['title'] = 'Canvas Exploit'
-                        note_dict['content'] = 'Exploit exists. Details unknown.'
-                        module = item.find('canvas_package')
-                        if module is not None:
-                            note_dict['content'] = module.text
-                        note_dict['last_modified_by'] = TOOL
-                        v['notes'].append(note_dict)
-
-                    # Grab Core Impact details
-                    exploit_detail = item.find('exploit_framework_core')
-                    if exploit_detail is not None and \
-                            exploit_detail.text == 'true':
-                        note_dict = copy.deepcopy(models.note_model)
-                        note_dict['title'] = 'Core Impact Exploit'
-                        note_dict['content'] = 'Exploit exists. Details unknown.'
-                        module = item.find('core_name')
-                        if module is not None:
-                            note_dict['content'] = module.text
-                        note_dict['last_modified_by'] = TOOL
-                        v['notes'].append(note_dict)
-
-                    # Grab ExploitHub SKUs
-                    exploit_detail = item.find('exploit_framework_exploithub')
-                    if exploit_detail is not None and \
-                            exploit_detail.text == 'true':
-                        note_dict = copy.deepcopy(models.note_model)
-                        note_dict['title'] = 'Exploit Hub Exploit'
-                        note_dict['content'] = 'Exploit exists. Details unknown.'
-                        module = item.find('exploithub_sku')
-                        if module is not None:
-                            note_dict['content'] = module.text
-                        note_dict['last_modified_by'] = TOOL
-                        v['notes'].append(note_dict)
-
-                    # Grab any and all ExploitDB IDs
-                    details = item.iter('edb-id')
-                    if details is not None:
-                        for module in details:
-                            note_dict = copy.deepcopy(models.note_model)
-                            note_dict['title'] = 'Exploit-DB Exploit ' \
-                                                 '({0})'.format(module.text)
-                            note_dict['content'] = module.text
-                            note_dict['last_modified_by'] = TOOL
-                            v['notes'].append(note_dict)
-
-                # Set the CVSS score
-                cvss = item.find('cvss_base_score')
-                if cvss is not None:
-                    v['cvss'] = float(cvss.text)
-                else:
-                    risk_factor = item.find('risk_factor')
-                    if risk_factor is not None:
-                        rf = risk_factor.text
-                        if rf == "Low":
-                            v['cvss'] = 3.0
-                        elif rf == "Medium":
-                            v['cvss'] = 5.0
-                        elif rf == "High":
-                            v['cvss'] = 7.5
-                        elif rf == "Critical":
-                            v['cvss'] = 10.0
-
-                # Set the CVE(s)
-                for cve in item.findall('cve'):
-                    c = cve_pattern.sub('', cve.text)
-                    v['cves'].append(c)
-
-                # Set the plugin information
-                plugin_dict = dict(models.plugin_id_model)
-                plugin_dict['tool'] = TOOL
-                plugin_dict['id'] = plugin_id
-                v['plugin_ids'].append(plugin_dict)
-
-                # Set the identified by information
-                identified_dict = dict(models.identified_by_model)
-                identified_dict['tool'] = TOOL
-                identified_dict['id'] = plugin_id
-                v['identified_by'].append(identified_dict)
-
-                # By default, don't include informational findings unless
-                # explicitly told to do so.
-                if v['cvss'] == 0 and not include_informational:
+                if part['first'][plugin_id] is None:
+                    skipped_plugins.add(plugin_id)
                     continue
 
+                title, record, cvss = part['first'][plugin_id]
                 vuln_host_map[plugin_id] = dict()
                 vuln_host_map[plugin_id]['hosts'] = set()
-                vuln_host_map[plugin_id]['vuln'] = v
+                vuln_host_map[plugin_id]['vuln'] = build_vulnerability(
+                    plugin_id, title, record, cvss)
                 vuln_host_map[plugin_id]['evidence'] = dict()
                 vuln_host_map[plugin_id]['hostnames'] = dict()
                 vuln_host_map[plugin_id]['ips'] = set()
 
-            # plugin_id will always be in vuln_host_map unless explicitly excluted (e.g. exclude informational)
-            if plugin_id in vuln_host_map:
-                # the issue is when there is a plugin where output is empty for one of the hosts.
-                evidence_text = evidence.text if evidence is not None else ''
-                # very rarely, evidence is not None, but evidence.text is None
-                evidence_text = evidence_text if evidence_text is not None else ''
+            for evidence_text, evidence_host, hostpp, target_hostname in \
+                    part['occurrences'].get(plugin_id, ()):
 
                 # Map host/port to shared plugin output
                 if evidence_text not in vuln_host_map[plugin_id]['evidence']:
                     vuln_host_map[plugin_id]['evidence'][evidence_text] = set()
-                evidence_host = u"{0} {1}/{2}".format(host_dict['string_addr'], str(port), protocol)
                 vuln_host_map[plugin_id]['evidence'][evidence_text].add(evidence_host)
 
-                hostpp = u"{0}:{1}:{2}".format(
-                    host_dict['string_addr'],
-                    str(port),
-                    protocol
-                )
-
-
                 vuln_host_map[plugin_id]['hosts'].add(hostpp)
 
                 if target_hostname:
@@ -423,25 +590,156 @@ def parse(project, nessus_file, include_informational=False, min_note_sev=2):
                 else:
                     vuln_host_map[plugin_id]['ips'].add(hostpp)
 
-            # if target_hostname:
-            #     # print "issue:", vuln_host_map[plugin_id]['vuln']['title'], 'target_hostname:', target_hostname
-            #     # to use dhostname instead of hostname, we'd need to know that the IP
-            #     # wasn't explicitly scanned also.
-            #     htag = "hostname:%s->%s:%s/%s" % (target_hostname, host_dict['string_addr'], port, protocol)
-            #     vuln_host_map[plugin_id]['vuln']['tags'].append(htag)
+    return vuln_host_map
 
-            #     # print '  issue full tags:', vuln_host_map[plugin_id]['vuln']['tags']
 
-        # In the event no IP was found, use the 'name' attribute of
-        # the 'ReportHost' element
-        if not host_dict['string_addr']:
-            host_dict['string_addr'] = temp_ip
-            host_dict['long_addr'] = helper.ip2long(temp_ip)
+def split_report_hosts(nessus_file, count):
+    """Splits a Nessus file into chunks of whole 'ReportHost' elements. The
+    boundaries are found by scanning the memory mapped file for the
+    elements' start tags, which cannot appear in the escaped text of a
+    Nessus file.
 
-        # Add all encountered ports to the host
-        host_dict['ports'].extend(ports_processed.values())
+    :param nessus_file: Path of an uncompressed Nessus file
+    :param count: Number of chunks wanted
+    :return: Tuple of the start tags a chunk is wrapped in to be parsed on
+             its own, the matching end tags and a list of (start, end) byte
+             offsets. None if the file has no host or an unexpected layout.
+    """
+    with open(nessus_file, 'rb') as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            first = REPORT_HOST_TAG.search(mm)
+            end = mm.rfind('</Report>')
+            if first is None or end < first.start():
+                return None
+
+            # The declaration, for the encoding, and the root and Report
+            # start tags, for the namespaces of the items
+            head = mm[:first.start()]
+            prolog = PROLOG_TAG.search(head)
+            root = ROOT_TAG.search(head)
+            report = REPORT_TAG.match(head, max(0, head.rfind('<Report')))
+            if root is None or report is None:
+                return None
+            prefix = (prolog.group(0) if prolog else '') + root.group(0) + \
+                report.group(0)
+
+            starts = [first.start()]
+            size = end - first.start()
+            for i in range(1, count):
+                match = REPORT_HOST_TAG.search(
+                    mm, first.start() + size * i // count)
+                if match is None or match.start() >= end:
+                    break
+                if match.start() > starts[-1]:
+                    starts.append(match.start())
+        finally:
+            mm.close()
+
+    spans = zip(starts, starts[1:] + [end])
+    return prefix, '</Report></NessusClientData_v2>', spans
+
+
+def _read_span(nessus_file, prefix, suffix, options, span, force=frozenset()):
+    # Parses the hosts between two offsets of a file split by
+    # split_report_hosts
+    start, end = span
+    with open(nessus_file, 'rb') as fh:
+        fh.seek(start)
+        data = fh.read(end - start)
+    root = et.fromstring(prefix + data + suffix)
+    return read_hosts(root.iter('ReportHost'), *options, force=force)
+
+
+# Arguments of _read_span shared by the chunks a worker process reads, set
+# when the process starts
+_worker = None
+
+
+def _init_worker(*args):
+    global _worker
+    _worker = args
+
+
+def _read_chunk(span):
+    return _read_span(*(_worker + (span,)))
+
+
+def read_parallel(project_dict, nessus_file, workers, include_informational,
+                  min_note_sev, scope):
+    """Reads the hosts of an uncompressed Nessus file in several processes,
+    a chunk of hosts at a time, and merges them in file order
+
+    :return: The vuln_host_map, or None if the file cannot be split
+    """
+    size = os.path.getsize(nessus_file)
+    count = max(workers * CHUNKS_PER_WORKER, size // MAX_CHUNK_SIZE + 1)
+    split = split_report_hosts(nessus_file, count)
+    if split is None:
+        return None
+
+    prefix, suffix, spans = split
+    options = (include_informational, min_note_sev, scope)
+    args = (nessus_file, prefix, suffix, options)
+
+    def reread(span, force):
+        return _read_span(*(args + (span, force)))
+
+    # Workers are forked, so the scope is inherited rather than pickled
+    pool = multiprocessing.Pool(workers, _init_worker, args)
+    try:
+        parts = itertools.izip(pool.imap(_read_chunk, spans), spans)
+        vuln_host_map = merge_hosts(project_dict, parts,
+                                    include_informational, reread)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return vuln_host_map
+
+
+def parse(project, nessus_file, include_informational=False, min_note_sev=2,
+          scope=None, workers=None):
+    """Parses a Nessus XMLv2 file and updates the Hive database
 
-        project_dict['hosts'].append(host_dict)
+    Uncompressed files of PARALLEL_MIN_SIZE or more are split at host
+    boundaries and read by several processes when workers, or
+    LAIR_PARSE_WORKERS, is above 1. The result is the same as reading the
+    file in a single pass.
+
+    :param project: The project id
+    :param nessus_file: The Nessus xml file to be parsed
+    :param include_informational: Whether to include info findings in data. Default False
+    :min_note_sev: The minimum severity of notes that will be saved. Default 2
+    :param scope: Optional Scope; out-of-scope hosts are skipped
+    :param workers: Number of processes reading the file. Default is
+                    LAIR_PARSE_WORKERS, or 1
+    """
+    if workers is None:
+        workers = int(os.environ.get('LAIR_PARSE_WORKERS') or 1)
+
+    # Create the project dictionary which acts as foundation of document
+    project_dict = copy.deepcopy(models.project_model)
+    project_dict['commands'] = list()
+    project_dict['vulnerabilities'] = list()
+    project_dict['project_id'] = project
+
+    vuln_host_map = None
+    if workers > 1 and helper.is_plain_file(nessus_file) and \
+            os.path.getsize(nessus_file) >= PARALLEL_MIN_SIZE:
+        vuln_host_map = read_parallel(project_dict, nessus_file, workers,
+                                      include_informational, min_note_sev,
+                                      scope)
+
+    if vuln_host_map is None:
+        with helper.open_resource(nessus_file) as fh:
+            tree = et.parse(fh)
+        part = read_hosts(tree.getroot().iter('ReportHost'),
+                          include_informational, min_note_sev, scope)
+        vuln_host_map = merge_hosts(project_dict, [(part, None)],
+                                    include_informational)
 
     # This code block uses the plugin/host/vuln mapping to associate
     # all vulnerable hosts to their vulnerability data within the
@@ -467,8 +765,6 @@ def parse(project, nessus_file, include_informational=False, min_note_sev=2):
             # if data['vuln']['title'] == 'lighttpd < 1.4.51 Multiple Vulnerabilities':
             #     print data['evidence']
 
-            import os
-
             # WARNING: do not use lstrip to remove a substring prefix, it may remove more than intended.
             # Use these instead:
             def remove_prefix(text, prefix):
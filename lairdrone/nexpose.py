@@ -2,7 +2,6 @@
 # Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
 # See the file license.txt for copying permission
 
-import xml.etree.ElementTree as et
 import os
 import sys
 import re
@@ -12,268 +11,386 @@ sys.path.append(os.path.abspath(
 )
 from lairdrone import drone_models as models
 from lairdrone import helper
+from lairdrone import xmlbackend as et
 from lairdrone.exceptions import IncompatibleDataVersionError
 
 OS_WEIGHT = 75
 TOOL = "nexpose"
 
 
-def parse(project, nexpose_file, include_informational=False):
-    """Parses a Nexpose XMLv2 file and updates the Lair database
+def parse_vulnerability(vuln):
+    """Builds the vulnerability model for a Nexpose vulnerability definition
 
-    :param project: The project id
-    :param nexpose_file: The Nexpose xml file to be parsed
-    :include_informational: Whether to include info findings in data. Default False
+    :param vuln: The 'vulnerability' element
     """
 
     cve_pattern = re.compile(r'(CVE-|CAN-)')
-    html_tag_pattern = re.compile(r'<.*?>')
     white_space_pattern = re.compile(r'\s+', re.MULTILINE)
 
-    # Used to create unique notes in DB
-    note_id = 1
-
-    tree = et.parse(nexpose_file)
-    root = tree.getroot()
-    if root is None or \
-            root.tag != "NexposeReport" or \
-            root.attrib['version'] != "2.0":
-        raise IncompatibleDataVersionError("Nexpose XML 2.0")
-
-    # Create the project dictionary which acts as foundation of document
-    project_dict = dict(models.project_model)
-    project_dict['commands'] = list()
-    project_dict['vulnerabilities'] = list()
-    project_dict['project_id'] = project
-    project_dict['commands'].append({'tool': TOOL, 'command': 'scan'})
+    v = copy.deepcopy(models.vulnerability_model)
+    v['cves'] = list()
+    v['plugin_ids'] = list()
+    v['identified_by'] = list()
+    v['hosts'] = list()
+
+    v['cvss'] = float(vuln.attrib['cvssScore'])
+    v['title'] = vuln.attrib['title']
+    plugin_id = vuln.attrib['id'].lower()
+
+    # Set plugin id
+    plugin_dict = dict(models.plugin_id_model)
+    plugin_dict['tool'] = TOOL
+    plugin_dict['id'] = plugin_id
+    v['plugin_ids'].append(plugin_dict)
+
+    # Set identified by information
+    identified_dict = dict(models.identified_by_model)
+    identified_dict['tool'] = TOOL
+    identified_dict['id'] = plugin_id
+    v['identified_by'].append(identified_dict)
+
+    # Search for exploits
+    for exploit in vuln.iter('exploit'):
+        v['flag'] = True
+        note_dict = copy.deepcopy(models.note_model)
+        note_dict['title'] = "{0} ({1})".format(
+            exploit.attrib['type'],
+            exploit.attrib['id']
+        )
+        note_dict['content'] = "{0}\n{1}".format(
+            exploit.attrib['title'].encode('ascii', 'replace'),
+            exploit.attrib['link'].encode('ascii', 'replace')
+        )
+        note_dict['last_modified_by'] = TOOL
+        v['notes'].append(note_dict)
+
+    # Search for CVE references
+    for reference in vuln.iter('reference'):
+        if reference.attrib['source'] == 'CVE':
+            cve = cve_pattern.sub('', reference.text)
+            v['cves'].append(cve)
+
+    # Search for solution
+    solution = vuln.find('solution')
+    if solution is not None:
+        for text in solution.itertext():
+            s = text.encode('ascii', 'replace').strip()
+            v['solution'] += white_space_pattern.sub(" ", s)
+
+    # Search for description
+    description = vuln.find('description')
+    if description is not None:
+        for text in description.itertext():
+            s = text.encode('ascii', 'replace').strip()
+            v['description'] += white_space_pattern.sub(" ", s)
+
+    return v
+
+
+def parse_node(node, vuln_hosts, note_id, scope=None):
+    """Builds the host model for a Nexpose node and records the host/port
+    of every confirmed vulnerability test
+
+    :param node: The 'node' element
+    :param vuln_hosts: Mapping of plugin id to the set of affected host keys
+    :param note_id: Id of the next service note
+    :param scope: Optional Scope; out-of-scope hosts are skipped
+    :return: Tuple of the host model (None if out of scope) and the id of
+             the next service note
+    """
 
-    # Used to maintain a running list of host:port vulnerabilities by plugin
-    vuln_host_map = dict()
-
-    for vuln in root.iter('vulnerability'):
-        v = copy.deepcopy(models.vulnerability_model)
-        v['cves'] = list()
-        v['plugin_ids'] = list()
-        v['identified_by'] = list()
-        v['hosts'] = list()
-
-        v['cvss'] = float(vuln.attrib['cvssScore'])
-        v['title'] = vuln.attrib['title']
-        plugin_id = vuln.attrib['id'].lower()
-
-        # Set plugin id
-        plugin_dict = dict(models.plugin_id_model)
-        plugin_dict['tool'] = TOOL
-        plugin_dict['id'] = plugin_id
-        v['plugin_ids'].append(plugin_dict)
-
-        # Set identified by information
-        identified_dict = dict(models.identified_by_model)
-        identified_dict['tool'] = TOOL
-        identified_dict['id'] = plugin_id
-        v['identified_by'].append(identified_dict)
-
-        # Search for exploits
-        for exploit in vuln.iter('exploit'):
-            v['flag'] = True
-            note_dict = copy.deepcopy(models.note_model)
-            note_dict['title'] = "{0} ({1})".format(
-                exploit.attrib['type'],
-                exploit.attrib['id']
-            )
-            note_dict['content'] = "{0}\n{1}".format(
-                exploit.attrib['title'].encode('ascii', 'replace'),
-                exploit.attrib['link'].encode('ascii', 'replace')
-            )
-            note_dict['last_modified_by'] = TOOL
-            v['notes'].append(note_dict)
-
-        # Search for CVE references
-        for reference in vuln.iter('reference'):
-            if reference.attrib['source'] == 'CVE':
-                cve = cve_pattern.sub('', reference.text)
-                v['cves'].append(cve)
-
-        # Search for solution
-        solution = vuln.find('solution')
-        if solution is not None:
-            for text in solution.itertext():
-                s = text.encode('ascii', 'replace').strip()
-                v['solution'] += white_space_pattern.sub(" ", s)
-
-        # Search for description
-        description = vuln.find('description')
-        if description is not None:
-            for text in description.itertext():
-                s = text.encode('ascii', 'replace').strip()
-                v['description'] += white_space_pattern.sub(" ", s)
-
-        # Build mapping of plugin-id to host to vuln dictionary
-        vuln_host_map[plugin_id] = dict()
-        vuln_host_map[plugin_id]['vuln'] = v
-        vuln_host_map[plugin_id]['hosts'] = set()
-
-    for node in root.iter('node'):
-
-        host_dict = dict(models.host_model)
-        host_dict['os'] = list()
-        host_dict['ports'] = list()
-        host_dict['hostnames'] = list()
-
-        # Set host status
-        if node.attrib['status'] != 'alive':
-            host_dict['alive'] = False
-
-        # Set IP address
-        host_dict['string_addr'] = node.attrib['address']
-        host_dict['long_addr'] = helper.ip2long(node.attrib['address'])
-
-        # Set the OS fingerprint
-        certainty = 0
-        for os in node.iter('os'):
-            if float(os.attrib['certainty']) > certainty:
-                certainty = float(os.attrib['certainty'])
-                os_dict = dict(models.os_model)
-                os_dict['tool'] = TOOL
-                os_dict['weight'] = OS_WEIGHT
-
-                fingerprint = ''
-                if 'vendor' in os.attrib:
-                    fingerprint += os.attrib['vendor'] + " "
-
-                # Make an extra check to limit duplication of data in the
-                # event that the product name was already in the vendor name
-                if 'product' in os.attrib and \
-                        os.attrib['product'] not in fingerprint:
-                    fingerprint += os.attrib['product'] + " "
-
-                fingerprint = fingerprint.strip()
-                os_dict['fingerprint'] = fingerprint
-
-                host_dict['os'] = list()
-                host_dict['os'].append(os_dict)
-
-        # Test for general, non-port related vulnerabilities
-        # Add them as tcp, port 0
-        tests = node.find('tests')
-        if tests is not None:
-            port_dict = dict(models.port_model)
-            port_dict['service'] = "general"
-
-            for test in tests.findall('test'):
+    # Don't import out-of-scope hosts
+    if scope is not None and node.attrib['address'] not in scope:
+        return None, note_id
+
+    host_dict = dict(models.host_model)
+    host_dict['os'] = list()
+    host_dict['ports'] = list()
+    host_dict['hostnames'] = list()
+
+    # Set host status
+    if node.attrib['status'] != 'alive':
+        host_dict['alive'] = False
+
+    # Set IP address
+    host_dict['string_addr'] = node.attrib['address']
+    host_dict['long_addr'] = helper.ip2long(node.attrib['address'])
+
+    # Set the OS fingerprint
+    certainty = 0
+    for os in node.iter('os'):
+        if float(os.attrib['certainty']) > certainty:
+            certainty = float(os.attrib['certainty'])
+            os_dict = dict(models.os_model)
+            os_dict['tool'] = TOOL
+            os_dict['weight'] = OS_WEIGHT
+
+            fingerprint = ''
+            if 'vendor' in os.attrib:
+                fingerprint += os.attrib['vendor'] + " "
+
+            # Make an extra check to limit duplication of data in the
+            # event that the product name was already in the vendor name
+            if 'product' in os.attrib and \
+                    os.attrib['product'] not in fingerprint:
+                fingerprint += os.attrib['product'] + " "
+
+            fingerprint = fingerprint.strip()
+            os_dict['fingerprint'] = fingerprint
+
+            host_dict['os'] = list()
+            host_dict['os'].append(os_dict)
+
+    # Test for general, non-port related vulnerabilities
+    # Add them as tcp, port 0
+    tests = node.find('tests')
+    if tests is not None:
+        port_dict = dict(models.port_model)
+        port_dict['service'] = "general"
+
+        for test in tests.findall('test'):
+            # vulnerable-since attribute is used to flag
+            # confirmed vulns
+            if 'vulnerable-since' in test.attrib:
+                plugin_id = test.attrib['id'].lower()
+
+                # This is used to track evidence for the host/port
+                # and plugin
+                h = "{0}:{1}:{2}".format(
+                    host_dict['string_addr'],
+                    "0",
+                    models.PROTOCOL_TCP
+                )
+                vuln_hosts.setdefault(plugin_id, set()).add(h)
+
+        host_dict['ports'].append(port_dict)
+
+    # Use the endpoint elements to populate port data
+    for endpoint in node.iter('endpoint'):
+        port_dict = copy.deepcopy(models.port_model)
+        port_dict['port'] = int(endpoint.attrib['port'])
+        port_dict['protocol'] = endpoint.attrib['protocol']
+        if endpoint.attrib['status'] != 'open':
+            port_dict['alive'] = False
+
+        # Use the service elements to identify service
+        for service in endpoint.iter('service'):
+
+            # Ignore unknown services
+            if 'unknown' not in service.attrib['name'].lower():
+                if not port_dict['service']:
+                    port_dict['service'] = service.attrib['name'].lower()
+
+            # Use the test elements to identify vulnerabilities for
+            # the host
+            for test in service.iter('test'):
                 # vulnerable-since attribute is used to flag
                 # confirmed vulns
                 if 'vulnerable-since' in test.attrib:
                     plugin_id = test.attrib['id'].lower()
 
+                    # Add service notes for evidence
+                    note_dict = copy.deepcopy(models.note_model)
+                    note_dict['title'] = "{0} (ID{1})".format(plugin_id,
+                                                          str(note_id))
+                    for evidence in test.iter():
+                        if evidence.text:
+                            for line in evidence.text.split("\n"):
+                                line = line.strip()
+                                if line:
+                                    note_dict['content'] += "    " + \
+                                                            line + "\n"
+                        elif evidence.tag == "URLLink":
+                            note_dict['content'] += "    "
+                            note_dict['content'] += evidence.attrib[
+                                                        'LinkURL'
+                                                    ] + "\n"
+
+                    note_dict['last_modified_by'] = TOOL
+                    port_dict['notes'].append(note_dict)
+                    note_id += 1
+
                     # This is used to track evidence for the host/port
                     # and plugin
                     h = "{0}:{1}:{2}".format(
                         host_dict['string_addr'],
-                        "0",
-                        models.PROTOCOL_TCP
+                        str(port_dict['port']),
+                        port_dict['protocol']
                     )
-                    vuln_host_map[plugin_id]['hosts'].add(h)
-
-            host_dict['ports'].append(port_dict)
-
-        # Use the endpoint elements to populate port data
-        for endpoint in node.iter('endpoint'):
-            port_dict = copy.deepcopy(models.port_model)
-            port_dict['port'] = int(endpoint.attrib['port'])
-            port_dict['protocol'] = endpoint.attrib['protocol']
-            if endpoint.attrib['status'] != 'open':
-                port_dict['alive'] = False
-
-            # Use the service elements to identify service
-            for service in endpoint.iter('service'):
-
-                # Ignore unknown services
-                if 'unknown' not in service.attrib['name'].lower():
-                    if not port_dict['service']:
-                        port_dict['service'] = service.attrib['name'].lower()
-
-                # Use the test elements to identify vulnerabilities for
-                # the host
-                for test in service.iter('test'):
-                    # vulnerable-since attribute is used to flag
-                    # confirmed vulns
-                    if 'vulnerable-since' in test.attrib:
-                        plugin_id = test.attrib['id'].lower()
-
-                        # Add service notes for evidence
-                        note_dict = copy.deepcopy(models.note_model)
-                        note_dict['title'] = "{0} (ID{1})".format(plugin_id,
-                                                              str(note_id))
-                        for evidence in test.iter():
-                            if evidence.text:
-                                for line in evidence.text.split("\n"):
-                                    line = line.strip()
-                                    if line:
-                                        note_dict['content'] += "    " + \
-                                                                line + "\n"
-                            elif evidence.tag == "URLLink":
-                                note_dict['content'] += "    "
-                                note_dict['content'] += evidence.attrib[
-                                                            'LinkURL'
-                                                        ] + "\n"
-
-                        note_dict['last_modified_by'] = TOOL
-                        port_dict['notes'].append(note_dict)
-                        note_id += 1
-
-                        # This is used to track evidence for the host/port
-                        # and plugin
-                        h = "{0}:{1}:{2}".format(
-                            host_dict['string_addr'],
-                            str(port_dict['port']),
-                            port_dict['protocol']
-                        )
-                        vuln_host_map[plugin_id]['hosts'].add(h)
-
-            # Use the fingerprint elements to identify product
-            certainty = 0
-            for fingerprint in endpoint.iter('fingerprint'):
-                if float(fingerprint.attrib['certainty']) > certainty:
-                    certainty = float(fingerprint.attrib['certainty'])
-                    prod = ''
-                    if 'vendor' in fingerprint.attrib:
-                        prod += fingerprint.attrib['vendor'] + " "
-
-                    if 'product' in fingerprint.attrib:
-                        prod += fingerprint.attrib['product'] + " "
-
-                    if 'version' in fingerprint.attrib:
-                        prod += fingerprint.attrib['version'] + " "
-
-                    prod = prod.strip()
-                    port_dict['product'] = prod
-
-            host_dict['ports'].append(port_dict)
-
-        project_dict['hosts'].append(host_dict)
+                    vuln_hosts.setdefault(plugin_id, set()).add(h)
+
+        # Use the fingerprint elements to identify product
+        certainty = 0
+        for fingerprint in endpoint.iter('fingerprint'):
+            if float(fingerprint.attrib['certainty']) > certainty:
+                certainty = float(fingerprint.attrib['certainty'])
+                prod = ''
+                if 'vendor' in fingerprint.attrib:
+                    prod += fingerprint.attrib['vendor'] + " "
+
+                if 'product' in fingerprint.attrib:
+                    prod += fingerprint.attrib['product'] + " "
+
+                if 'version' in fingerprint.attrib:
+                    prod += fingerprint.attrib['version'] + " "
+
+                prod = prod.strip()
+                port_dict['product'] = prod
+
+        host_dict['ports'].append(port_dict)
+
+    return host_dict, note_id
+
+
+def start_offset(nexpose_file):
+    """Returns the offset to rewind to for reading a Nexpose report again,
+    or None if it cannot be read again: stdin, or a file object that is not
+    seekable, such as a pipe. Paths are opened again, from offset 0.
+
+    :param nexpose_file: The Nexpose xml file, '-' for stdin, or a file
+                         object
+    """
+    if isinstance(nexpose_file, basestring):
+        return None if nexpose_file == helper.STDIN else 0
+    seekable = getattr(nexpose_file, 'seekable', None)
+    if seekable is not None and not seekable():
+        return None
+    try:
+        return nexpose_file.tell()
+    except (AttributeError, IOError):
+        return None
+
+
+def iter_elements(nexpose_file, tags):
+    """Streams a Nexpose report, yielding each completed element with one of
+    the given tags. Yielded elements are detached from the tree once the
+    caller is done with them so memory stays bounded.
+
+    :param nexpose_file: The Nexpose xml file to be parsed, '-' for stdin,
+                         or a file object
+    :param tags: Tag names to yield
+    """
+    if isinstance(nexpose_file, basestring):
+        fh = helper.open_resource(nexpose_file)
+    else:
+        fh = nexpose_file
+
+    stack = list()
+    releaser = et.Releaser()
+    try:
+        for event, elem in et.iterparse(fh, events=('start', 'end')):
+            if event == 'start':
+                if not stack and (elem.tag != "NexposeReport" or
+                                  elem.attrib.get('version') != "2.0"):
+                    raise IncompatibleDataVersionError("Nexpose XML 2.0")
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            if elem.tag in tags:
+                yield elem
+                releaser.release(stack[-1] if stack else None, elem)
+    finally:
+        if fh is not nexpose_file:
+            fh.close()
+
+
+def parse(project, nexpose_file, include_informational=False, scope=None):
+    """Parses a Nexpose XMLv2 file and updates the Lair database
+
+    The report is streamed in two phases. Nodes are processed first,
+    recording the vulnerability tests each host references. Vulnerability
+    models are then only built for referenced definitions; in a standard
+    export the definitions follow the nodes so both phases share one read
+    of the file.
+
+    :param project: The project id
+    :param nexpose_file: The Nexpose xml file to be parsed, or '-' for stdin
+    :include_informational: Whether to include info findings in data. Default False
+    :param scope: Optional Scope; out-of-scope hosts are skipped
+    """
+
+    # Used to create unique notes in DB
+    note_id = 1
+
+    # Create the project dictionary which acts as foundation of document
+    project_dict = copy.deepcopy(models.project_model)
+    project_dict['commands'] = list()
+    project_dict['vulnerabilities'] = list()
+    project_dict['project_id'] = project
+    project_dict['commands'].append({'tool': TOOL, 'command': 'scan'})
+
+    # Used to maintain a running list of host:port vulnerabilities by plugin
+    vuln_hosts = dict()
+
+    # Vulnerability models keyed by plugin id, built on demand
+    vuln_map = dict()
+
+    # Set when a definition is seen before the nodes referencing it, in
+    # which case the definitions are read again once all nodes are known.
+    # Stdin and pipes cannot be read again, so those definitions are kept
+    # instead.
+    needs_second_pass = False
+    nodes_done = False
+    offset = start_offset(nexpose_file)
+    rewindable = offset is not None
+    early_vulns = dict()
+
+    for elem in iter_elements(nexpose_file, ('node', 'nodes', 'vulnerability')):
+        if elem.tag == 'node':
+            host_dict, note_id = parse_node(elem, vuln_hosts, note_id, scope)
+            if host_dict is not None:
+                project_dict['hosts'].append(host_dict)
+
+        elif elem.tag == 'nodes':
+            nodes_done = True
+
+        elif not nodes_done:
+            if rewindable:
+                needs_second_pass = True
+            elif float(elem.attrib['cvssScore']) != 0 or include_informational:
+                early_vulns[elem.attrib['id'].lower()] = parse_vulnerability(elem)
+
+        elif elem.attrib['id'].lower() in vuln_hosts:
+            # By default, don't include informational findings unless
+            # explicitly told to do so.
+            if float(elem.attrib['cvssScore']) == 0 and \
+                    not include_informational:
+                continue
+            vuln_map[elem.attrib['id'].lower()] = parse_vulnerability(elem)
+
+    for plugin_id, v in early_vulns.items():
+        if plugin_id in vuln_hosts and plugin_id not in vuln_map:
+            vuln_map[plugin_id] = v
+
+    if needs_second_pass:
+        if not isinstance(nexpose_file, basestring):
+            nexpose_file.seek(offset)
+        for elem in iter_elements(nexpose_file, ('vulnerability',)):
+            plugin_id = elem.attrib['id'].lower()
+            if plugin_id not in vuln_hosts or plugin_id in vuln_map:
+                continue
+            if float(elem.attrib['cvssScore']) == 0 and \
+                    not include_informational:
+                continue
+            vuln_map[plugin_id] = parse_vulnerability(elem)
 
     # This code block uses the plugin/host/vuln mapping to associate
     # all vulnerable hosts to their vulnerability data within the
     # context of the expected Lair schema structure.
-    for plugin_id, data in vuln_host_map.items():
+    for plugin_id, v in vuln_map.items():
 
         # Build list of host and ports affected by vulnerability and
         # assign that list to the vulnerability model
-        for key in data['hosts']:
+        for key in vuln_hosts[plugin_id]:
             (string_addr, port, protocol) = key.split(':')
 
             host_key_dict = dict(models.host_key_model)
             host_key_dict['string_addr'] = string_addr
             host_key_dict['port'] = int(port)
             host_key_dict['protocol'] = protocol
-            data['vuln']['hosts'].append(host_key_dict)
-
-        # By default, don't include informational findings unless
-        # explicitly told to do so.
-        if data['vuln']['cvss'] == 0 and not include_informational:
-            continue
+            v['hosts'].append(host_key_dict)
 
-        project_dict['vulnerabilities'].append(data['vuln'])
+        project_dict['vulnerabilities'].append(v)
 
-    return project_dict
\ No newline at end of file
+    return project_dict
@@ -3,20 +3,25 @@
 # See the file license.txt for copying permission
 
 import os
+import sys
 import copy
 import re
-import xml.etree.ElementTree as et
+import stat
+import time
+import select
 from lairdrone import drone_models as models
 from lairdrone import helper
+from lairdrone import xmlbackend as et
 
 OS_WEIGHT = 50
 TOOL = "nmap"
 
-def parse_grep(project, resource):
+def parse_grep(project, resource, scope=None):
     """Parses an Nmap Grepable file and updates the Lair database
 
     :param project: The project id
     :param resource: The Nmap grepable file or string to be parsed
+    :param scope: Optional Scope; out-of-scope hosts are skipped
     """
     command_pattern = re.compile('as: (.+)\n')
     host_status_pattern = re.compile('Host: ([0-9.]*)\s(.+)\sStatus: (\w+)')
@@ -26,8 +31,8 @@ def parse_grep(project, resource):
 
     # Attempt to parse resource as file or string
     try:
-        if os.path.isfile(resource):
-            with open(resource, 'r') as fh:
+        if helper.is_resource(resource):
+            with helper.open_resource(resource) as fh:
                 contents = fh.read()
         else:
             contents = resource
@@ -50,7 +55,11 @@ def parse_grep(project, resource):
     # Process each 'host' in the file
     for host_match in host_status_pattern.findall(contents):
         host_ip, host_name, status = host_match
-        
+
+        # Don't import out-of-scope hosts
+        if scope is not None and host_ip not in scope:
+            continue
+
         host_dict = copy.deepcopy(models.host_model)
 
         # Parse the host status
@@ -95,17 +104,105 @@ def parse_grep(project, resource):
     return project_dict
 
 
-def parse_xml(project, resource):
+def parse_host(host, scope=None):
+    """Builds the host model for an Nmap 'host' element
+
+    :param host: The 'host' element
+    :param scope: Optional Scope; out-of-scope hosts are skipped
+    :return: The host model, or None if the host is not up or out of scope
+    """
+
+    host_dict = copy.deepcopy(models.host_model)
+
+    # Find the host status
+    status = host.find('status')
+    if status is not None:
+        if status.attrib['state'] != 'up':
+            host_dict['alive'] = False
+
+    if status is None or not host_dict.get('alive', False):
+        # Don't import dead hosts
+        return None
+
+    # Find the IP address and/or MAC address
+    for addr in host.findall('address'):
+
+        # Get IP address
+        if addr.attrib['addrtype'] == 'ipv4':
+            host_dict['string_addr'] = addr.attrib['addr']
+            host_dict['long_addr'] = helper.ip2long(addr.attrib['addr'])
+        elif addr.attrib['addrtype'] == 'mac':
+            host_dict['mac_addr'] = addr.attrib['addr']
+
+    # Don't import out-of-scope hosts
+    if scope is not None and host_dict['string_addr'] not in scope:
+        return None
+
+    # Find the host names
+    for hostname in host.iter('hostname'):
+        host_dict['hostnames'].append(hostname.attrib['name'])
+
+    # Find the ports
+    for port in host.iter('port'):
+        port_dict = copy.deepcopy(models.port_model)
+        port_dict['port'] = int(port.attrib['portid'])
+        port_dict['protocol'] = port.attrib['protocol']
+
+        # Find port status
+        status = port.find('state')
+        if status is not None:
+            if status.attrib['state'] != 'open':
+                continue
+            port_dict['alive'] = True
+
+        # Find port service and product
+        service = port.find('service')
+        if service is not None:
+            port_dict['service'] = service.attrib['name']
+            if 'product' in service.attrib:
+                if 'version' in service.attrib:
+                    port_dict['product'] = service.attrib['product'] + " " + service.attrib['version']
+                else:
+                    port_dict['product'] = service.attrib['product']
+            else:
+                port_dict['product'] = "unknown"
+
+        # Find NSE script output
+        for script in port.findall('script'):
+            note_dict = copy.deepcopy(models.note_model)
+            note_dict['title'] = script.attrib['id']
+            note_dict['content'] = script.attrib['output']
+            note_dict['last_modified_by'] = TOOL
+            port_dict['notes'].append(note_dict)
+
+        host_dict['ports'].append(port_dict)
+
+    # Find the Operating System
+    os_dict = copy.deepcopy(models.os_model)
+    os_dict['tool'] = TOOL
+    os_list = list(host.iter('osmatch'))
+    if os_list:
+        os_dict['weight'] = OS_WEIGHT
+        os_dict['fingerprint'] = os_list[0].attrib['name']
+
+    host_dict['os'].append(os_dict)
+
+    return host_dict
+
+
+def parse_xml(project, resource, scope=None):
     """Parses an Nmap XML file and updates the Lair database
 
     :param project: The project id
     :param resource: The Nmap xml file or xml string to be parsed
+    :param scope: Optional Scope; out-of-scope hosts are skipped
     """
 
     # Attempt to parse resource as file or string
     try:
-        if os.path.isfile(resource):
-            tree = et.parse(resource)
+        if helper.is_resource(resource):
+            with helper.open_resource(resource) as fh:
+                tree = et.parse(fh)
             root = tree.getroot()
         else:
             root = et.fromstring(resource)
@@ -131,78 +228,150 @@ def parse_xml(project, resource):
 
     # Process each 'host' in the file
     for host in root.findall('host'):
+        host_dict = parse_host(host, scope)
+        if host_dict is not None:
+            project_dict['hosts'].append(host_dict)
 
-        host_dict = copy.deepcopy(models.host_model)
+    return project_dict
 
-        # Find the host status
-        status = host.find('status')
-        if status is not None:
-            if status.attrib['state'] != 'up':
-                host_dict['alive'] = False
 
-        if status is None or not host_dict.get('alive', False):
-            # Don't import dead hosts
-            continue
+class FollowReader(object):
+    """File-like object that keeps reading a file or pipe as it grows.
 
-        # Find the IP address and/or MAC address
-        for addr in host.findall('address'):
+    Reading stops once the end marker has been read, when a pipe is closed,
+    or when a regular file has not grown for idle_timeout seconds. on_idle
+    is called each time the reader runs out of data and has to wait.
+    """
 
-            # Get IP address
-            if addr.attrib['addrtype'] == 'ipv4':
-                host_dict['string_addr'] = addr.attrib['addr']
-                host_dict['long_addr'] = helper.ip2long(addr.attrib['addr'])
-            elif addr.attrib['addrtype'] == 'mac':
-                host_dict['mac_addr'] = addr.attrib['addr']
+    def __init__(self, fh, end_marker, on_idle=None, poll_interval=1.0,
+                 idle_timeout=None):
+        self.fd = fh.fileno()
+        self.end_marker = end_marker
+        self.on_idle = on_idle
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.is_pipe = not stat.S_ISREG(os.fstat(self.fd).st_mode)
+        self.tail = ''
+        self.complete = False
+        self.eof = False
+        self.last_read = time.time()
+
+    def read(self, size=65536):
+        if size is None or size < 0:
+            size = 65536
+        idle = False
+        while not self.complete:
+            if self.is_pipe and \
+                    not select.select([self.fd], [], [], self.poll_interval)[0]:
+                data = None
+            else:
+                data = os.read(self.fd, size)
+                if not data and self.is_pipe:
+                    break
+
+            if data:
+                self.last_read = time.time()
+                window = self.tail + data
+                self.complete = self.end_marker in window
+                self.tail = window[-len(self.end_marker):]
+                return data
+
+            if not idle and self.on_idle is not None:
+                self.on_idle()
+            idle = True
+
+            if self.idle_timeout is not None and \
+                    time.time() - self.last_read >= self.idle_timeout:
+                break
+
+            if not self.is_pipe:
+                time.sleep(self.poll_interval)
+
+        self.eof = not self.complete
+        return ''
+
+
+def follow_xml(project, resource, save, batch_size=25, idle_timeout=None,
+               scope=None):
+    """Imports hosts from an Nmap XML file while Nmap is still writing it.
+    Each completed 'host' is parsed as soon as it is written and hosts are
+    handed to save in batches of up to batch_size, or whenever the output
+    stops growing. A report whose root element is never closed (e.g. an
+    interrupted scan) is imported up to its last completed host. The
+    command is only sent with the first batch, and each batch is numbered
+    in its 'batch' field.
 
-        # Find the host names
-        for hostname in host.iter('hostname'):
-            host_dict['hostnames'].append(hostname.attrib['name'])
+    :param project: The project id
+    :param resource: The Nmap xml file, or '-' to read from stdin
+    :param save: Callable receiving each batch as a project dictionary
+    :param batch_size: Maximum number of hosts per batch
+    :param idle_timeout: Seconds without new output before giving up on a
+                         regular file. Default is to wait for the scan to end.
+    :param scope: Optional Scope; out-of-scope hosts are skipped
+    :return: The number of hosts imported
+    """
 
-        # Find the ports
-        for port in host.iter('port'):
-            port_dict = copy.deepcopy(models.port_model)
-            port_dict['port'] = int(port.attrib['portid'])
-            port_dict['protocol'] = port.attrib['protocol']
-
-            # Find port status
-            status = port.find('state')
-            if status is not None:
-                if status.attrib['state'] != 'open':
-                    continue
-                port_dict['alive'] = True
-
-            # Find port service and product
-            service = port.find('service')
-            if service is not None:
-                port_dict['service'] = service.attrib['name']
-                if 'product' in service.attrib:
-                    if 'version' in service.attrib:
-                        port_dict['product'] = service.attrib['product'] + " " + service.attrib['version']
-                    else:
-                        port_dict['product'] = service.attrib['product']
-                else:
-                    port_dict['product'] = "unknown"
+    fh = sys.stdin if resource == '-' else open(resource, 'rb')
 
-            # Find NSE script output
-            for script in port.findall('script'):
-                note_dict = copy.deepcopy(models.note_model)
-                note_dict['title'] = script.attrib['id']
-                note_dict['content'] = script.attrib['output']
-                note_dict['last_modified_by'] = TOOL
-                port_dict['notes'].append(note_dict)
+    command_dict = copy.deepcopy(models.command_model)
+    command_dict['tool'] = TOOL
 
-            host_dict['ports'].append(port_dict)
+    pending = list()
+    totals = {'hosts': 0, 'batches': 0}
 
-        # Find the Operating System
-        os_dict = copy.deepcopy(models.os_model)
-        os_dict['tool'] = TOOL
-        os_list = list(host.iter('osmatch'))
-        if os_list:
-            os_dict['weight'] = OS_WEIGHT
-            os_dict['fingerprint'] = os_list[0].attrib['name']
+    def flush():
+        if not pending:
+            return
 
-        host_dict['os'].append(os_dict)
+        project_dict = copy.deepcopy(models.project_model)
+        project_dict['project_id'] = project
+        # The command is only recorded once, with the first batch
+        if not totals['batches']:
+            project_dict['commands'].append(dict(command_dict))
+        project_dict['batch'] = totals['batches']
+        project_dict['hosts'] = list(pending)
+        del pending[:]
 
-        project_dict['hosts'].append(host_dict)
+        totals['hosts'] += len(project_dict['hosts'])
+        totals['batches'] += 1
+        save(project_dict)
+
+    reader = FollowReader(fh, '</nmaprun>', on_idle=flush,
+                          idle_timeout=idle_timeout)
+    stack = list()
+    releaser = et.Releaser()
+
+    try:
+        for event, elem in et.iterparse(reader, events=('start', 'end')):
+            if event == 'start':
+                if not stack and elem.tag == 'nmaprun':
+                    command_dict['command'] = elem.attrib.get('args', '')
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            if len(stack) != 1:
+                continue
+
+            # Completed children of the root element are released as soon
+            # as they have been processed
+            if elem.tag == 'host':
+                host_dict = parse_host(elem, scope)
+                if host_dict is not None:
+                    pending.append(host_dict)
+            releaser.release(stack[0], elem)
+
+            if len(pending) >= batch_size:
+                flush()
+
+    except et.ParseError:
+        if not reader.eof:
+            raise
+        print "[!] Nmap output ended before the scan completed."
+
+    finally:
+        flush()
+        if fh is not sys.stdin:
+            fh.close()
 
-    return project_dict
\ No newline at end of file
+    return totals['hosts']
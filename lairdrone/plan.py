@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import copy
+import threading
+from bson import BSON
+
+
+class Results(list):
+    """Documents returned by a planned find(), with the cursor methods
+    api.save relies on
+    """
+
+    def count(self):
+        return len(self)
+
+
+def _keys(field, value):
+    # Index entries for a field value; list elements are indexed on their
+    # own so that equality and $all queries match them as MongoDB does, and
+    # so are the fields of subdocuments for $elemMatch
+    values = value if isinstance(value, list) else [value]
+    keys = list()
+    for item in values:
+        if isinstance(item, dict):
+            if '$elemMatch' in item:
+                item = item['$elemMatch']
+            for k, v in item.items():
+                keys.extend(_keys(field + '.' + k, v))
+            continue
+        try:
+            hash(item)
+        except TypeError:
+            continue
+        keys.append((field, item))
+    return keys
+
+
+def _element_matches(condition, item):
+    if isinstance(condition, dict) and '$elemMatch' in condition:
+        return isinstance(item, dict) and all(
+            item.get(k) == v for k, v in condition['$elemMatch'].items())
+    return condition == item
+
+
+def _value(document, field):
+    # Value of a field, a dotted field is read from each element of a list
+    # of subdocuments as MongoDB does
+    value = document
+    for name in field.split('.'):
+        if isinstance(value, list):
+            value = [item.get(name) for item in value if isinstance(item, dict)]
+        elif isinstance(value, dict):
+            value = value.get(name)
+        else:
+            return None
+    return value
+
+
+def _matches(q, document):
+    for field, condition in (q or {}).items():
+        value = _value(document, field)
+        values = value if isinstance(value, list) else [value]
+        if isinstance(condition, dict):
+            if '$all' in condition:
+                if not all(any(_element_matches(item, v) for v in values)
+                           for item in condition['$all']):
+                    return False
+            if '$in' in condition:
+                if not any(item in values for item in condition['$in']):
+                    return False
+        elif condition != value and condition not in values:
+            return False
+    return True
+
+
+def _apply_update(document, update):
+    # Applies the $set and $push operators api.save uses
+    for field, value in update.get('$set', {}).items():
+        document[field] = copy.deepcopy(value)
+    for field, value in update.get('$push', {}).items():
+        items = document.setdefault(field, list())
+        if isinstance(value, dict) and '$each' in value:
+            items.extend(copy.deepcopy(value['$each']))
+            if '$slice' in value:
+                document[field] = items[value['$slice']:] if value['$slice'] < 0 \
+                    else items[:value['$slice']]
+        else:
+            items.append(copy.deepcopy(value))
+    return document
+
+
+class PlannedCollection(object):
+    """A collection whose writes are recorded rather than sent.
+
+    Reads are served from the database, with the documents written earlier
+    in the plan laid over the stored ones, so a later save (or a later
+    batch of a streamed import) sees the same state as in a real run.
+    """
+
+    def __init__(self, plan, name, collection):
+        self.plan = plan
+        self.name = name
+        self.collection = collection
+
+        # _id -> planned document
+        self.written = dict()
+        # (field, value) -> set of planned document ids
+        self.index = dict()
+        # ids of the documents read from the database
+        self.stored = set()
+
+        self.inserts = set()
+        self.updates = set()
+        self.bytes = 0
+        # Operations of the bulk writes, whose documents are unknown
+        self.requests = 0
+
+    def _candidates(self, q):
+        ids = None
+        for field, condition in (q or {}).items():
+            if isinstance(condition, dict):
+                if '$all' in condition:
+                    keys = [k for item in condition['$all'] for k in _keys(field, item)]
+                    found = [self.index.get(k, set()) for k in keys]
+                    found = set.intersection(*found) if found else None
+                elif '$in' in condition:
+                    keys = [k for item in condition['$in'] for k in _keys(field, item)]
+                    found = set().union(*[self.index.get(k, set()) for k in keys])
+                else:
+                    found = None
+            else:
+                keys = _keys(field, condition)
+                found = self.index.get(keys[0], set()) if keys else None
+            if found is not None:
+                ids = found if ids is None else ids & found
+        return self.written.keys() if ids is None else ids
+
+    def _planned(self, q):
+        return [self.written[i] for i in self._candidates(q)
+                if _matches(q, self.written[i])]
+
+    def _read(self, document):
+        self.stored.add(document['_id'])
+        if document['_id'] in self.written:
+            return copy.deepcopy(self.written[document['_id']])
+        return document
+
+    def _forget(self, _id):
+        old = self.written.pop(_id, None)
+        if old is not None:
+            for field, value in old.items():
+                for key in _keys(field, value):
+                    self.index[key].discard(_id)
+
+    def _write(self, document, size=None):
+        document = copy.deepcopy(document)
+        _id = document['_id']
+
+        self._forget(_id)
+        self.written[_id] = document
+        for field, value in document.items():
+            for key in _keys(field, value):
+                self.index.setdefault(key, set()).add(_id)
+
+        if _id in self.stored:
+            self.updates.add(_id)
+        else:
+            self.inserts.add(_id)
+        self.bytes += len(BSON.encode(document)) if size is None else size
+
+    def find_one(self, q=None, *args, **kwargs):
+        with self.plan.lock:
+            self.plan.round_trips += 1
+            planned = self._planned(q)
+            if planned:
+                return copy.deepcopy(planned[0])
+            document = self.collection.find_one(q, *args, **kwargs)
+            return self._read(document) if document else document
+
+    def find(self, q=None, *args, **kwargs):
+        with self.plan.lock:
+            self.plan.round_trips += 1
+            results = Results()
+            for document in self.collection.find(q, *args, **kwargs):
+                results.append(self._read(document))
+            seen = set(document['_id'] for document in results)
+            results.extend(copy.deepcopy(document) for document in self._planned(q)
+                           if document['_id'] not in seen)
+            return results
+
+    def save(self, document):
+        with self.plan.lock:
+            self.plan.round_trips += 1
+            self._write(document)
+            return document['_id']
+
+    def insert_many(self, documents, ordered=True):
+        with self.plan.lock:
+            self.plan.round_trips += 1
+            for document in documents:
+                if document['_id'] not in self.written:
+                    self._write(document)
+
+    def update_one(self, q, update):
+        with self.plan.lock:
+            self.plan.round_trips += 1
+            planned = self._planned(q)
+            if planned:
+                document = copy.deepcopy(planned[0])
+            else:
+                document = self.collection.find_one(q)
+                if not document:
+                    return
+                self._read(document)
+            self._write(_apply_update(document, update),
+                        len(BSON.encode(update)))
+
+    def write_documents(self, ops):
+        # See throttle.write_documents
+        with self.plan.lock:
+            self.plan.round_trips += 1
+            for op, document in ops:
+                if op not in ('insert', 'replace'):
+                    raise ValueError("Unsupported write: {0}".format(op))
+                self._write(document)
+
+    def bulk_write(self, requests, ordered=True):
+        # pymongo requests do not expose their documents, so they are only
+        # counted, as ThrottledDB does: neither sized nor seen by later
+        # reads. api.save writes through throttle.write_documents.
+        with self.plan.lock:
+            self.plan.round_trips += 1
+            self.requests += len(list(requests))
+
+    def delete_one(self, q):
+        with self.plan.lock:
+            self.plan.round_trips += 1
+            for document in self._planned(q)[:1]:
+                self._forget(document['_id'])
+
+    def ensure_index(self, *args, **kwargs):
+        with self.plan.lock:
+            self.plan.round_trips += 1
+
+    create_index = ensure_index
+
+
+class Plan(object):
+    """Stands in for a database connection to plan what api.save would do.
+
+    Passed to api.save in place of the connection, it runs all of the
+    matching and merging logic against the current state of the database
+    but writes nothing. The inserts and updates it would make, the size of
+    the documents it would send and the number of round trips are recorded
+    for report().
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.round_trips = 0
+        self.collections = dict()
+        # api.save may write from several threads
+        self.lock = threading.RLock()
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = PlannedCollection(self, name, self.db[name])
+            return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    @property
+    def name(self):
+        # The name of the database, not a collection named 'name'
+        return self.db.name
+
+    def create_collection(self, name, **kwargs):
+        with self.lock:
+            self.round_trips += 1
+        return self[name]
+
+    def collection_names(self, *args, **kwargs):
+        with self.lock:
+            self.round_trips += 1
+        return self.db.collection_names(*args, **kwargs)
+
+    def summary(self):
+        """Totals of the planned writes
+
+        :return: Dict of collection name to a dict with the number of
+                 'inserts' and 'updates', of other bulk write 'requests'
+                 and the 'bytes' sent, and the totals under 'bytes' and
+                 'round_trips'
+        """
+        collections = dict()
+        for name, collection in self.collections.items():
+            if collection.inserts or collection.updates or collection.requests:
+                collections[name] = {
+                    'inserts': len(collection.inserts),
+                    'updates': len(collection.updates),
+                    'requests': collection.requests,
+                    'bytes': collection.bytes,
+                }
+        return {
+            'collections': collections,
+            'bytes': sum(c['bytes'] for c in collections.values()),
+            'round_trips': self.round_trips,
+        }
+
+    def report(self):
+        """Describes the planned writes
+
+        :return: Printable report
+        """
+        summary = self.summary()
+        lines = ["[+] Dry run, nothing was written. Planned changes:"]
+        for name in sorted(summary['collections']):
+            c = summary['collections'][name]
+            lines.append("[+]   {0}: {1} insert(s), {2} update(s), {3} bytes".format(
+                name, c['inserts'], c['updates'], c['bytes']))
+            if c['requests']:
+                lines.append("[+]     and {0} bulk write request(s) of unknown size".format(
+                    c['requests']))
+        if not summary['collections']:
+            lines.append("[+]   none")
+        lines.append("[+] Estimated bytes written: {0}".format(summary['bytes']))
+        lines.append("[+] Database round trips: {0}".format(summary['round_trips']))
+        return '\n'.join(lines)
@@ -3,26 +3,46 @@
 # See the file license.txt for copying permission
 
 import os
+import re
 import sys
 import json
+import itertools
+from StringIO import StringIO
 sys.path.append(os.path.abspath(
     os.path.join(os.path.dirname(__file__), '..'))
 )
 
+from lairdrone import helper
 
-def parse(project, resource):
-    """Parses a raw JSON file and updates the Lair database
+# Bytes read from the input at a time when streaming
+CHUNK_SIZE = 65536
+
+# Default number of hosts and vulnerabilities saved at once when streaming
+DEFAULT_BATCH_SIZE = 100
+
+# Document keys holding records, and the record type of their items
+RECORD_KEYS = {
+    'hosts': 'host',
+    'vulnerabilities': 'vulnerability',
+}
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def parse(project, resource, scope=None):
+    """Parses a raw JSON or NDJSON file and updates the Lair database
 
     :param project: The project id
     :param resource: The JSON file, string, or dict to be parsed
+    :param scope: Optional Scope; out-of-scope hosts are removed
     """
 
     # Attempt to parse resource as file or string
-    if isinstance(resource, str) and os.path.isfile(resource):
-        with open(resource, "r") as raw_json:
-            project_dict = json.load(raw_json)
+    if helper.is_resource(resource):
+        with helper.open_resource(resource) as raw_json:
+            project_dict = read_document(raw_json)
     elif isinstance(resource, str):
-        project_dict = json.loads(resource)
+        project_dict = read_document(StringIO(resource))
     elif isinstance(resource, dict):
         project_dict = resource
     else:
@@ -30,4 +50,276 @@ def parse(project, resource):
 
     project_dict['project_id'] = project
 
+    if scope is not None:
+        filter_scope(project_dict, scope)
+
+    return project_dict
+
+
+def filter_vulnerability(vuln, scope):
+    """Removes out-of-scope hosts from a vulnerability
+
+    :param vuln: The raw vulnerability dictionary
+    :param scope: Scope to apply
+    :return: The vulnerability, or None if it was left without hosts
+    """
+    hosts = [h for h in vuln.get('hosts', [])
+             if h.get('string_addr') in scope]
+    if hosts or not vuln.get('hosts'):
+        vuln['hosts'] = hosts
+        return vuln
+    return None
+
+
+def filter_scope(project_dict, scope):
+    """Removes out-of-scope hosts from a raw document, along with their
+    references in vulnerabilities. Vulnerabilities left without hosts are
+    removed.
+
+    :param project_dict: The raw project dictionary
+    :param scope: Scope to apply
+    """
+    project_dict['hosts'] = [
+        host for host in project_dict.get('hosts', [])
+        if host.get('string_addr') in scope
+    ]
+
+    vulnerabilities = list()
+    for vuln in project_dict.get('vulnerabilities', []):
+        if filter_vulnerability(vuln, scope) is not None:
+            vulnerabilities.append(vuln)
+    project_dict['vulnerabilities'] = vulnerabilities
+
+
+class JSONReader(object):
+    """Reads consecutive JSON values from a file without loading it whole.
+    Only the value being decoded is held in memory, so the members of a
+    large object or array can be read one at a time.
+    """
+
+    def __init__(self, fh, chunk_size=CHUNK_SIZE):
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        if self.eof:
+            return False
+
+        # Drop what has already been read
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+
+        data = self.fh.read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def peek(self):
+        """Returns the next non-whitespace character, or '' at the end"""
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        """Consumes the next non-whitespace character
+
+        :param chars: The characters allowed next
+        :return: The character consumed
+        """
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError("Expected one of '%s' but found '%s'" % (chars, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decodes the next JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # Incomplete value, read more. Reads grow with the buffer
+                # so a large value is not decoded over and over.
+                if not self._fill(max(self.chunk_size, len(self.buf) - self.pos)):
+                    raise
+                continue
+
+            # A number at the end of the buffer may continue in the next chunk
+            if end < len(self.buf) or not self._fill():
+                self.pos = end
+                return value
+
+
+def iter_records(fh):
+    """Reads a raw JSON document incrementally. The document is either a
+    single project object, or a newline delimited (NDJSON) file whose first
+    line is a header object followed by one record per line, each of the
+    form {"host": {...}} or {"vulnerability": {...}}. Hosts and
+    vulnerabilities in the first object are also read one at a time.
+
+    :param fh: File object to read
+    :return: Generator of (type, value) tuples. The type is 'host' or
+             'vulnerability', or 'header' for the project fields, which are
+             yielded once the first object has been read.
+    """
+    reader = JSONReader(fh)
+    header = dict()
+
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.expect('}')
+    else:
+        while True:
+            key = reader.value()
+            reader.expect(':')
+            if key in RECORD_KEYS and reader.peek() == '[':
+                reader.expect('[')
+                if reader.peek() == ']':
+                    reader.expect(']')
+                else:
+                    while True:
+                        yield RECORD_KEYS[key], reader.value()
+                        if reader.expect(',]') == ']':
+                            break
+            else:
+                header[key] = reader.value()
+
+            if reader.expect(',}') == '}':
+                break
+
+    yield 'header', header
+
+    # Any further values are newline delimited records
+    record_types = RECORD_KEYS.values()
+    while reader.peek():
+        record = reader.value()
+        if not isinstance(record, dict) or len(record) != 1 or \
+                record.keys()[0] not in record_types:
+            raise ValueError('Invalid record: expected {"host": ...} or '
+                             '{"vulnerability": ...}')
+        yield record.items()[0]
+
+
+def read_document(fh):
+    """Reads a raw JSON or NDJSON document into a project dictionary
+
+    :param fh: File object to read
+    """
+    records = {'host': list(), 'vulnerability': list()}
+    for record_type, value in iter_records(fh):
+        if record_type == 'header':
+            project_dict = value
+        else:
+            records[record_type].append(value)
+
+    project_dict['hosts'] = records['host']
+    project_dict['vulnerabilities'] = records['vulnerability']
     return project_dict
+
+
+def stream(project, resource, save, batch_size=DEFAULT_BATCH_SIZE, scope=None):
+    """Imports a raw JSON or NDJSON file without loading it into memory.
+    Hosts and vulnerabilities are handed to save in batches of up to
+    batch_size records, each batch carrying the project fields from the
+    header. The commands and notes are only sent with the first batch, and
+    each batch is numbered in its 'batch' field.
+
+    When a single object document lists hosts or vulnerabilities before
+    its other fields, the file is read twice: first for the fields, then
+    for the records. If the input cannot be rewound the records are held
+    until the fields have been read.
+
+    :param project: The project id
+    :param resource: The JSON file, '-' for stdin, or a file object
+    :param save: Callable receiving each batch as a project dictionary
+    :param batch_size: Maximum number of hosts and vulnerabilities per batch
+    :param scope: Optional Scope; out-of-scope hosts are removed
+    :return: Tuple of the number of hosts and vulnerabilities imported
+    """
+
+    if isinstance(resource, basestring):
+        fh = helper.open_resource(resource)
+    else:
+        fh = resource
+
+    try:
+        fh.tell()
+        seekable = True
+    except (AttributeError, IOError):
+        seekable = False
+
+    try:
+        records = iter_records(fh)
+        early = list()
+        rewind = False
+        for record_type, value in records:
+            if record_type == 'header':
+                header = value
+                break
+            if seekable:
+                rewind = True
+            else:
+                early.append((record_type, value))
+
+        if rewind:
+            # Records preceded the end of the header, read them again
+            fh.seek(0)
+            records = (r for r in iter_records(fh) if r[0] != 'header')
+
+        header['project_id'] = project
+
+        # Project commands and notes are only sent once
+        commands = header.pop('commands', [])
+        notes = header.pop('notes', [])
+
+        pending = {'host': list(), 'vulnerability': list()}
+        totals = {'host': 0, 'vulnerability': 0, 'batches': 0}
+
+        def flush(force=False):
+            if not force and not pending['host'] and not pending['vulnerability']:
+                return
+
+            project_dict = dict(header)
+            project_dict['commands'] = list() if totals['batches'] else commands
+            project_dict['notes'] = list() if totals['batches'] else notes
+            project_dict['batch'] = totals['batches']
+            project_dict['hosts'] = list(pending['host'])
+            project_dict['vulnerabilities'] = list(pending['vulnerability'])
+            for record_type in pending:
+                totals[record_type] += len(pending[record_type])
+                del pending[record_type][:]
+
+            totals['batches'] += 1
+            save(project_dict)
+
+        for record_type, value in itertools.chain(early, records):
+            if scope is not None:
+                if record_type == 'host':
+                    if value.get('string_addr') not in scope:
+                        continue
+                elif filter_vulnerability(value, scope) is None:
+                    continue
+
+            pending[record_type].append(value)
+            if len(pending['host']) + len(pending['vulnerability']) >= batch_size:
+                flush()
+
+        # A document without records still records its command and notes
+        flush(force=not totals['batches'])
+
+        return totals['host'], totals['vulnerability']
+
+    finally:
+        if fh is not resource:
+            fh.close()
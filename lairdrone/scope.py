@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import socket
+from bisect import bisect_right
+from lairdrone import helper
+from lairdrone.exceptions import InvalidScopeError
+
+MAX_LONG_ADDR = 0xFFFFFFFF
+
+
+def parse_entry(entry):
+    """Converts a scope entry to an inclusive range of long addresses
+
+    :param entry: A CIDR (10.0.0.0/8), a range (10.0.0.1-10.0.0.50) or
+                  a single address
+    :return: Tuple of the first and last long address
+    """
+    try:
+        if '/' in entry:
+            addr, bits = entry.split('/', 1)
+            bits = int(bits)
+            if bits < 0 or bits > 32:
+                raise ValueError
+            mask = (MAX_LONG_ADDR << (32 - bits)) & MAX_LONG_ADDR
+            first = helper.ip2long(addr.strip()) & mask
+            return first, first | (~mask & MAX_LONG_ADDR)
+
+        if '-' in entry:
+            first, last = entry.split('-', 1)
+            first = helper.ip2long(first.strip())
+            last = helper.ip2long(last.strip())
+            if last < first:
+                raise ValueError
+            return first, last
+
+        n = helper.ip2long(entry)
+        return n, n
+
+    except (socket.error, ValueError):
+        raise InvalidScopeError(entry)
+
+
+def merge_ranges(ranges):
+    """Sorts ranges and merges any that overlap or touch
+
+    :param ranges: Iterable of inclusive (first, last) tuples
+    :return: Sorted list of disjoint ranges
+    """
+    merged = list()
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def subtract_ranges(ranges, excluded):
+    """Removes excluded addresses from a list of ranges
+
+    :param ranges: Sorted list of disjoint ranges
+    :param excluded: Sorted list of disjoint ranges to remove
+    :return: Sorted list of disjoint ranges
+    """
+    result = list()
+    for first, last in ranges:
+        for ex_first, ex_last in excluded:
+            if ex_last < first or ex_first > last:
+                continue
+            if ex_first > first:
+                result.append((first, ex_first - 1))
+            first = ex_last + 1
+            if first > last:
+                break
+        if first <= last:
+            result.append((first, last))
+    return result
+
+
+class Scope(object):
+    """Set of in-scope IPv4 addresses.
+
+    Included and excluded entries are compiled into one sorted list of
+    disjoint address ranges, so each lookup is a single bisect. When no
+    include entries are given every address not excluded is in scope.
+    """
+
+    def __init__(self, includes=None, excludes=None):
+        if includes:
+            ranges = merge_ranges([parse_entry(e) for e in includes])
+        else:
+            ranges = [(0, MAX_LONG_ADDR)]
+
+        ranges = subtract_ranges(
+            ranges, merge_ranges([parse_entry(e) for e in excludes or []]))
+
+        self.starts = [first for first, last in ranges]
+        self.ends = [last for first, last in ranges]
+
+    def contains_long(self, n):
+        """Checks if an address is in scope
+
+        :param n: IP address as a long value
+        """
+        i = bisect_right(self.starts, n) - 1
+        return i >= 0 and n <= self.ends[i]
+
+    def __contains__(self, ip):
+        try:
+            n = helper.ip2long(ip)
+        except (socket.error, TypeError):
+            return False
+        return self.contains_long(n)
+
+
+def load_file(path):
+    """Loads a scope file. Each line holds a CIDR, a range or a single
+    address. Lines starting with '!' are excluded from the scope, and
+    blank lines and '#' comments are ignored.
+
+    :param path: Path to the scope file
+    :return: Scope
+    """
+    includes = list()
+    excludes = list()
+    with open(path, 'r') as fh:
+        for line in fh:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith('!'):
+                excludes.append(line[1:].strip())
+            else:
+                includes.append(line)
+
+    return Scope(includes, excludes)
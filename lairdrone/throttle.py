@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+import time
+import random
+import threading
+from bson import BSON
+from pymongo import InsertOne, ReplaceOne
+from pymongo.errors import ConnectionFailure, OperationFailure, BulkWriteError
+
+DEFAULT_RETRIES = 5
+
+# Delay before the first retry and the longest delay between two retries,
+# in seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# Server error codes worth retrying: the server is unreachable, shutting
+# down or changing primary
+TRANSIENT_CODES = frozenset([6, 7, 89, 91, 189, 262, 9001, 10107, 11600,
+                             11602, 13435, 13436])
+
+DUPLICATE_KEY = 11000
+
+# Collection methods that write, and the ones that only read
+WRITE_METHODS = ('save', 'insert_one', 'insert_many', 'replace_one',
+                 'update_one', 'update_many', 'delete_one', 'delete_many',
+                 'bulk_write')
+READ_METHODS = ('find_one', 'count', 'count_documents', 'distinct',
+                'ensure_index', 'create_index')
+
+# Writes that can be repeated after a failure whose outcome is unknown:
+# they replace or insert documents by _id, and the duplicate key errors of
+# an unordered bulk insert that went through are ignored (see
+# ThrottledDB.call). Any other write, e.g. an update with $push, is only
+# retried once by the driver (retryWrites), which the server applies once
+RETRIED_WRITES = ('save', 'replace_one', 'insert_many', 'bulk_write')
+BULK_WRITES = ('insert_many', 'bulk_write')
+
+
+def is_transient(error):
+    """Tells if a database error is worth retrying
+
+    :param error: Exception raised by pymongo
+    """
+    if isinstance(error, ConnectionFailure):
+        return True
+    if isinstance(error, OperationFailure) and \
+            not isinstance(error, BulkWriteError):
+        return error.code in TRANSIENT_CODES
+    return False
+
+
+class TokenBucket(object):
+    """Limits a rate, allowing bursts of up to one second of budget.
+
+    A request larger than the bucket is let through once the bucket is
+    full and leaves it in debt, so later requests wait for it to refill.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def take(self, amount):
+        """Waits until amount can be spent
+
+        :param amount: Number of tokens spent
+        :return: Seconds waited
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rate,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(0.0, (min(amount, self.rate) - self.tokens) / self.rate)
+            self.tokens -= amount
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def _document_size(document):
+    try:
+        return len(BSON.encode(document))
+    except Exception:
+        return 0
+
+
+def bulk_requests(ops):
+    """Turns documents to write into bulk write requests
+
+    :param ops: List of ('insert', document) and ('replace', document)
+                tuples, replaced documents are matched on their _id
+    :return: List of pymongo InsertOne and ReplaceOne requests
+    """
+    requests = list()
+    for op, document in ops:
+        if op == 'insert':
+            requests.append(InsertOne(document))
+        elif op == 'replace':
+            requests.append(ReplaceOne({'_id': document['_id']}, document))
+        else:
+            raise ValueError("Unsupported write: {0}".format(op))
+    return requests
+
+
+def write_documents(collection, ops):
+    """Inserts and replaces documents with unordered bulk writes.
+    Collections that know the documents they write (ThrottledCollection and
+    plan.PlannedCollection) are given them as they are, any other gets
+    pymongo requests.
+
+    :param collection: Target collection
+    :param ops: List of ('insert', document) and ('replace', document)
+                tuples, see bulk_requests
+    """
+    # Looked up on the type, a pymongo collection would return the
+    # sub-collection named write_documents
+    if getattr(type(collection), 'write_documents', None) is not None:
+        return collection.write_documents(ops)
+    return collection.bulk_write(bulk_requests(ops), ordered=False)
+
+
+class ThrottledDB(object):
+    """Wraps a database connection to keep writes within a budget of
+    operations and bytes per second, and to retry operations that fail
+    with a transient error after an exponential backoff with full jitter.
+
+    Collections are wrapped as they are accessed, any other attribute is
+    the one of the connection. Cursors returned by find() are not retried,
+    and writes only when they are idempotent, see RETRIED_WRITES.
+    Only the number of operations of a bulk_write() counts against the
+    budget, write_documents() also counts the bytes.
+    Totals of the time spent waiting on the budget and of the retries are
+    kept in waited and retried.
+    """
+
+    def __init__(self, db, ops_per_second=None, bytes_per_second=None,
+                 retries=DEFAULT_RETRIES):
+        self.db = db
+        self.ops = TokenBucket(ops_per_second) if ops_per_second else None
+        self.bytes = TokenBucket(bytes_per_second) if bytes_per_second else None
+        self.retries = retries
+
+        self.waited = 0.0
+        self.retried = 0
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name):
+        return ThrottledCollection(self, self.db[name])
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self.db, name)
+        if hasattr(attr, 'find_one'):
+            return ThrottledCollection(self, attr)
+        return attr
+
+    def collection_names(self, *args, **kwargs):
+        return self.call(False, self.db.collection_names, *args, **kwargs)
+
+    def throttle(self, ops, size):
+        """Waits until the budget allows a write
+
+        :param ops: Number of operations written
+        :param size: Number of bytes written
+        """
+        waited = 0.0
+        if self.ops is not None:
+            waited += self.ops.take(ops)
+        if self.bytes is not None and size:
+            waited += self.bytes.take(size)
+        if waited:
+            with self.lock:
+                self.waited += waited
+
+    def call(self, retry_inserts, func, *args, **kwargs):
+        """Calls func, retrying it after transient errors
+
+        :param retry_inserts: Whether func is a bulk write, whose retries may
+                              find documents inserted by the failed attempt
+        :param func: Database operation
+        """
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except BulkWriteError as e:
+                # An insert that went through before the failure
+                errors = e.details.get('writeErrors', [])
+                if retry_inserts and attempt and errors and \
+                        all(error.get('code') == DUPLICATE_KEY for error in errors):
+                    return None
+                raise
+            except Exception as e:
+                if attempt >= self.retries or not is_transient(e):
+                    raise
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            attempt += 1
+            with self.lock:
+                self.retried += 1
+            print "[!] Database error, retry {0}/{1} in {2:.1f}s".format(
+                attempt, self.retries, delay)
+            time.sleep(delay)
+
+
+class ThrottledCollection(object):
+    """A collection whose writes go through the budget of a ThrottledDB"""
+
+    def __init__(self, throttled, collection):
+        self.throttled = throttled
+        self.collection = collection
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self.collection, name)
+        if name in WRITE_METHODS:
+            return lambda *args, **kwargs: self._write(name, attr, *args, **kwargs)
+        if name in READ_METHODS:
+            return lambda *args, **kwargs: self.throttled.call(False, attr, *args, **kwargs)
+        return attr
+
+    def write_documents(self, ops):
+        """Inserts and replaces documents, see write_documents
+
+        :param ops: List of ('insert', document) and ('replace', document)
+                    tuples
+        """
+        requests = bulk_requests(ops)
+        self.throttled.throttle(len(requests), sum(_document_size(document)
+                                                   for op, document in ops))
+        return self.throttled.call(True, self.collection.bulk_write,
+                                   requests, ordered=False)
+
+    def _write(self, name, func, *args, **kwargs):
+        first = args[0] if args else None
+        if name in BULK_WRITES:
+            requests = list(first)
+            args = (requests,) + args[1:]
+            ops = len(requests)
+            # The requests of a bulk_write do not expose their documents
+            size = 0 if name == 'bulk_write' else \
+                sum(_document_size(document) for document in requests)
+        else:
+            ops = 1
+            size = _document_size(args[-1]) if args and isinstance(args[-1], dict) else 0
+
+        self.throttled.throttle(ops, size)
+        # An ordered bulk write stops at the first duplicate key, the
+        # documents after it would be skipped by the retry
+        if name not in RETRIED_WRITES or \
+                (name in BULK_WRITES and kwargs.get('ordered', True)):
+            return func(*args, **kwargs)
+        return self.throttled.call(name in BULK_WRITES, func, *args, **kwargs)
+
+
+def from_environment(db):
+    """Wraps a connection with the budget and retries set by LAIR_WRITE_OPS
+    (operations per second), LAIR_WRITE_BYTES (bytes per second) and
+    LAIR_RETRIES. There is no budget by default.
+
+    :param db: A connection to the target Lair database
+    :return: ThrottledDB
+    """
+    return ThrottledDB(db,
+                       ops_per_second=float(os.environ.get('LAIR_WRITE_OPS') or 0),
+                       bytes_per_second=float(os.environ.get('LAIR_WRITE_BYTES') or 0),
+                       retries=int(os.environ.get('LAIR_RETRIES') or DEFAULT_RETRIES))
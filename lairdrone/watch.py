@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+import time
+import threading
+import traceback
+from Queue import Queue
+from lairdrone import api
+from lairdrone import burp
+from lairdrone import dirb
+from lairdrone import helper
+from lairdrone import nessus
+from lairdrone import nexpose
+from lairdrone import nmap
+from lairdrone import raw
+
+# Number of bytes read from the start of a file to detect its tool
+SNIFF_SIZE = 4096
+
+# Content signatures checked against the start of a file, in order
+SIGNATURES = (
+    ('nmap', '<nmaprun'),
+    ('nessus', '<NessusClientData_v2'),
+    ('nexpose', '<NexposeReport'),
+    ('burp', '<issues'),
+    ('dirb', 'DIRB v'),
+    ('dirb', 'URL_BASE: '),
+    ('nmap-grep', '# Nmap '),
+)
+
+# File name suffixes used by tools for output that is still being written
+PARTIAL_SUFFIXES = ('.part', '.tmp', '.swp', '~')
+
+
+def detect_tool(path):
+    """Identifies the tool that produced a file from its content. Compressed
+    files are identified by their decompressed content.
+
+    :param path: Path to the file
+    :return: The tool name, or None if the content is not recognized
+    """
+    with helper.open_resource(path) as fh:
+        head = fh.read(SNIFF_SIZE)
+
+    for tool, signature in SIGNATURES:
+        if signature in head:
+            return tool
+
+    if head.lstrip('\xef\xbb\xbf \t\r\n').startswith('{'):
+        return 'raw'
+
+    return None
+
+
+def _parse_raw(project, path, include_informational, scope):
+    project_dict = raw.parse(project, path, scope)
+    commands = project_dict.get('commands') or [{}]
+    return project_dict, commands[0].get('tool') or 'raw'
+
+
+# Maps a detected tool to a function returning the parsed project
+# dictionary and the tool name recorded by api.save
+PARSERS = {
+    'nmap': lambda project, path, info, scope: (
+        nmap.parse_xml(project, path, scope), nmap.TOOL),
+    'nmap-grep': lambda project, path, info, scope: (
+        nmap.parse_grep(project, path, scope), nmap.TOOL),
+    'nessus': lambda project, path, info, scope: (
+        nessus.parse(project, path, info, scope=scope), nessus.TOOL),
+    'nexpose': lambda project, path, info, scope: (
+        nexpose.parse(project, path, info, scope), nexpose.TOOL),
+    'burp': lambda project, path, info, scope: (
+        burp.parse(project, path, info, scope), burp.TOOL),
+    'dirb': lambda project, path, info, scope: (
+        dirb.parse(project, path, scope), dirb.TOOL),
+    'raw': _parse_raw,
+}
+
+
+class Watcher(object):
+    """Polls directories for new scan output and imports each file into a
+    Lair project.
+
+    A file is only picked up once its size and modification time have not
+    changed for settle seconds, so output that is still being written is
+    not imported early. Files are parsed by a bounded pool of worker
+    threads sharing one database connection. Saves are serialized since
+    api.save merges against the current project state.
+    """
+
+    def __init__(self, project, directories, db, workers=2, settle=10,
+                 interval=5, include_informational=False, scope=None):
+        self.project = project
+        self.directories = directories
+        self.db = db
+        self.settle = settle
+        self.interval = interval
+        self.include_informational = include_informational
+        self.scope = scope
+
+        # path -> (size, mtime, time the size and mtime were first seen)
+        self.candidates = dict()
+
+        # path -> (size, mtime) of the version already handled
+        self.handled = dict()
+
+        self.queue = Queue(maxsize=workers * 2)
+        self.save_lock = threading.Lock()
+        self.workers = list()
+        for i in range(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def scan(self):
+        """Walks the watched directories once and queues every file that
+        has settled since it was last handled
+        """
+        now = time.time()
+        for directory in self.directories:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                for filename in filenames:
+                    if filename.startswith('.') or \
+                            filename.endswith(PARTIAL_SUFFIXES):
+                        continue
+
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+
+                    version = (st.st_size, st.st_mtime)
+                    if self.handled.get(path) == version:
+                        continue
+
+                    candidate = self.candidates.get(path)
+                    if candidate is None or candidate[:2] != version:
+                        self.candidates[path] = version + (now,)
+                        continue
+
+                    if now - candidate[2] < self.settle:
+                        continue
+
+                    del self.candidates[path]
+                    self.handled[path] = version
+                    self.queue.put(path)
+
+    def run(self):
+        """Scans the watched directories every interval seconds, forever"""
+        print "[+] Watching {0} for project {1}".format(
+            ', '.join(self.directories), self.project)
+        while True:
+            self.scan()
+            time.sleep(self.interval)
+
+    def ingest(self, path):
+        """Detects the tool that produced a file, parses it and saves it
+
+        :param path: Path to the file
+        """
+        tool = detect_tool(path)
+        if tool is None:
+            print "[!] Skipping {0}: unrecognized file format.".format(path)
+            return
+
+        print "[+] Importing {0} as {1} output".format(path, tool)
+        project_dict, tool_name = PARSERS[tool](
+            self.project, path, self.include_informational, self.scope)
+
+        with self.save_lock:
+            api.save(project_dict, self.db, tool_name)
+
+    def _work(self):
+        while True:
+            path = self.queue.get()
+            try:
+                self.ingest(path)
+            except Exception:
+                print "[!] Failed to import {0}:".format(path)
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
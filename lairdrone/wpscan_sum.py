@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import re
+from HTMLParser import HTMLParser
+import json
+from urlparse import urlparse
+from lairdrone import drone_models as models
+from lairdrone import helper
+from distutils.version import LooseVersion
+
+# Scan to run:
+# wpscan --random-user-agent -v --url https://example.com --api-token <TOKEN> -v -e ap,at,tt,cb,dbe,u1-10,m1-10 -o wpscan.json -f json
+
+OS_WEIGHT = 0
+TOOL = "wpscan"
+CVSS = 0.1
+CVES = []
+
+
+def get_cves(resolver, cve_ids):
+    resolved = resolver.resolve(cve_ids)
+
+    cves = []
+    for cve in cve_ids:
+        if resolved[cve] is None:
+            continue
+        global CVES
+        CVES.append(cve)
+        cves.append(resolved[cve])
+
+    return cves
+
+def cvss_severity(base_score):
+    if base_score >= 9:
+        return "Critical"
+    if base_score >= 7:
+        return "High"
+    if base_score >= 4:
+        return "Medium"
+    return "Low"
+
+
+
+# Info about detected version.
+def version_info(doc):
+    v = doc['version']
+
+    out = '''
+- Version Number: %s
+- Release Date: %s
+- Status: %s
+- Detection Method: %s
+- Detection Result: %s
+- Vulnerabilities: %s
+''' % (
+    v.get('number'),
+    v.get('release_date'),
+    v.get('status'),
+    v.get('found_by'),
+    v['interesting_entries'][0] if v.get('interesting_entries') else '',
+    len(v['vulnerabilities']) if v.get('vulnerabilities') else 0,
+    )
+
+    return out
+
+
+
+# .Vulnerabilities in WP itself at path: ['version']['vulnerabilities'].
+def wp_vulns(doc):
+    backups = doc.get('')
+    if not backups:
+        return "(none)\n"
+
+    return "**THERE IS CONTENT IN THIS BUT PARSING IS NOT COMPLETE. PLEASE IMPLEMENT AND RE-RUN.**\n"
+
+
+
+# Info about used plugins.
+def plugin_info(doc, resolver):
+    plugins = doc.get('plugins')
+    if not plugins:
+        return "(none)\n"
+
+    out = ""
+    for p in plugins.values():
+        print 'PLUGIN START:',  p.get('slug', 'Unknown').capitalize(), '\n'
+        vuln_out = ""
+        for v in p.get('vulnerabilities', []):
+            cve_ids = []
+            for cve in v['references'].get('cve', []):
+                cve_ids.append("CVE-%s" % cve)
+
+            cvss = 0
+            cves = get_cves(resolver, cve_ids)
+            for cve in cves:
+                score = cve.get('impact', {}).get('baseMetricV2', {}).get('cvssV2', {}).get('baseScore', 0)
+                if score == 0:
+                    score = cve.get('impact', {}).get('baseMetricV3', {}).get('cvssV3', {}).get('baseScore', 0)
+                cvss = score if score > cvss else cvss
+            url = ""
+            for wpvulndb_ref in v['references'].get('wpvulndb', []):
+                url = "https://wpscan.com/vulnerability/" + wpvulndb_ref
+                break
+            if url == '':
+                for url_ref in v['references'].get('url', []):
+                    url = url_ref
+                    break
+            if url == '' and len(cves) > 0:
+                cve_id = cves[0]['cve']['CVE_data_meta']['ID']
+                url = "https://nvd.nist.gov/vuln/detail/" + cve_id
+
+            if url == '':
+                url = 'https://wpscan.com'
+
+            global CVSS
+            if CVSS < cvss:
+                # print 'setting cvss to:', cvss
+                CVSS = cvss
+
+            vuln_out += '  - [%s](%s): %s severity (%s)\n' % (
+                v.get('title', 'Untitled'),
+                url,
+                cvss_severity(cvss),
+                cvss,
+                )
+
+# We could say something like this:
+# Note that we were unable to determine the version numbers of some in-use plugins with known vulnerabilities. We have included them below but recognize they may be up-to-date.
+
+        out += '''
+%s:
+
+- Location: <%s>
+- Version: %s
+- Latest Version: %s
+- Last Updated: %s
+- Outdated: %s
+- Vulnerabilities: %s
+''' % (
+    p.get('slug', 'Unknown').capitalize(),
+    p.get('location', 'Unknown'),
+    p['version']['number'] if p.get('version') else 'Unknown',
+    p.get('latest_version', 'Unknown'),
+    p.get('last_updated', 'Unknown'),
+    "Yes" if p.get('outdated') else "No",
+    0 if vuln_out == "" else "\n"+vuln_out,
+    )
+
+    # print 'PLUGIN OUT:',  out, '\n'
+
+    return out
+
+
+
+# Info about used themes.
+def theme_info(doc):
+    themes = doc.get('themes')
+    if not themes:
+        return "(none)\n"
+
+    out = ""
+    for t in themes.values():
+        out += '''
+%s:
+
+- Location: %s
+- Version: %s
+- Latest Version: %s
+- Last Updated: %s
+- Outdated: %s
+- Vulnerabilities: %d
+''' % (
+    t.get('style_name', t.get('slug', 'Unknown')).capitalize(),
+    t.get('location', 'Unknown'),
+    t['version']['number'] if t.get('version') else 'Unknown',
+    t.get('latest_version', 'Unknown'),
+    t.get('last_updated', 'Unknown'),
+    "Yes" if t.get('outdated') else "No",
+    len(t['vulnerabilities']) if t.get('vulnerabilities') else 0,
+    )
+
+    return out
+
+# Info about configuration backup files.
+def config_backup_info(doc):
+    backups = doc.get('config_backups')
+    if not backups:
+        return "(none)\n"
+
+    return "**THERE IS CONTENT IN THIS BUT PARSING IS NOT COMPLETE. PLEASE IMPLEMENT AND RE-RUN.**\n"
+
+# Info about database export files.
+def db_export_info(doc):
+    exports = doc.get('db_exports')
+    if not exports:
+        return "(none)\n"
+
+    return "**THERE IS CONTENT IN THIS BUT PARSING IS NOT COMPLETE. PLEASE IMPLEMENT AND RE-RUN.**\n"
+
+# Info about media??
+def media_info(doc):
+    medias = doc.get('medias')
+    if not medias:
+        return "(none)\n"
+
+    return "**THERE IS CONTENT IN THIS BUT PARSING IS NOT COMPLETE. PLEASE IMPLEMENT AND RE-RUN.**\n"
+
+# Info about user accounts.
+def user_info(doc):
+    users = doc.get('users')
+    if not users:
+        return "(none)\n"
+
+    confirms = {} # maps confirmation name to a URL of an interesting entry
+    usernames = []
+
+    for username, data in users.items():
+        usernames.append(username)
+        for method, mdata in data.get("confirmed_by", {}).items():
+            if method in confirms:
+                val = confirms[method]
+                # if the method value in confirms is not empty, skip method since we are done.
+                if val != '':
+                    continue
+                for entry in mdata.get("interesting_entries", []):
+                    # if we find a non-empty values, update the method value in confirms.
+                    if entry != '':
+                        confirms[method] = entry
+            else:
+                val = ''
+                for entry in mdata.get("interesting_entries", []):
+                    if entry != '':
+                        val = entry
+                confirms[method] = val
+
+    out = ''
+    for un in usernames:
+        out += '- `%s`\n' % un
+
+    if len(confirms) > 0:
+        out += '\nWe identified the above user accounts with the following methods:\n\n'
+        for confirm, evidence in confirms.items():
+            out += '- %s' % confirm.replace(' (Aggressive Detection)', '')
+            if evidence != '':
+                out += ': [example URL](%s)' % evidence
+            out += '\n'
+
+    return out
+
+
+
+def evidence(doc, resolver):
+    out = ""
+
+    out += "**WordPress Version Info:**\n\n"
+    out += version_info(doc)
+    out +=  "\n"
+
+    out += "**Plugins:**\n\n"
+    out += plugin_info(doc, resolver)
+    out +=  "\n"
+
+    out += "**Themes:**\n\n"
+    out += theme_info(doc)
+    out +=  "\n"
+
+    out += "**Configuration Backups:**\n\n"
+    out += config_backup_info(doc)
+    out +=  "\n"
+
+    out += "**Database Exports:**\n\n"
+    out += db_export_info(doc)
+    out +=  "\n"
+
+    out += "**Media:**\n\n"
+    out += media_info(doc)
+    out +=  "\n"
+
+    out += "**Users:**\n\n"
+    out += user_info(doc)
+    out +=  "\n"
+
+    return out
+
+
+
+
+def parse(project_id, wpscan_json_file, resolver, in_scope=None):
+    """Parses a WPScan file and returns a project dictionary
+
+    :param project: The project id
+    :param wpscan_json_file: The WPScan json file to be parsed
+    :param resolver: CVEResolver looking up the CVEs of the vulnerabilities
+    :param in_scope: Optional Scope; an out-of-scope target is not imported,
+                     the project returned has no hosts or vulnerabilities
+    """
+
+    with helper.open_resource(wpscan_json_file) as file:
+        doc = json.load(file)
+
+    # Create the project dictionary which acts as foundation of document
+    project = dict(models.project_model)
+    project['commands'] = list()
+    project['vulnerabilities'] = list()
+    project['project_id'] = project_id
+
+    # Temp dicts used to ensure no duplicate hosts or ports are added
+    temp_vulns = dict()
+    temp_hosts = list()
+
+    command = dict(models.command_model)
+    command['tool'] = TOOL
+    command['command'] = 'wpscan'
+    project['commands'].append(command)
+
+    # An out-of-scope target is not imported, only the command is recorded
+    if in_scope is not None and doc['target_ip'] not in in_scope:
+        print 'target %s is out of scope' % doc['target_ip']
+        project['hosts'] = list()
+        return project
+
+    v = dict(models.vulnerability_model)
+    v['cves'] = list()
+    v['plugin_ids'] = list()
+    v['identified_by'] = list()
+    v['hosts'] = list()
+    v['notes'] = list()
+
+    v['title'] = 'WordPress Reconnaissance'
+    v['description'] = "As one of the world's most high-profile open-source software projects, WordPress has been a natural target for ongoing security exploits ever since it arrived on the scene. Vulnerabilities can come from a number of sources, including directly through the WordPress project via inadvertent bugs and regressions in their released versions. The WordPress ecosystem can also introduce buggy and vulnerable software through themes and plugins that site maintainers may choose to install. Finally, the site administrator can introduce weaknesses by delaying upgrading to the latest secure version of WordPress, exposing configuration backups and database exports, leaking sensitive media, or otherwise introducing [security misconfigurations](https://owasp.org/www-project-top-ten/2017/A6_2017-Security_Misconfiguration)."
+
+    # Look up every plugin CVE at once so they are fetched concurrently
+    cve_ids = []
+    for p in (doc.get('plugins') or {}).values():
+        for pv in p.get('vulnerabilities', []):
+            for cve in pv['references'].get('cve', []):
+                cve_ids.append("CVE-%s" % cve)
+    resolver.resolve(cve_ids)
+
+    v['evidence'] = evidence(doc, resolver)
+
+    v['solution'] = 'This finding is informational only. If there are vulnerabilities related to any of the Reconnaissance discoveries presented here, there is another finding in the report. But as always, ensure WordPress and add-ons are running the latest patched versions.'
+    # v['tags'] = ['cat:network']
+
+    v['cves'] = CVES
+    v['cvss'] = CVSS
+
+
+    # Set plugin
+    plugin_id = 'wpscan-sum' + doc['version']['number']
+    plugin = dict(models.plugin_id_model)
+    plugin['tool'] = TOOL
+    plugin['id'] = 'wpscan-sum' + doc['version']['number']
+    v['plugin_ids'].append(plugin)
+
+    # Set identified by information
+    identified = dict(models.identified_by_model)
+    identified['tool'] = TOOL
+    identified['id'] = plugin_id
+    v['identified_by'].append(identified)
+
+    # Parse url to get port and hostname
+    url = urlparse(doc['target_url'])
+    port = 80
+    if url.port:
+        port = url.port
+    elif url.scheme == 'https':
+        port = 443
+
+    # Associate host with vuln
+    host_key_dict = dict(models.host_key_model)
+    host_key_dict['string_addr'] = doc['target_ip']
+    host_key_dict['port'] = port
+    v['hosts'].append(host_key_dict)
+    tag = 'dhostname:%s->%s:%s/tcp' % (url.hostname, doc['target_ip'], port)
+    v['tags'] = [tag]
+
+    # Create host
+    host = dict(models.host_model)
+    host['os'] = list() # no OS
+    host['ports'] = list()
+    host['hostnames'] = list()
+
+    host['string_addr'] = doc['target_ip']
+    host['long_addr'] = helper.ip2long(doc['target_ip'])
+
+    if url.hostname:
+        host['hostnames'].append(url.hostname)
+
+    # Create port and associate with host
+    port_dict = dict(models.port_model)
+    port_dict['port'] = port
+    port_dict['protocol'] = models.PROTOCOL_TCP
+    port_dict['service'] = url.scheme
+    host['ports'].append(port_dict)
+
+    # Don't set an OS
+    os_dict = dict(models.os_model)
+    os_dict['tool'] = TOOL
+    host['os'].append(os_dict)
+
+    project['vulnerabilities'] = [v]
+    project['hosts'] = [host]
+
+    return project
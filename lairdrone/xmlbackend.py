@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+
+# XML implementations in order of preference. The first one available is
+# used unless LAIR_XML_BACKEND names another, e.g. for benchmarking.
+BACKENDS = ('lxml', 'cElementTree', 'ElementTree')
+
+# Name of the backend in use
+NAME = None
+
+# Functions and parse error of the backend in use, with the ElementTree
+# signatures
+parse = None
+iterparse = None
+fromstring = None
+ParseError = None
+
+
+def _load(name):
+    if name == 'lxml':
+        from lxml import etree
+
+        # Behave like ElementTree: no comment or processing instruction
+        # nodes, and no entity expansion
+        options = {
+            'remove_comments': True,
+            'remove_pis': True,
+            'resolve_entities': False,
+            'huge_tree': True,
+        }
+        parser = etree.XMLParser(**options)
+
+        def lxml_parse(source):
+            return etree.parse(source, parser)
+
+        def lxml_iterparse(source, events=('end',)):
+            return etree.iterparse(source, events=events, **options)
+
+        def lxml_fromstring(text):
+            return etree.fromstring(text, parser)
+
+        return lxml_parse, lxml_iterparse, lxml_fromstring, etree.ParseError
+
+    if name == 'cElementTree':
+        import xml.etree.cElementTree as etree
+    elif name == 'ElementTree':
+        import xml.etree.ElementTree as etree
+    else:
+        raise ValueError("Unknown XML backend '%s', expected one of: %s" %
+                         (name, ', '.join(BACKENDS)))
+
+    return etree.parse, etree.iterparse, etree.fromstring, etree.ParseError
+
+
+def use(name=None):
+    """Selects the XML backend used by all parsers
+
+    :param name: One of BACKENDS. Default is the first one available
+    :return: The name of the backend selected
+    """
+    global NAME, parse, iterparse, fromstring, ParseError
+
+    for candidate in [name] if name else BACKENDS:
+        try:
+            parse, iterparse, fromstring, ParseError = _load(candidate)
+        except ImportError:
+            if name:
+                raise
+            continue
+        NAME = candidate
+        return NAME
+
+
+class Releaser(object):
+    """Frees the elements of a document read with iterparse once they have
+    been processed, so memory stays bounded.
+
+    An element is cleared straight away but only detached from its parent
+    when the next element is released. lxml may still append the text that
+    follows an element to it while it is the last element parsed.
+    """
+
+    def __init__(self):
+        self.last = None
+
+    def release(self, parent, elem):
+        """Frees a processed element
+
+        :param parent: The parent of the element, None for the root
+        :param elem: The element
+        """
+        if self.last is not None:
+            last_parent, last_elem = self.last
+            try:
+                last_parent.remove(last_elem)
+            except ValueError:
+                # Already removed along with a cleared ancestor
+                pass
+        elem.clear()
+        self.last = (parent, elem) if parent is not None else None
+
+
+use(os.environ.get('LAIR_XML_BACKEND') or None)
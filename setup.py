@@ -6,12 +6,12 @@ setup(
     author='Dan Kottmann, Tom Steele',
     author_email='dan.kottmann@fishnetsecurity.com, thomas.steele@fishnetsecurity.com',
     packages=['lairdrone'],
-    scripts=['bin/drone-nmap', 'bin/drone-nessus', 'bin/drone-nexpose', 'bin/drone-burp', 'bin/drone-raw', 'bin/drone-dirb', 'bin/drone-wpscan', 'bin/drone-wpscan-sum'],
+    scripts=['bin/drone', 'bin/drone-nmap', 'bin/drone-nessus', 'bin/drone-nexpose', 'bin/drone-burp', 'bin/drone-db', 'bin/drone-raw', 'bin/drone-dirb', 'bin/drone-export', 'bin/drone-wpscan', 'bin/drone-wpscan-sum', 'bin/drone-watch'],
     url='https://github.com/fishnetsecurity/lair',
     license='LICENSE.txt',
     description='Packages and scripts for use with Lair',
     install_requires=[
-        "pymongo >= 3.0",
+        "pymongo >= 3.7",
     ],
 
 )
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import unittest
+from lairdrone import api
+
+
+class FakeCollection(object):
+
+    def __init__(self):
+        self.documents = list()
+
+    def insert_many(self, documents, ordered=True):
+        self.documents.extend(documents)
+
+
+class FakeDB(object):
+
+    def __init__(self):
+        self.drone_log = FakeCollection()
+
+
+class WriteDroneLogTest(unittest.TestCase):
+
+    def test_non_ascii_entries(self):
+        # Project ids are unicode when read from the database, vulnerability
+        # entries are UTF-8 encoded
+        db = FakeDB()
+        entries = [u'2020 - New vulnerability found: Caf\xe9'.encode('utf-8'),
+                   u'2020 - New vulnerability found: \u2603']
+        api.write_drone_log(db, u'P\xe9', entries)
+        self.assertEqual([d['entry'] for d in db.drone_log.documents], entries)
+        self.assertEqual(len(set(d['_id'] for d in db.drone_log.documents)), 2)
+
+    def test_identical_entries_are_kept(self):
+        db = FakeDB()
+        entry = '2020 - 10.0.0.1:80/tcp - New vulnerability found: X'
+        api.write_drone_log(db, u'P1', [entry, entry])
+        api.write_drone_log(db, u'P1', [entry])
+        self.assertEqual(len(set(d['_id'] for d in db.drone_log.documents)), 3)
+        self.assertEqual([d['seq'] for d in db.drone_log.documents], [0, 1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
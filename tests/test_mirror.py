@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+import shutil
+import tempfile
+import unittest
+from lairdrone import mirror
+
+
+class FakeCollection(object):
+
+    def __init__(self):
+        self.documents = dict()
+
+    def find(self, q, projection=None):
+        found = list()
+        for document in self.documents.values():
+            if 'project_id' in q and document['project_id'] != q['project_id']:
+                continue
+            if '_id' in q and document['_id'] not in q['_id']['$in']:
+                continue
+            found.append(dict(document))
+        return found
+
+
+class FakeDB(dict):
+
+    def __init__(self):
+        for name in ('hosts', 'ports', 'vulnerabilities'):
+            self[name] = FakeCollection()
+
+    def add(self, collection, _id, **fields):
+        fields['_id'] = _id
+        fields['project_id'] = 'p'
+        self[collection].documents[_id] = fields
+
+
+def _vuln(*ids):
+    return {'plugin_ids': [{'tool': 'nessus', 'id': i} for i in ids]}
+
+
+class MirrorRefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'p.json')
+        self.db = FakeDB()
+        # Random string ids, as created by the Lair UI, and ObjectId ones
+        self.db.add('hosts', '2kDpvRQxWn6sJmZ4a', string_addr='10.0.0.1')
+        self.db.add('hosts', '5f1c2e0e8b3a4d0001a1b2c3', string_addr='10.0.0.2')
+        self.db.add('ports', '2aaa', host_id='2kDpvRQxWn6sJmZ4a', port=80,
+                    protocol='tcp')
+        self.db.add('ports', '2bbb', host_id='5f1c2e0e8b3a4d0001a1b2c3',
+                    port=443, protocol='tcp')
+        self.db.add('vulnerabilities', '2vvv', **_vuln('A', 'B'))
+
+        m = mirror.Mirror(self.path, 'p')
+        self.assertEqual(m.refresh(self.db), 5)
+        for address in ('10.0.0.1', '10.0.0.2'):
+            m.imported_host({'string_addr': address}, 'digest')
+        m.imported_vulnerability(_vuln('A', 'B'), 'digest')
+        m.save()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_unchanged(self):
+        m = mirror.Mirror(self.path, 'p')
+        self.assertEqual(m.refresh(self.db), 0)
+        self.assertTrue(m.unchanged_host({'string_addr': '10.0.0.1'}, 'digest'))
+        self.assertTrue(m.unchanged_vulnerability(_vuln('A', 'B'), 'digest'))
+
+    def test_deleted_and_added(self):
+        # The counts stay the same
+        del self.db['hosts'].documents['2kDpvRQxWn6sJmZ4a']
+        del self.db['ports'].documents['2aaa']
+        self.db.add('hosts', '3new', string_addr='10.0.0.3')
+        self.db.add('ports', '3port', host_id='3new', port=80, protocol='tcp')
+        del self.db['vulnerabilities'].documents['2vvv']
+        self.db.add('vulnerabilities', '3vvv', **_vuln('C'))
+
+        m = mirror.Mirror(self.path, 'p')
+        self.assertEqual(m.refresh(self.db), 3)
+        self.assertFalse(m.unchanged_host({'string_addr': '10.0.0.1'}, 'digest'))
+        self.assertTrue(m.unchanged_host({'string_addr': '10.0.0.2'}, 'digest'))
+        self.assertFalse(m.unchanged_vulnerability(_vuln('A', 'B'), 'digest'))
+        self.assertEqual(sorted(m.keys['hosts']), ['10.0.0.2', '10.0.0.3'])
+        self.assertEqual(m.candidates(_vuln('C')['plugin_ids']), set(['3vvv']))
+
+    def test_deleted_port(self):
+        # A host's digest covers its ports
+        del self.db['ports'].documents['2bbb']
+        m = mirror.Mirror(self.path, 'p')
+        self.assertEqual(m.refresh(self.db), 0)
+        self.assertTrue(m.unchanged_host({'string_addr': '10.0.0.1'}, 'digest'))
+        self.assertFalse(m.unchanged_host({'string_addr': '10.0.0.2'}, 'digest'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+import shutil
+import tempfile
+import unittest
+from lairdrone import nessus
+
+# Hosts of the report, the second one with many more items than the others
+# so that an even split of the file falls inside it
+HOST_ITEMS = [3, 40, 3, 3, 3, 3]
+
+
+def _item(plugin_id, port, severity, output, cvss=None, protocol='tcp',
+          service='www', title=None):
+    score = '<cvss_base_score>{0}</cvss_base_score>'.format(cvss) \
+        if cvss is not None else ''
+    return ('<ReportItem port="{0}" svc_name="{1}" protocol="{2}" '
+            'severity="{3}" pluginID="{4}" pluginName="{5}" '
+            'pluginFamily="General"><description>Found {4}</description>'
+            '{6}<plugin_output>{7}</plugin_output></ReportItem>\n').format(
+        port, service, protocol, severity, plugin_id,
+        title or 'Plugin {0}'.format(plugin_id), score, output)
+
+
+def _host(n, items):
+    lines = [
+        '<ReportHost name="{0}"><HostProperties>\n'.format(
+            'host{0}.example.com'.format(n) if n % 2 else '10.0.0.{0}'.format(n)),
+        '<tag name="host-ip">10.0.0.{0}</tag>\n'.format(n),
+        '<tag name="operating-system">Linux {0}</tag>\n'.format(n),
+        '</HostProperties>\n',
+    ]
+    if n == 1:
+        lines.append(_item('19506', 0, 0, 'scan info here', service='general',
+                           title='Nessus Scan Information'))
+    # Kept on the first host, informational where another chunk sees it
+    # first, so that chunk is read again with the plugin forced
+    lines.append(_item('100', 443, 0 if n > 2 else 2, 'output {0}'.format(n),
+                       cvss=None if n > 2 else 5.0))
+    # Never kept
+    lines.append(_item('200', 80, 0, 'informational'))
+    # Dropped as a false positive UDP service
+    lines.append(_item('300', 161, 3, 'udp', cvss=7.5, protocol='udp',
+                       service='snmp?'))
+    for i in range(items):
+        lines.append(_item(str(1000 + i % 7), 22 + i % 3, 3,
+                           'shared output {0}\n\n  line {1}'.format(i % 2, n),
+                           cvss=6.8))
+    lines.append('</ReportHost>\n')
+    return ''.join(lines)
+
+
+def _report():
+    hosts = ''.join(_host(n + 1, items) for n, items in enumerate(HOST_ITEMS))
+    return ('<?xml version="1.0" ?>\n<NessusClientData_v2>'
+            '<Report name="split">\n' + hosts + '</Report>\n'
+            '</NessusClientData_v2>\n')
+
+
+class ParallelParseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'split.nessus')
+        with open(self.path, 'wb') as fh:
+            fh.write(_report())
+
+        # Paranoid plugins are looked up on tenable.com
+        self.is_paranoid = nessus.is_paranoid
+        self.min_size = nessus.PARALLEL_MIN_SIZE
+        nessus.is_paranoid = lambda plugin_id: plugin_id == '1003'
+        nessus.PARALLEL_MIN_SIZE = 0
+
+    def tearDown(self):
+        nessus.is_paranoid = self.is_paranoid
+        nessus.PARALLEL_MIN_SIZE = self.min_size
+        shutil.rmtree(self.directory)
+
+    def test_split_at_host_boundaries(self):
+        with open(self.path, 'rb') as fh:
+            data = fh.read()
+        hosts = [i for i in range(len(data))
+                 if data.startswith('<ReportHost', i)]
+        large = (hosts[1], hosts[2])
+
+        count = 4
+        prefix, suffix, spans = nessus.split_report_hosts(self.path, count)
+        size = data.rfind('</Report>') - hosts[0]
+        boundaries = [hosts[0] + size * i // count for i in range(1, count)]
+
+        # An even split would cut the large host, the chunks do not
+        self.assertTrue(any(large[0] < b < large[1] for b in boundaries))
+        self.assertTrue(len(spans) > 1)
+        for start, end in spans:
+            self.assertIn(start, hosts)
+            self.assertFalse(large[0] < start < large[1])
+        self.assertEqual(spans[0][0], hosts[0])
+        self.assertEqual(spans[-1][1], data.rfind('</Report>'))
+
+    def test_same_result_as_single_pass(self):
+        for include_informational in (False, True):
+            single = nessus.parse('p', self.path, include_informational,
+                                  workers=1)
+            parallel = nessus.parse('p', self.path, include_informational,
+                                    workers=2)
+            self.assertEqual(len(single['hosts']), len(HOST_ITEMS))
+            self.assertEqual(parallel, single)
+
+
+if __name__ == '__main__':
+    unittest.main()
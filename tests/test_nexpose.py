@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+import unittest
+from lairdrone import nexpose
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'fixtures', 'sample_nexpose.xml')
+
+
+def _definitions_first():
+    # The same report with the vulnerability definitions before the nodes
+    # referencing them
+    with open(FIXTURE, 'rb') as fh:
+        data = fh.read()
+    nodes_start = data.index('<nodes>')
+    definitions_start = data.index('<VulnerabilityDefinitions>')
+    definitions_end = data.index('</NexposeReport>')
+    return (data[:nodes_start] +
+            data[definitions_start:definitions_end] +
+            data[nodes_start:definitions_start] + data[definitions_end:])
+
+
+def _sorted(project):
+    # Vulnerabilities come out in the order of a dictionary
+    project['vulnerabilities'].sort(
+        key=lambda v: json.dumps(v['plugin_ids'], sort_keys=True))
+    return project
+
+
+class RereadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'report.xml')
+        with open(self.path, 'wb') as fh:
+            fh.write(_definitions_first())
+        self.expected = _sorted(nexpose.parse('p', FIXTURE, True))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_path(self):
+        self.assertEqual(nexpose.start_offset(self.path), 0)
+        self.assertEqual(_sorted(nexpose.parse('p', self.path, True)),
+                         self.expected)
+
+    def test_seekable_file(self):
+        with open(self.path, 'rb') as fh:
+            self.assertEqual(nexpose.start_offset(fh), 0)
+            self.assertEqual(_sorted(nexpose.parse('p', fh, True)),
+                             self.expected)
+
+    def test_pipe(self):
+        process = subprocess.Popen(['cat', self.path], stdout=subprocess.PIPE)
+        try:
+            self.assertEqual(nexpose.start_offset(process.stdout), None)
+            self.assertEqual(_sorted(nexpose.parse('p', process.stdout, True)),
+                             self.expected)
+        finally:
+            process.stdout.close()
+            process.wait()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+# Run from the top of the repository with:
+#   python -m unittest discover -s tests
+
+import unittest
+from lairdrone import api
+
+
+def _vuln(*ids):
+    return {'plugin_ids': [{'tool': 'nessus', 'id': i} for i in ids]}
+
+
+class FakeCollection(object):
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = list()
+
+    def find(self, q, projection=None):
+        self.queries.append(q)
+        ids = q['plugin_ids.id']['$in']
+        return [document for document in self.documents
+                if document['project_id'] == q['project_id'] and
+                any(plugin['id'] in ids for plugin in document['plugin_ids'])]
+
+
+class FakeDB(object):
+
+    def __init__(self, vulnerabilities):
+        self.vulnerabilities = FakeCollection(vulnerabilities)
+
+
+def _stored(_id, *ids, **kwargs):
+    document = _vuln(*ids)
+    document['_id'] = _id
+    document['project_id'] = kwargs.get('project_id', 'p')
+    return document
+
+
+def _partition_of(partitions, index):
+    for n, partition in enumerate(partitions):
+        if index in partition:
+            return n
+
+
+class PartitionVulnerabilitiesTest(unittest.TestCase):
+
+    def test_shared_plugin_id(self):
+        vulns = [_vuln('A'), _vuln('B'), _vuln('A', 'C'), _vuln('D')]
+        partitions = api.partition_vulnerabilities(vulns, range(4), 4)
+        self.assertEqual(_partition_of(partitions, 0), _partition_of(partitions, 2))
+        self.assertEqual(sorted(sum(partitions, [])), range(4))
+
+    def test_same_stored_vulnerability(self):
+        # [A] and [B] are both merged with the stored [A, B]
+        vulns = [_vuln('A'), _vuln('B'), _vuln('C')]
+        db = FakeDB([_stored('v1', 'A', 'B'), _stored('v2', 'C')])
+        stored = api.stored_vulnerability_ids(db, 'p', vulns, range(3))
+        self.assertEqual(stored, {0: set(['v1']), 1: set(['v1']), 2: set(['v2'])})
+        self.assertEqual(len(db.vulnerabilities.queries), 1)
+
+        partitions = api.partition_vulnerabilities(vulns, range(3), 3, stored)
+        self.assertEqual(len(partitions), 2)
+        self.assertEqual(_partition_of(partitions, 0), _partition_of(partitions, 1))
+        self.assertNotEqual(_partition_of(partitions, 0), _partition_of(partitions, 2))
+
+    def test_stored_ids_need_every_plugin_id(self):
+        vulns = [_vuln('A', 'C'), _vuln('A'), _vuln('E')]
+        db = FakeDB([_stored('v1', 'A', 'B'), _stored('v2', 'C'),
+                     _stored('v3', 'A', project_id='other')])
+        stored = api.stored_vulnerability_ids(db, 'p', vulns, range(3))
+        self.assertEqual(stored, {0: set(), 1: set(['v1']), 2: set()})
+
+    def test_partitions_are_in_document_order(self):
+        vulns = [_vuln('A'), _vuln('B'), _vuln('A'), _vuln('B')]
+        stored = {0: set(['v1']), 1: set(['v1']), 2: set(['v1']), 3: set(['v1'])}
+        partitions = api.partition_vulnerabilities(vulns, range(4), 2, stored)
+        self.assertEqual(partitions, [[0, 1, 2, 3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import re
+import unittest
+from lairdrone import burp
+
+# The single regex process_retirejs matched details with before
+# burp.parse_retirejs_detail. Its nested (.*\n)+ group backtracks on long
+# details, so it is only kept here as the reference the parser is checked
+# against.
+RETIREJS_DETAIL = re.compile(r'The library <b>(?P<library>[^<]+)</b> version <b>(?P<version>[^<]+)</b>.*\n.*\n.*\n.*\n<ul>\n(?P<urls>(.*\n)+)</ul>\n.*\n.*\n.*\nThe vulnerability is affecting all versions prior <b>(?P<before>[^<]+)</b> \(between <b>(?P<from>[^<]+)</b> and <b>(?P<to>[^<]+)</b>\)')
+RETIREJS_HREF = re.compile('href="([^"]+)"')
+
+
+def retirejs_reference(detail):
+    # Extracts a retire.js detail the way process_retirejs used to
+    m = RETIREJS_DETAIL.search(detail)
+    if m is None:
+        return None
+    details = m.groupdict()
+    urls = details.pop('urls')
+    details['urls'] = list()
+    for token in urls.split():
+        href = RETIREJS_HREF.search(token)
+        if href is not None:
+            details['urls'].append(href.group(1))
+    return details
+
+
+def _library(name, version, disclosures, nested=0, affected=True):
+    # Lines of one library in a Burp retire.js issue detail
+    lines = [
+        'The library <b>%s</b> version <b>%s</b> has known security issues.' % (name, version),
+        'For more information, visit those websites:',
+        '',
+        '<br>',
+        '<ul>',
+    ]
+    for n in range(disclosures):
+        lines.append('<li><a href="https://example.com/%s/%d">https://example.com/%s/%d</a></li>' %
+                     (name, n, name, n))
+        # Lists inside the disclosure list, each closed on its own line
+        if nested and n % nested == 0:
+            lines.extend(['<ul>', '<li>note %d</li>' % n, '</ul>'])
+    lines.append('</ul>')
+    if affected:
+        lines.extend([
+            '<br>',
+            '<p>',
+            '<br>',
+            'The vulnerability is affecting all versions prior <b>%s.9</b> (between <b>*</b> and <b>%s.8</b>)' %
+            (version, version),
+        ])
+    return lines
+
+
+def retirejs_inputs(size):
+    # (name, detail) of about size lines: long and nested disclosure lists
+    # and many libraries, which the parser must read like the old regex
+    # did, and the details the regex stalled on. When no library is
+    # followed by its affected versions, the regex tries every split of the
+    # rest of the detail from each library line, so its time grows with
+    # the square of the size.
+    many = list()
+    unaffected = list()
+    for n in range(max(1, size // 17)):
+        many.extend(_library('lib%d' % n, '%d.0' % n, 8))
+        unaffected.extend(_library('lib%d' % n, '%d.0' % n, 12, affected=False))
+
+    inputs = [
+        ('long list', _library('jquery', '1.8', size)),
+        ('nested lists', _library('jquery', '1.8', size // 4, nested=1)),
+        ('many libraries', many),
+        ('libraries without affected versions', unaffected),
+        ('unmatched closes', _library('jquery', '1.8', 1, affected=False) +
+         ['</ul>', '<br>'] * (size // 2)),
+    ]
+    return [(name, '\n'.join(lines)) for name, lines in inputs]
+
+
+class RetireJSDetailTest(unittest.TestCase):
+
+    def test_same_as_regex(self):
+        for name, detail in retirejs_inputs(2000):
+            expected = retirejs_reference(detail)
+            self.assertEqual(burp._extract_retirejs_detail(detail), expected, name)
+
+    def test_regex_matches_some_inputs(self):
+        # The comparison is only meaningful if both outcomes are covered
+        results = [retirejs_reference(detail)
+                   for name, detail in retirejs_inputs(200)]
+        self.assertTrue(any(result is None for result in results))
+        self.assertTrue(any(result is not None for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
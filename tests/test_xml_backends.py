@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Tom Steele, Dan Kottmann, FishNet Security
+# See the file license.txt for copying permission
+
+import os
+import unittest
+from lairdrone import burp, nessus, nexpose, nmap, xmlbackend
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Parsers of the fixture scans
+SCANS = [
+    ('nmap', lambda path: nmap.parse_xml('p', path), 'sample_nmap.xml'),
+    ('nessus', lambda path: nessus.parse('p', path, True), 'sample.nessus'),
+    ('nexpose', lambda path: nexpose.parse('p', path, True), 'sample_nexpose.xml'),
+    ('burp', lambda path: burp.parse('p', path, True), 'sample_burp.xml'),
+]
+
+
+class XMLBackendsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = xmlbackend.NAME
+        # Paranoid plugins are looked up on tenable.com
+        self.is_paranoid = nessus.is_paranoid
+        nessus.is_paranoid = lambda plugin_id: int(plugin_id) % 7 == 0
+
+    def tearDown(self):
+        xmlbackend.use(self.backend)
+        nessus.is_paranoid = self.is_paranoid
+
+    def test_backends_parse_the_same(self):
+        installed = list()
+        for name in xmlbackend.BACKENDS:
+            try:
+                xmlbackend.use(name)
+            except ImportError:
+                continue
+            installed.append(name)
+        if len(installed) < 2:
+            self.skipTest('only {0} is installed'.format(', '.join(installed)))
+
+        for tool, parse, fixture in SCANS:
+            path = os.path.join(FIXTURES, fixture)
+            results = list()
+            for name in installed:
+                xmlbackend.use(name)
+                results.append((name, parse(path)))
+
+            first, expected = results[0]
+            self.assertTrue(expected['hosts'], tool)
+            for name, result in results[1:]:
+                self.assertEqual(result, expected, '{0}: {1} differs from {2}'.format(
+                    tool, name, first))
+
+
+if __name__ == '__main__':
+    unittest.main()